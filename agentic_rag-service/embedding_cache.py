@@ -0,0 +1,227 @@
+"""
+Caché de embeddings en dos niveles
+Memoria LRU acotada + almacén float32 en disco (memory-mapped) que sobrevive a reinicios
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Sin flock (Windows): un único proceso por directorio
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """
+    Caché de embeddings indexada por modelo + hash del texto
+
+    El nivel en disco guarda dos ficheros append-only por modelo:
+    `keys.txt` (una clave por línea) y `vectors.f32` (una fila float32 por clave,
+    en el mismo orden). Las lecturas usan np.memmap, así que abrir la caché
+    no carga los vectores en memoria.
+
+    Varios procesos del mismo host pueden compartir el directorio: la carga y
+    cada append se hacen bajo un `flock` exclusivo sobre `lock`, y antes de
+    escribir se incorporan las filas añadidas por otros procesos. Si al cargar
+    el número de filas no coincide con el de claves, el nivel se vacía.
+    """
+
+    def __init__(self, model_name: str, max_memory_items: int = 10000, cache_dir: Optional[str] = None):
+        self.model_name = model_name
+        self.max_memory_items = max_memory_items
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0
+        }
+
+        # Nivel en disco (opcional)
+        self._disk_dir: Optional[Path] = None
+        self._disk_index: Dict[str, int] = {}
+        self._disk_dim: Optional[int] = None
+        self._disk_map: Optional[np.memmap] = None
+        if cache_dir:
+            model_slug = model_name.replace('/', '__')
+            self._disk_dir = Path(cache_dir) / model_slug
+            self._load_disk_index()
+
+    def _key(self, text: str) -> str:
+        """Clave estable: hash del modelo y del texto"""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    # === NIVEL EN DISCO ===
+
+    @property
+    def _keys_path(self) -> Path:
+        return self._disk_dir / "keys.txt"
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self._disk_dir / "vectors.f32"
+
+    @property
+    def _dim_path(self) -> Path:
+        return self._disk_dir / "dim.txt"
+
+    @property
+    def _lock_path(self) -> Path:
+        return self._disk_dir / "lock"
+
+    @contextmanager
+    def _disk_lock(self):
+        """Exclusión entre procesos que comparten el directorio (flock)"""
+        with open(self._lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _load_disk_index(self):
+        """Cargar el índice clave -> fila del almacén en disco"""
+        try:
+            self._disk_dir.mkdir(parents=True, exist_ok=True)
+            with self._disk_lock():
+                self._read_disk_index()
+            if self._disk_index:
+                logger.info(f"Caché de embeddings en disco: {len(self._disk_index)} vectores en {self._disk_dir}")
+
+        except Exception as e:
+            logger.error(f"Error cargando caché de embeddings en disco, se desactiva: {e}")
+            self._disk_dir = None
+            self._disk_index = {}
+
+    def _read_disk_index(self):
+        """Leer claves y filas del disco (con el lock tomado) y comprobar que coinciden"""
+        if not self._dim_path.exists():
+            return
+
+        self._disk_dim = int(self._dim_path.read_text().strip())
+        keys = self._keys_path.read_text().split() if self._keys_path.exists() else []
+
+        row_bytes = 4 * self._disk_dim
+        size = self._vectors_size()
+        rows = size // row_bytes
+        if rows != len(keys):
+            # Claves y filas desalineadas: ningún vector es fiable. Se sustituyen los
+            # ficheros en vez de truncarlos para no invalidar memmaps abiertos
+            logger.warning(f"Caché de embeddings en disco inconsistente ({len(keys)} claves, {rows} filas), se vacía")
+            for path in (self._vectors_path, self._keys_path):
+                tmp_path = path.with_name(path.name + ".tmp")
+                tmp_path.write_bytes(b'')
+                os.replace(tmp_path, path)
+            keys = []
+        elif size != rows * row_bytes:
+            # Bytes sueltos tras la última fila completa: se descartan
+            with open(self._vectors_path, 'r+b') as f:
+                f.truncate(rows * row_bytes)
+        self._disk_index = {key: row for row, key in enumerate(keys)}
+        self._disk_map = None
+
+    def _vectors_size(self) -> int:
+        return self._vectors_path.stat().st_size if self._vectors_path.exists() else 0
+
+    def _disk_get(self, key: str) -> Optional[np.ndarray]:
+        row = self._disk_index.get(key)
+        if row is None:
+            return None
+
+        # Reabrir el mapa si se ha quedado corto tras nuevas escrituras
+        if self._disk_map is None or row >= self._disk_map.shape[0]:
+            self._disk_map = np.memmap(
+                self._vectors_path, dtype=np.float32, mode='r',
+                shape=(len(self._disk_index), self._disk_dim)
+            )
+        return np.array(self._disk_map[row])
+
+    def _disk_put_many(self, keys: List[str], vectors: np.ndarray):
+        if self._disk_dir is None:
+            return
+
+        try:
+            with self._disk_lock():
+                # Incorporar las filas que otros procesos hayan añadido desde la última lectura
+                if not self._dim_path.exists():
+                    self._disk_dim = int(vectors.shape[1])
+                    self._dim_path.write_text(str(self._disk_dim))
+                elif self._disk_dim is None or self._vectors_size() != len(self._disk_index) * 4 * self._disk_dim:
+                    self._read_disk_index()
+
+                if vectors.shape[1] != self._disk_dim:
+                    logger.warning(f"Dimensión de embedding inesperada ({vectors.shape[1]} != {self._disk_dim}), no se persiste")
+                    return
+
+                new_rows = {key: vector for key, vector in zip(keys, vectors) if key not in self._disk_index}
+                if not new_rows:
+                    return
+
+                # Primero los vectores y después las claves: una clave nunca apunta a una fila incompleta
+                with open(self._vectors_path, 'ab') as f:
+                    f.write(np.ascontiguousarray(list(new_rows.values()), dtype=np.float32).tobytes())
+                with open(self._keys_path, 'a') as f:
+                    f.write(''.join(f"{key}\n" for key in new_rows))
+
+                for key in new_rows:
+                    self._disk_index[key] = len(self._disk_index)
+
+        except Exception as e:
+            logger.error(f"Error escribiendo caché de embeddings en disco: {e}")
+
+    # === API PÚBLICA ===
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Devolver el embedding cacheado de cada texto, o None si no está"""
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self._key(text)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.stats_counters['memory_hits'] += 1
+                elif self._disk_dir is not None and (vector := self._disk_get(key)) is not None:
+                    self._memory_put(key, vector)
+                    self.stats_counters['disk_hits'] += 1
+                else:
+                    self.stats_counters['misses'] += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        """Guardar embeddings recién calculados en ambos niveles"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._memory_put(key, vector)
+            self._disk_put_many(keys, vectors)
+
+    def _memory_put(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de aciertos/fallos y tamaño de cada nivel"""
+        with self._lock:
+            lookups = sum(self.stats_counters.values())
+            hits = self.stats_counters['memory_hits'] + self.stats_counters['disk_hits']
+            return {
+                **self.stats_counters,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'memory_items': len(self._memory),
+                'memory_capacity': self.max_memory_items,
+                'disk_enabled': self._disk_dir is not None,
+                'disk_items': len(self._disk_index)
+            }
@@ -0,0 +1,107 @@
+"""
+Executor dedicado para la inferencia de embeddings
+Saca SentenceTransformer.encode del event loop con un pool acotado de hilos o procesos
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Modelo cargado en cada proceso del pool (modo "process")
+_worker_model = None
+
+def _init_worker(model_name: str):
+    """Inicializador de los procesos: carga el modelo una sola vez por proceso"""
+    global _worker_model
+    from sentence_transformers import SentenceTransformer
+    _worker_model = SentenceTransformer(model_name)
+
+def _worker_encode(texts: List[str], batch_size: int) -> np.ndarray:
+    return _worker_model.encode(texts, batch_size=batch_size, show_progress_bar=False)
+
+class EmbeddingExecutor:
+    """
+    Pool acotado para la inferencia de embeddings
+
+    En modo "thread" las tareas corren en hilos del propio proceso (torch libera
+    el GIL durante la inferencia). En modo "process" los hilos solo orquestan y
+    el encode se delega a procesos con su propia copia del modelo.
+    La cola está acotada por `max_queue`: por encima, los llamantes esperan.
+    """
+
+    def __init__(self, mode: str = "thread", max_workers: int = 1, max_queue: int = 64, model_name: Optional[str] = None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Modo de executor de embeddings no soportado: {mode}")
+
+        self.mode = mode
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embedding")
+        self._processes = None
+        if mode == "process":
+            self._processes = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_name,)
+            )
+
+        self._slots = asyncio.Semaphore(max_queue)
+        self._lock = threading.Lock()
+        self.stats_counters = {
+            'queue_depth': 0,
+            'peak_queue_depth': 0,
+            'completed': 0,
+            'failed': 0
+        }
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Ejecutar `fn(*args)` en el pool sin bloquear el event loop"""
+        loop = asyncio.get_running_loop()
+
+        # Contrapresión: si la cola está llena, esperar hueco sin bloquear el loop
+        async with self._slots:
+            self._track(+1)
+            try:
+                result = await loop.run_in_executor(self._threads, fn, *args)
+                self._count('completed')
+                return result
+            except Exception:
+                self._count('failed')
+                raise
+            finally:
+                self._track(-1)
+
+    def encode_in_process(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """Codificar en un proceso del pool (bloquea solo el hilo que llama)"""
+        return self._processes.submit(_worker_encode, texts, batch_size).result()
+
+    def _track(self, delta: int):
+        with self._lock:
+            self.stats_counters['queue_depth'] += delta
+            self.stats_counters['peak_queue_depth'] = max(
+                self.stats_counters['peak_queue_depth'],
+                self.stats_counters['queue_depth']
+            )
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.stats_counters[counter] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Profundidad de cola y contadores del executor"""
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                **self.stats_counters
+            }
+
@@ -0,0 +1,154 @@
+"""
+Caché de expansiones de consultas
+Memoria LRU acotada con TTL + fichero JSONL opcional que sobrevive a reinicios
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from sparse_index import fold_text
+
+logger = logging.getLogger(__name__)
+
+def normalize_query(query: str) -> str:
+    """Consulta sin acentos, mayúsculas, signos ni espacios repetidos"""
+    return " ".join(re.findall(r"[a-z0-9]+", fold_text(str(query or ""))))
+
+class ExpansionCache:
+    """
+    Expansiones LLM indexadas por consulta normalizada + hash del contexto
+
+    "¿Vino para carne?" y "vino para carne" comparten entrada. Las entradas
+    caducan a los `ttl_seconds` (reloj de pared, para que el TTL siga
+    valiendo tras un reinicio). El nivel en disco es un JSONL append-only
+    (`expansions.jsonl`) que se compacta al cargarlo.
+    """
+
+    FILE_NAME = "expansions.jsonl"
+
+    def __init__(self, max_items: int = 1000, ttl_seconds: float = 86400, cache_dir: Optional[str] = None):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_counters = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0
+        }
+
+        self._disk_path: Optional[Path] = None
+        if cache_dir and self.enabled:
+            self._disk_path = Path(cache_dir) / self.FILE_NAME
+            self._load_disk()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_items > 0
+
+    @staticmethod
+    def key(query: str, context: Dict[str, Any] = None) -> str:
+        """Clave estable: consulta normalizada y contexto en JSON canónico"""
+        canonical_context = json.dumps(context or {}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(f"{normalize_query(query)}\0{canonical_context}".encode("utf-8")).hexdigest()
+
+    # === NIVEL EN DISCO ===
+
+    def _load_disk(self):
+        """Cargar las entradas vigentes y reescribir el fichero sin duplicados ni caducadas"""
+        try:
+            self._disk_path.parent.mkdir(parents=True, exist_ok=True)
+            if not self._disk_path.exists():
+                return
+
+            now = time.time()
+            entries: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+            with open(self._disk_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Línea incompleta de una escritura interrumpida
+                    if record.get("expires_at", 0) > now and isinstance(record.get("expansions"), list):
+                        entries[record["key"]] = (record["expires_at"], record["expansions"])
+                        entries.move_to_end(record["key"])
+            while len(entries) > self.max_items:
+                entries.popitem(last=False)
+
+            self._memory = entries
+            self._rewrite_disk()
+            logger.info(f"Caché de expansiones en disco: {len(entries)} consultas en {self._disk_path}")
+
+        except Exception as e:
+            logger.error(f"Error cargando caché de expansiones en disco, se desactiva: {e}")
+            self._disk_path = None
+
+    def _rewrite_disk(self):
+        tmp_path = self._disk_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for key, (expires_at, expansions) in self._memory.items():
+                f.write(json.dumps({"key": key, "expires_at": expires_at, "expansions": expansions}, ensure_ascii=False) + "\n")
+        tmp_path.replace(self._disk_path)
+
+    def _disk_append(self, key: str, expires_at: float, expansions: List[str]):
+        if self._disk_path is None:
+            return
+        try:
+            with open(self._disk_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"key": key, "expires_at": expires_at, "expansions": expansions}, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.error(f"Error escribiendo caché de expansiones en disco: {e}")
+
+    # === API PÚBLICA ===
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Expansiones cacheadas y vigentes (sin la consulta original), o None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                self.stats_counters['misses'] += 1
+                return None
+            expires_at, expansions = entry
+            if expires_at <= time.time():
+                del self._memory[key]
+                self.stats_counters['expired'] += 1
+                self.stats_counters['misses'] += 1
+                return None
+            self._memory.move_to_end(key)
+            self.stats_counters['hits'] += 1
+            return list(expansions)
+
+    def put(self, key: str, expansions: List[str]):
+        """Guardar las expansiones de una consulta en ambos niveles"""
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        expansions = list(expansions)
+        with self._lock:
+            self._memory[key] = (expires_at, expansions)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+            self._disk_append(key, expires_at, expansions)
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de aciertos/fallos y ocupación"""
+        with self._lock:
+            lookups = self.stats_counters['hits'] + self.stats_counters['misses']
+            return {
+                **self.stats_counters,
+                'hit_rate': round(self.stats_counters['hits'] / lookups, 4) if lookups else 0.0,
+                'items': len(self._memory),
+                'capacity': self.max_items,
+                'ttl_seconds': self.ttl_seconds,
+                'disk_enabled': self._disk_path is not None
+            }
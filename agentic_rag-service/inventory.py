@@ -0,0 +1,210 @@
+"""
+Tabla columnar del inventario de vinos
+Columnas numpy (precio, stock, puntuación, añada y códigos de tipo/región)
+para agregaciones filtradas vectorizadas sin leer la base vectorial
+"""
+
+import threading
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+
+from sparse_index import fold_text
+
+_NUMERIC_COLUMNS = ("price", "stock", "rating", "vintage")
+_CATEGORY_COLUMNS = ("wine_type", "region")
+
+def _as_float(value: Any) -> float:
+    """Valor numérico de un metadato (acepta texto numérico como la añada "2018"), o NaN"""
+    if isinstance(value, bool):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+class InventoryTable:
+    """
+    Inventario en formato columnar (una fila por vino)
+
+    Las columnas numéricas son float64 (NaN si falta el dato) y las
+    categóricas se codifican como int32 contra un vocabulario. Eliminar un
+    vino mueve la última fila a su hueco, así que las escrituras son O(1) y
+    las agregaciones son máscaras booleanas más np.bincount.
+    """
+
+    def __init__(self):
+        self._ids: List[str] = []
+        self._names: List[str] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._size = 0
+        self._numeric = {column: np.empty(0, dtype=np.float64) for column in _NUMERIC_COLUMNS}
+        self._codes = {column: np.empty(0, dtype=np.int32) for column in _CATEGORY_COLUMNS}
+        self._vocab: Dict[str, Dict[str, int]] = {column: {} for column in _CATEGORY_COLUMNS}
+        self._labels: Dict[str, List[str]] = {column: [] for column in _CATEGORY_COLUMNS}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._id_to_row
+
+    # === ESCRITURA ===
+
+    def _ensure_capacity(self, rows: int):
+        capacity = self._numeric["price"].shape[0]
+        if self._size + rows <= capacity:
+            return
+        capacity = max(self._size + rows, 2 * capacity, 64)
+        for column, values in self._numeric.items():
+            grown = np.full(capacity, np.nan, dtype=np.float64)
+            grown[:self._size] = values[:self._size]
+            self._numeric[column] = grown
+        for column, codes in self._codes.items():
+            grown = np.zeros(capacity, dtype=np.int32)
+            grown[:self._size] = codes[:self._size]
+            self._codes[column] = grown
+
+    def _code(self, column: str, label: Any) -> int:
+        label = str(label or "Sin datos")
+        code = self._vocab[column].get(label)
+        if code is None:
+            code = len(self._labels[column])
+            self._vocab[column][label] = code
+            self._labels[column].append(label)
+        return code
+
+    def add(self, doc_ids: Iterable[str], metadatas: Iterable[Dict[str, Any]]):
+        """Incorporar los vinos de un lote de documentos (los demás tipos se ignoran)"""
+        with self._lock:
+            wines = []
+            seen = set()
+            for doc_id, metadata in zip(doc_ids, metadatas):
+                if (metadata or {}).get("type") != "vino" or doc_id in self._id_to_row or doc_id in seen:
+                    continue
+                seen.add(doc_id)
+                wines.append((doc_id, metadata))
+            if not wines:
+                return
+
+            self._ensure_capacity(len(wines))
+            start = self._size
+            rows = slice(start, start + len(wines))
+            for column in _NUMERIC_COLUMNS:
+                self._numeric[column][rows] = [_as_float(metadata.get(column)) for _, metadata in wines]
+            for column in _CATEGORY_COLUMNS:
+                self._codes[column][rows] = [self._code(column, metadata.get(column)) for _, metadata in wines]
+            for offset, (doc_id, metadata) in enumerate(wines):
+                self._id_to_row[doc_id] = start + offset
+                self._ids.append(doc_id)
+                self._names.append(metadata.get("name", doc_id))
+            self._size += len(wines)
+
+    def remove(self, doc_ids: Iterable[str]):
+        """Eliminar vinos moviendo la última fila a cada hueco"""
+        with self._lock:
+            for doc_id in doc_ids:
+                row = self._id_to_row.pop(doc_id, None)
+                if row is None:
+                    continue
+                last = self._size - 1
+                if row != last:
+                    for values in list(self._numeric.values()) + list(self._codes.values()):
+                        values[row] = values[last]
+                    self._ids[row] = self._ids[last]
+                    self._names[row] = self._names[last]
+                    self._id_to_row[self._ids[row]] = row
+                self._ids.pop()
+                self._names.pop()
+                self._size -= 1
+
+    # === AGREGACIONES ===
+
+    def _label_mask(self, column: str, labels: List[str]) -> np.ndarray:
+        """Filas cuya etiqueta coincide (sin acentos ni mayúsculas) con alguna de `labels`"""
+        wanted = {fold_text(label) for label in labels}
+        codes = [code for label, code in self._vocab[column].items() if fold_text(label) in wanted]
+        return np.isin(self._codes[column][:self._size], codes)
+
+    def _mask(self, wine_type: str = None, regions: List[str] = None,
+              min_price: float = None, max_price: float = None) -> np.ndarray:
+        """Máscara booleana de las filas que cumplen los filtros"""
+        mask = np.ones(self._size, dtype=bool)
+        price = self._numeric["price"][:self._size]
+        with np.errstate(invalid="ignore"):
+            if min_price is not None:
+                mask &= price >= min_price
+            if max_price is not None:
+                mask &= price <= max_price
+        if wine_type:
+            mask &= self._label_mask("wine_type", [wine_type])
+        if regions is not None:
+            mask &= self._label_mask("region", regions)
+        return mask
+
+    def _group_by(self, column: str, mask: np.ndarray, stock: np.ndarray, value: np.ndarray) -> Dict[str, Dict[str, Any]]:
+        codes = self._codes[column][:self._size][mask]
+        size = len(self._labels[column])
+        wines = np.bincount(codes, minlength=size)
+        stock_sum = np.bincount(codes, weights=stock[mask], minlength=size)
+        value_sum = np.bincount(codes, weights=value[mask], minlength=size)
+        return {
+            self._labels[column][code]: {
+                "vinos": int(wines[code]),
+                "stock": int(stock_sum[code]),
+                "valor": round(float(value_sum[code]), 2)
+            }
+            for code in np.flatnonzero(wines)
+        }
+
+    def report(self, stats: Iterable[str], wine_type: str = None, regions: List[str] = None,
+               min_price: float = None, max_price: float = None, low_stock_threshold: float = 0) -> Dict[str, Any]:
+        """
+        Estadísticas del inventario filtrado
+
+        `stats` admite: stock_total, valor_total, precio_promedio, por_region,
+        por_tipo, por_añada, percentiles_precio y stock_bajo.
+        """
+        stats = set(stats)
+        with self._lock:
+            mask = self._mask(wine_type, regions, min_price, max_price)
+            # Un dato ausente no suma ni en stock ni en valor
+            price = np.nan_to_num(self._numeric["price"][:self._size])
+            stock = np.nan_to_num(self._numeric["stock"][:self._size])
+            value = price * stock
+            known_prices = self._numeric["price"][:self._size][mask]
+            known_prices = known_prices[~np.isnan(known_prices)]
+
+            report: Dict[str, Any] = {"vinos": int(mask.sum())}
+            if "stock_total" in stats:
+                report["stock_total"] = int(stock[mask].sum())
+            if "valor_total" in stats:
+                report["valor_total"] = round(float(value[mask].sum()), 2)
+            if "precio_promedio" in stats:
+                report["precio_promedio"] = round(float(known_prices.mean()), 2) if known_prices.size else None
+            if "percentiles_precio" in stats:
+                report["percentiles_precio"] = (
+                    dict(zip(("p25", "p50", "p75", "p90"), np.round(np.percentile(known_prices, [25, 50, 75, 90]), 2).tolist()))
+                    if known_prices.size else {}
+                )
+            if "por_tipo" in stats:
+                report["por_tipo"] = self._group_by("wine_type", mask, stock, value)
+            if "por_region" in stats:
+                report["por_region"] = self._group_by("region", mask, stock, value)
+            if "por_añada" in stats:
+                vintage = self._numeric["vintage"][:self._size]
+                with_vintage = mask & ~np.isnan(vintage)
+                years, inverse = np.unique(vintage[with_vintage], return_inverse=True)
+                stock_by_year = np.bincount(inverse, weights=stock[with_vintage], minlength=len(years))
+                report["por_añada"] = {int(year): int(total) for year, total in zip(years, stock_by_year)}
+            if "stock_bajo" in stats:
+                raw_stock = self._numeric["stock"][:self._size]
+                with np.errstate(invalid="ignore"):
+                    low_rows = np.flatnonzero(mask & (raw_stock <= low_stock_threshold))
+                low_rows = low_rows[np.argsort(raw_stock[low_rows], kind="stable")]
+                report["stock_bajo"] = [
+                    {"id": self._ids[row], "name": self._names[row], "stock": int(raw_stock[row])}
+                    for row in low_rows
+                ]
+            return report
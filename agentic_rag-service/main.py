@@ -8,13 +8,21 @@ import os
 import sys
 import json
 import asyncio
+import hashlib
+import heapq
 import logging
+import math
+import threading
 import time
 import requests
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+from typing import List, Dict, Any, Literal, Optional
 from contextlib import asynccontextmanager
 
+import numpy as np
+import httpx
 import uvicorn
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
@@ -22,13 +30,21 @@ from pydantic import BaseModel
 # MCP SDK imports
 from mcp import types
 from mcp.server import Server
-from mcp.server.stdio import stdio_server
 
-# Vector DB imports
-import chromadb
-from chromadb.config import Settings
+# chromadb y sentence_transformers se importan bajo demanda: son lentos de cargar
+# y el servidor debe poder responder a /health antes de tener modelo e índice
 import openai
-from sentence_transformers import SentenceTransformer
+
+from embedding_cache import EmbeddingCache
+from embedding_executor import EmbeddingExecutor
+from sparse_index import BM25Index, fold_text
+from wine_catalog import WineCatalog, wine_style
+from inventory import InventoryTable
+from name_index import NameIndex
+from tool_cache import ToolResultCache
+from expansion_cache import ExpansionCache
+from thesaurus import Thesaurus
+from reranker import CrossEncoderReranker
 
 # Configuración de logging
 logging.basicConfig(level=logging.INFO)
@@ -38,49 +54,221 @@ logger = logging.getLogger(__name__)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
-VECTOR_DB_TYPE = os.getenv("VECTOR_DB_TYPE", "chroma")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "30"))
+OPENAI_EXPANSION_TIMEOUT = float(os.getenv("OPENAI_EXPANSION_TIMEOUT", "10"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "10"))
+# Paginación del recurso knowledge://documents
+RESOURCE_PAGE_SIZE = int(os.getenv("RESOURCE_PAGE_SIZE", "50"))
+RESOURCE_MAX_PAGE_SIZE = int(os.getenv("RESOURCE_MAX_PAGE_SIZE", "500"))
+RESOURCE_SCAN_PAGE_SIZE = 1000
+# Las herramientas MCP de solo recuperación pueden activar la expansión LLM (1 llamada) o no (0 llamadas)
+TOOL_QUERY_EXPANSION = os.getenv("TOOL_QUERY_EXPANSION", "false").lower() == "true"
+# Caché de resultados de las herramientas MCP deterministas (TTL 0: desactivada)
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "3600"))
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", "1000"))
+CACHEABLE_TOOLS = ("temperaturas_servicio", "explicar_concepto", "guia_cata")
+# Caché de expansiones de consultas (TTL 0: desactivada; EXPANSION_CACHE_DIR vacío: solo memoria)
+EXPANSION_CACHE_SIZE = int(os.getenv("EXPANSION_CACHE_SIZE", "1000"))
+EXPANSION_CACHE_TTL = float(os.getenv("EXPANSION_CACHE_TTL", "86400"))
+EXPANSION_CACHE_DIR = os.getenv("EXPANSION_CACHE_DIR")
+# Expansión de consultas: "llm", "thesaurus" (solo local) o "thesaurus_llm" (local y, si la
+# consulta no tiene términos del tesauro, LLM). El tesauro se genera con scripts/build_thesaurus.py
+EXPANSION_STRATEGY = os.getenv("EXPANSION_STRATEGY", "thesaurus_llm")
+THESAURUS_PATH = os.getenv("THESAURUS_PATH", "/app/data/thesaurus.json")
+# Espera máxima a la expansión LLM: la búsqueda de la consulta original arranca en paralelo
+# y, si la expansión no llega a tiempo, se responde solo con sus resultados (0: no esperar)
+# Con CONFIDENCE_GATING la llamada LLM de expansión espera a la primera pasada como mucho este tiempo:
+# una primera pasada concluyente más rápida la cancela antes de cualquier E/S de red
+EXPANSION_START_DELAY_MS = float(os.getenv("EXPANSION_START_DELAY_MS", "50"))
+EXPANSION_BUDGET_MS = float(os.getenv("EXPANSION_BUDGET_MS", "2000"))
+# Recuperación adaptativa: una primera pasada con la consulta original decide si hace falta
+# expandir (similitud coseno del mejor resultado y margen sobre el segundo)
+CONFIDENCE_GATING = os.getenv("CONFIDENCE_GATING", "true").lower() == "true"
+CONFIDENCE_HIGH = float(os.getenv("CONFIDENCE_HIGH", "0.75"))  # Desde aquí, con margen, no se expande
+CONFIDENCE_MARGIN = float(os.getenv("CONFIDENCE_MARGIN", "0.05"))
+CONFIDENCE_LOW = float(os.getenv("CONFIDENCE_LOW", "0.35"))  # Por debajo, se expande con más resultados por consulta
+VECTOR_DB_TYPE = os.getenv("VECTOR_DB_TYPE", "chroma")  # "chroma" o "numpy" (en proceso, sin servidor)
+NUMPY_STORE_DIR = os.getenv("NUMPY_STORE_DIR")  # Sin valor: almacén numpy solo en memoria
 CHROMA_HOST = os.getenv("CHROMA_HOST", "localhost")
 CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8001"))
+CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR")  # Sin valor: ChromaDB embebido en memoria
+KNOWLEDGE_BASE_DIR = os.getenv("KNOWLEDGE_BASE_DIR", "/app/knowledge_base")
+# "background": el puerto se abre de inmediato y el modelo/índice se cargan en segundo plano
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background")
+# "vector": solo búsqueda densa; "hybrid": BM25 + vectores fusionados con RRF
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))  # Candidatos por rama antes de fusionar
+RRF_K = int(os.getenv("RRF_K", "60"))
+HYBRID_FILTER_OVERSAMPLE = 4  # Con filtros, BM25 propone este múltiplo de candidatos antes de comprobar metadatos
+# Umbral por defecto de las alertas de stock bajo de calcular_inventario
+INVENTORY_LOW_STOCK_THRESHOLD = int(os.getenv("INVENTORY_LOW_STOCK_THRESHOLD", "25"))
+# crear_menu_maridaje: candidatos por plato y notas del sumiller con una sola llamada LLM por menú
+MENU_CANDIDATES = int(os.getenv("MENU_CANDIDATES", "8"))
+MENU_LLM_NOTES = os.getenv("MENU_LLM_NOTES", "true").lower() == "true"
+MENU_GLASSES_PER_BOTTLE = 6  # Copas de 125 ml por botella de 75 cl
+# Reranking opcional con cross-encoder en CPU de los RERANK_CANDIDATES mejores candidatos
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "250"))  # Por petición; 0 desactiva el reranking
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+VECTOR_DB_WRITE_BATCH_SIZE = int(os.getenv("VECTOR_DB_WRITE_BATCH_SIZE", "256"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")  # Sin valor: solo caché en memoria
+EMBEDDING_EXECUTOR = os.getenv("EMBEDDING_EXECUTOR", "thread")  # "thread" o "process"
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+EMBEDDING_MAX_QUEUE = int(os.getenv("EMBEDDING_MAX_QUEUE", "64"))
 
 # Modelos de datos
+class SearchFilters(BaseModel):
+    """Filtros estructurados aplicados dentro de la consulta al índice"""
+    type: Optional[str] = None
+    wine_type: Optional[str] = None
+    region: Optional[str] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    in_stock: Optional[bool] = None
+
 class QueryRequest(BaseModel):
     query: str
     context: Optional[Dict[str, Any]] = None
     max_results: int = 5
+    retrieval_mode: Optional[Literal["vector", "hybrid"]] = None  # Sin valor: RETRIEVAL_MODE
+    filters: Optional[SearchFilters] = None
+    rerank_budget_ms: Optional[float] = None  # Sin valor: RERANK_BUDGET_MS; 0: sin reranking
 
 class DocumentRequest(BaseModel):
     content: str
     metadata: Optional[Dict[str, Any]] = None
     doc_id: Optional[str] = None
 
+class BulkDocumentRequest(BaseModel):
+    documents: List[DocumentRequest]
+
 class RAGResponse(BaseModel):
     answer: str
     sources: List[Dict[str, Any]]
     context_used: Dict[str, Any]
+    retrieval_path: Optional[str] = None  # Ruta de la recuperación adaptativa (ver confidence_path)
+    rerank: Optional[Dict[str, Any]] = None  # Informe del reranking: estado, candidatos puntuados y ms
 
 class AgenticRAGEngine:
     """Motor de RAG Agéntico con capacidades avanzadas"""
     
     def __init__(self):
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self._embedding_model = None
+        self._model_lock = threading.Lock()
+        self.ready = False
+        self.embedding_cache = EmbeddingCache(
+            EMBEDDING_MODEL,
+            max_memory_items=EMBEDDING_CACHE_SIZE,
+            cache_dir=EMBEDDING_CACHE_DIR
+        )
+        self.embedding_executor = EmbeddingExecutor(
+            mode=EMBEDDING_EXECUTOR,
+            max_workers=EMBEDDING_WORKERS,
+            max_queue=EMBEDDING_MAX_QUEUE,
+            model_name=EMBEDDING_MODEL
+        )
+        self.tool_cache = ToolResultCache(ttl_seconds=TOOL_CACHE_TTL, max_items=TOOL_CACHE_SIZE)
+        self.expansion_cache = ExpansionCache(
+            max_items=EXPANSION_CACHE_SIZE,
+            ttl_seconds=EXPANSION_CACHE_TTL,
+            cache_dir=EXPANSION_CACHE_DIR
+        )
+        self.reranker = CrossEncoderReranker(RERANK_MODEL, batch_size=RERANK_BATCH_SIZE)
         self.vector_db = None
         self.collection = None
+        self._type_counts: Optional[Counter] = None  # Contadores por tipo, calculados bajo demanda
+        self.sparse_index: Optional[BM25Index] = None  # Índice BM25, construido en la primera búsqueda híbrida
+        self.catalog: Optional[WineCatalog] = None  # Catálogo de vinos por precio/puntuación, construido bajo demanda
+        self.inventory: Optional[InventoryTable] = None  # Inventario columnar, construido junto al catálogo
+        self.name_index: Optional[NameIndex] = None  # Nombres de vino -> IDs, construido junto al catálogo
         self.openai_client = None
+        self._llm_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+        self.retrieval_paths: Counter = Counter()  # Consultas por ruta de recuperación
+        self.thesaurus: Optional[Thesaurus] = None  # Tesauro de expansión local, cargado al inicializar
+        self.expansion_sources: Counter = Counter()  # Expansiones por origen: tesauro, caché o LLM
+        self._pending_expansions: set = set()  # Referencias fuertes a las expansiones en segundo plano
         
         if OPENAI_API_KEY:
-            self.openai_client = openai.OpenAI(
+            # Cliente asíncrono con un pool de conexiones compartido por todas las llamadas
+            self.openai_client = openai.AsyncOpenAI(
                 api_key=OPENAI_API_KEY,
-                base_url=OPENAI_BASE_URL
+                base_url=OPENAI_BASE_URL,
+                timeout=OPENAI_TIMEOUT,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=OPENAI_MAX_CONNECTIONS,
+                        max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+                    ),
+                    timeout=OPENAI_TIMEOUT
+                )
             )
     
+    @property
+    def embedding_model(self):
+        """Modelo de embeddings, cargado en el primer uso"""
+        if self._embedding_model is None:
+            with self._model_lock:
+                if self._embedding_model is None:
+                    from sentence_transformers import SentenceTransformer
+                    logger.info(f"Cargando modelo de embeddings {EMBEDDING_MODEL}")
+                    self._embedding_model = SentenceTransformer(EMBEDDING_MODEL)
+        return self._embedding_model
+    
+    async def warm_up(self):
+        """Cargar modelo e índice sin bloquear el event loop y marcar el motor como listo"""
+        await self.initialize()
+        await self.embedding_executor.run(self._encode, ["warm-up"])
+        if RERANK_ENABLED:
+            await self.reranker.warm_up()
+    
     async def initialize(self):
         """Inicializar conexiones a bases de datos vectoriales"""
+        self._type_counts = None
+        self.sparse_index = None
+        self.catalog = None
+        self.inventory = None
+        self.name_index = None
+        if EXPANSION_STRATEGY != "llm":
+            self.thesaurus = await asyncio.to_thread(Thesaurus.load, THESAURUS_PATH)
+        # La carga de chromadb y la apertura del índice bloquean: se hacen fuera del event loop
+        await asyncio.to_thread(self._connect_vector_db)
+    
+    def _connect_vector_db(self):
+        if VECTOR_DB_TYPE == "numpy":
+            # Búsqueda exacta en proceso: sin salto HTTP ni dependencia externa
+            from numpy_store import NumpyVectorStore
+            logger.info(f"Inicializando almacén vectorial numpy ({NUMPY_STORE_DIR or 'en memoria'})")
+            self.vector_db = None
+            self.collection = NumpyVectorStore(path=NUMPY_STORE_DIR)
+            logger.info(f"Vector DB inicializada exitosamente: numpy ({self.collection.count()} documentos)")
+            return
+        
+        import chromadb
+        from chromadb.config import Settings
+        
         try:
             if VECTOR_DB_TYPE == "chroma":
                 # En Railway usar ChromaDB embebido, localmente usar cliente HTTP
                 use_embedded = os.getenv("USE_EMBEDDED_CHROMA", "false").lower() == "true" or os.getenv("ENVIRONMENT") == "railway"
                 
-                if use_embedded:
+                if use_embedded and CHROMA_PERSIST_DIR:
+                    logger.info(f"Inicializando ChromaDB embebido persistente en {CHROMA_PERSIST_DIR}")
+                    self.vector_db = chromadb.PersistentClient(
+                        path=CHROMA_PERSIST_DIR,
+                        settings=Settings(
+                            allow_reset=True,
+                            anonymized_telemetry=False
+                        )
+                    )
+                elif use_embedded:
                     logger.info("Inicializando ChromaDB embebido para Railway")
                     self.vector_db = chromadb.EphemeralClient(
                         settings=Settings(
@@ -123,67 +311,525 @@ class AgenticRAGEngine:
     
     def _embed_text(self, text: str) -> List[float]:
         """Generar embeddings para texto"""
-        return self.embedding_model.encode(text).tolist()
+        return self._embed_texts([text])[0]
+    
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Generar embeddings para varios textos en lotes, reutilizando la caché"""
+        if not texts:
+            return []
+        return self._embed_array(texts).tolist()
+    
+    def _embed_array(self, texts: List[str]) -> np.ndarray:
+        """Embeddings de varios textos como matriz float32 (una fila por texto)"""
+        vectors = self.embedding_cache.get_many(texts)
+        
+        # Codificar solo los textos no cacheados (sin repetir duplicados)
+        pending = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if pending:
+            encoded = np.asarray(self._encode(pending), dtype=np.float32)
+            self.embedding_cache.put_many(pending, encoded)
+            encoded_by_text = dict(zip(pending, encoded))
+            vectors = [vector if vector is not None else encoded_by_text[text] for text, vector in zip(texts, vectors)]
+        
+        return np.vstack(vectors)
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Inferencia del modelo, en este proceso o en el pool de procesos"""
+        if self.embedding_executor.mode == "process":
+            return self.embedding_executor.encode_in_process(texts, EMBEDDING_BATCH_SIZE)
+        return self.embedding_model.encode(texts, batch_size=EMBEDDING_BATCH_SIZE, show_progress_bar=False)
+    
+    async def embed_text(self, text: str) -> List[float]:
+        """Versión awaitable de _embed_text, ejecutada en el executor de embeddings"""
+        return await self.embedding_executor.run(self._embed_text, text)
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Versión awaitable de _embed_texts, ejecutada en el executor de embeddings"""
+        return await self.embedding_executor.run(self._embed_texts, texts)
+    
+    async def embed_array(self, texts: List[str]) -> np.ndarray:
+        """Versión awaitable de _embed_array, ejecutada en el executor de embeddings"""
+        return await self.embedding_executor.run(self._embed_array, texts)
+    
+    async def chat_completion(self, timeout: float = OPENAI_TIMEOUT, **kwargs):
+        """Llamada al LLM con límite de concurrencia y timeout por llamada"""
+        async with self._llm_slots:
+            return await self.openai_client.chat.completions.create(timeout=timeout, **kwargs)
+    
+    @staticmethod
+    def _content_doc_id(content: str, metadata: Dict[str, Any] = None) -> str:
+        """ID determinista para documentos sin ID: hash del contenido y los metadatos
+        
+        No consulta la colección (O(1) por documento), no colisiona tras borrados
+        y reingestar el mismo documento produce el mismo ID.
+        """
+        payload = json.dumps([content, metadata or {}], sort_keys=True, ensure_ascii=False, default=str)
+        return f"doc_{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:20]}"
     
     async def add_document(self, content: str, metadata: Dict[str, Any] = None, doc_id: str = None) -> str:
         """Agregar documento a la base de conocimiento"""
+        doc_ids = await self.add_documents([
+            {"content": content, "metadata": metadata, "doc_id": doc_id}
+        ])
+        return doc_ids[0]
+    
+    async def add_documents(self, documents: List[Dict[str, Any]], upsert: bool = False) -> List[str]:
+        """
+        Agregar documentos en lote a la base de conocimiento
+        
+        Args:
+            documents: Lista de dicts con 'content' y opcionalmente 'metadata' y 'doc_id'
+            upsert: Reemplazar los documentos cuyo ID ya existe (sin él se ignoran, como en ChromaDB)
+            
+        Returns:
+            Lista de IDs de los documentos, en el mismo orden de entrada
+        """
+        if not documents:
+            return []
+        
         try:
-            if not doc_id:
-                doc_id = f"doc_{len(self.collection.get()['ids']) + 1}"
+            doc_ids = [
+                doc.get("doc_id") or self._content_doc_id(doc["content"], doc.get("metadata"))
+                for doc in documents
+            ]
             
-            embedding = self._embed_text(content)
+            # Un mismo ID solo se escribe una vez por lote (ChromaDB rechaza IDs repetidos en un add)
+            first_by_id = {}
+            for doc_id, doc in zip(doc_ids, documents):
+                first_by_id.setdefault(doc_id, doc)
+            unique_ids = list(first_by_id)
+            contents = [first_by_id[doc_id]["content"] for doc_id in unique_ids]
+            metadatas = [first_by_id[doc_id].get("metadata") or {} for doc_id in unique_ids]
             
-            # Agregar a ChromaDB
-            self.collection.add(
-                documents=[content],
-                embeddings=[embedding],
-                metadatas=[metadata or {}],
-                ids=[doc_id]
-            )
+            # Variación de los contadores por tipo (solo si ya se han calculado);
+            # se aplica cuando la escritura ha terminado sin errores
+            type_delta = None
+            if self._type_counts is not None:
+                existing = await asyncio.to_thread(self.collection.get, ids=unique_ids, include=['metadatas'])
+                type_delta = Counter()
+                if upsert:
+                    # Los documentos reemplazados dejan de contar con su tipo anterior
+                    type_delta.subtract((metadata or {}).get("type", "desconocido") for metadata in existing['metadatas'])
+                replaced = set() if upsert else set(existing['ids'])
+                type_delta.update(
+                    (first_by_id[doc_id].get("metadata") or {}).get("type", "desconocido")
+                    for doc_id in unique_ids if doc_id not in replaced
+                )
+            
+            # Codificar y escribir en ChromaDB por bloques
+            write = self.collection.upsert if upsert else self.collection.add
+            for start in range(0, len(contents), VECTOR_DB_WRITE_BATCH_SIZE):
+                end = start + VECTOR_DB_WRITE_BATCH_SIZE
+                write(
+                    documents=contents[start:end],
+                    embeddings=await self.embed_texts(contents[start:end]),
+                    metadatas=metadatas[start:end],
+                    ids=unique_ids[start:end]
+                )
+            self.tool_cache.invalidate()
+            
+            if type_delta is not None and self._type_counts is not None:
+                self._type_counts.update(type_delta)
+                self._type_counts = +self._type_counts
             
-            logger.info(f"Documento agregado: {doc_id}")
-            return doc_id
+            # Los índices en memoria descartan la versión anterior de los documentos reemplazados
+            if upsert:
+                for index in (self.sparse_index, self.catalog, self.inventory, self.name_index):
+                    if index is not None:
+                        index.remove(unique_ids)
+            
+            # Mantener el índice BM25 sincronizado (solo si ya se ha construido)
+            if self.sparse_index is not None:
+                self.sparse_index.add(unique_ids, contents)
+            if self.catalog is not None:
+                self.catalog.add(unique_ids, metadatas)
+            if self.inventory is not None:
+                self.inventory.add(unique_ids, metadatas)
+            if self.name_index is not None:
+                self.name_index.add(*self._wine_names(unique_ids, metadatas))
+            
+            if len(doc_ids) == 1:
+                logger.info(f"Documento agregado: {doc_ids[0]}")
+            else:
+                logger.info(f"{len(doc_ids)} documentos agregados en lote")
+            return doc_ids
             
         except Exception as e:
-            logger.error(f"Error agregando documento: {e}")
+            logger.error(f"Error agregando documentos: {e}")
+            self.tool_cache.invalidate()  # Un lote escrito a medias también cambia la base
             raise
     
-    async def semantic_search(self, query: str, max_results: int = 5) -> List[Dict[str, Any]]:
-        """Búsqueda semántica en la base de conocimiento"""
+    async def delete_documents(self, doc_ids: List[str]):
+        """Eliminar documentos de la base de conocimiento por ID"""
+        if not doc_ids:
+            return
+        # Los contadores por tipo se descuentan con los metadatos de los documentos a borrar
+        if self._type_counts is not None:
+            deleted = await asyncio.to_thread(self.collection.get, ids=doc_ids, include=['metadatas'])
+            self._type_counts.subtract((metadata or {}).get("type", "desconocido") for metadata in deleted['metadatas'])
+            self._type_counts = +self._type_counts
+        for start in range(0, len(doc_ids), VECTOR_DB_WRITE_BATCH_SIZE):
+            self.collection.delete(ids=doc_ids[start:start + VECTOR_DB_WRITE_BATCH_SIZE])
+        self.tool_cache.invalidate()
+        if self.sparse_index is not None:
+            self.sparse_index.remove(doc_ids)
+        if self.catalog is not None:
+            self.catalog.remove(doc_ids)
+        if self.inventory is not None:
+            self.inventory.remove(doc_ids)
+        if self.name_index is not None:
+            self.name_index.remove(doc_ids)
+        logger.info(f"{len(doc_ids)} documentos eliminados")
+    
+    async def document_type_counts(self) -> Dict[str, int]:
+        """Número de documentos por tipo de metadato
+        
+        Se calcula una vez recorriendo los metadatos por páginas (fuera del
+        event loop) y después se mantiene incrementalmente en add_documents y
+        delete_documents.
+        """
+        if self._type_counts is None:
+            self._type_counts = await asyncio.to_thread(self._scan_type_counts)
+        return dict(self._type_counts)
+    
+    def _scan_type_counts(self) -> Counter:
+        counts = Counter()
+        offset = 0
+        while True:
+            page = self.collection.get(include=['metadatas'], limit=RESOURCE_SCAN_PAGE_SIZE, offset=offset)
+            counts.update((metadata or {}).get("type", "desconocido") for metadata in page['metadatas'])
+            if len(page['ids']) < RESOURCE_SCAN_PAGE_SIZE:
+                break
+            offset += RESOURCE_SCAN_PAGE_SIZE
+        return counts
+    
+    @staticmethod
+    def build_where(filters: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        """
+        Traducir filtros estructurados a un filtro `where` de ChromaDB
+        
+        Claves soportadas: type, wine_type, region, min_price, max_price e
+        in_stock (stock > 0). `region` puede ser una lista de nombres ya
+        resueltos (ver resolve_filters). Devuelve None si no hay ningún filtro.
+        """
+        filters = {key: value for key, value in (filters or {}).items() if value is not None}
+        conditions = []
+        if "type" in filters:
+            conditions.append({"type": filters["type"]})
+        if "wine_type" in filters:
+            # Los metadatos guardan el tipo capitalizado ("Tinto", "Blanco"...)
+            conditions.append({"wine_type": filters["wine_type"].capitalize()})
+        if "region" in filters:
+            regions = filters["region"]
+            if isinstance(regions, list):
+                conditions.append({"region": regions[0] if len(regions) == 1 else {"$in": regions}})
+            else:
+                conditions.append({"region": regions})
+        if "min_price" in filters:
+            conditions.append({"price": {"$gte": filters["min_price"]}})
+        if "max_price" in filters:
+            conditions.append({"price": {"$lte": filters["max_price"]}})
+        if filters.get("in_stock"):
+            conditions.append({"stock": {"$gt": 0}})
+        
+        if not conditions:
+            return None
+        # ChromaDB exige al menos dos condiciones dentro de $and
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+    
+    async def resolve_filters(self, filters: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        """
+        Normalizar la región de los filtros con los alias del catálogo
+        
+        Los metadatos guardan el nombre original ("Rías Baixas", "Rioja"): la
+        región pedida ("rias baixas", "D.O. Rioja", "Ribera") se sustituye por
+        la lista de regiones del catálogo que le corresponden. Sin coincidencia
+        se conserva el texto tal cual.
+        """
+        if not filters or not isinstance(filters.get("region"), str):
+            return filters
+        catalog = await self.wine_catalog()
+        return {**filters, "region": catalog.resolve_region(filters["region"]) or [filters["region"]]}
+    
+    async def semantic_search(self, query: str, max_results: int = 5, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Búsqueda semántica en la base de conocimiento (con filtros opcionales)"""
         try:
-            query_embedding = self._embed_text(query)
+            filters = await self.resolve_filters(filters)
+            query_embedding = await self.embed_text(query)
             
             results = self.collection.query(
                 query_embeddings=[query_embedding],
                 n_results=max_results,
-                include=['documents', 'metadatas', 'distances']
+                include=['documents', 'metadatas', 'distances'],
+                **self.where_kwargs(filters)
             )
             
-            formatted_results = []
-            if results['documents'][0]:
-                for i, (doc, metadata, distance) in enumerate(zip(
-                    results['documents'][0],
-                    results['metadatas'][0],
-                    results['distances'][0]
-                )):
-                    formatted_results.append({
-                        'content': doc,
-                        'metadata': metadata,
-                        'relevance_score': 1 - distance,  # Convertir distancia a score
-                        'rank': i + 1
-                    })
-            
-            return formatted_results
+            return self._format_search_results(results)
             
         except Exception as e:
             logger.error(f"Error en búsqueda semántica: {e}")
             return []
     
+    async def semantic_search_batch(self, queries: List[str], max_results: int = 5, filters: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        """Búsqueda semántica de varias consultas con un único encode y una única consulta al índice"""
+        if not queries:
+            return []
+        
+        try:
+            filters = await self.resolve_filters(filters)
+            query_embeddings = await self.embed_array(queries)
+            
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=max_results,
+                include=['documents', 'metadatas', 'distances'],
+                **self.where_kwargs(filters)
+            )
+            
+            return [self._format_search_results(results, row) for row in range(len(queries))]
+            
+        except Exception as e:
+            logger.error(f"Error en búsqueda semántica multi-consulta: {e}")
+            return [[] for _ in queries]
+    
+    @staticmethod
+    def where_kwargs(filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Argumento `where` para collection.query (vacío si no hay filtros)"""
+        where = AgenticRAGEngine.build_where(filters)
+        return {"where": where} if where else {}
+    
+    def _format_search_results(self, results: Dict[str, Any], row: int = 0) -> List[Dict[str, Any]]:
+        """Convertir la fila `row` de una respuesta de collection.query en fuentes"""
+        formatted_results = []
+        if results['documents'][row]:
+            for i, (doc, metadata, distance) in enumerate(zip(
+                results['documents'][row],
+                results['metadatas'][row],
+                results['distances'][row]
+            )):
+                formatted_results.append({
+                    'id': results['ids'][row][i] if results.get('ids') else None,
+                    'content': doc,
+                    'metadata': metadata,
+                    'relevance_score': 1 - distance,  # Convertir distancia a score
+                    'rank': i + 1
+                })
+        return formatted_results
+    
+    def _get_sparse_index(self) -> BM25Index:
+        """Índice BM25 de la colección
+        
+        Se construye una vez recorriendo los documentos por páginas y después
+        se mantiene incrementalmente en add_documents y delete_documents.
+        """
+        if self.sparse_index is None:
+            index = BM25Index()
+            offset = 0
+            while True:
+                page = self.collection.get(include=['documents'], limit=RESOURCE_SCAN_PAGE_SIZE, offset=offset)
+                index.add(page['ids'], page['documents'])
+                if len(page['ids']) < RESOURCE_SCAN_PAGE_SIZE:
+                    break
+                offset += RESOURCE_SCAN_PAGE_SIZE
+            self.sparse_index = index
+            logger.info(f"Índice BM25 construido: {len(index)} documentos")
+        return self.sparse_index
+    
+    @staticmethod
+    def _wine_names(doc_ids: List[str], metadatas: List[Dict[str, Any]]) -> tuple:
+        """IDs y nombres de los vinos de un lote de documentos"""
+        wines = [(doc_id, metadata.get("name")) for doc_id, metadata in zip(doc_ids, metadatas)
+                 if (metadata or {}).get("type") == "vino"]
+        return [doc_id for doc_id, _ in wines], [name for _, name in wines]
+    
+    def _build_wine_indexes(self):
+        """Catálogo, inventario e índice de nombres de los vinos de la colección
+        
+        Se construyen juntos con una sola lectura paginada de los metadatos
+        de los vinos y después se mantienen en cada escritura.
+        """
+        catalog = WineCatalog()
+        inventory = InventoryTable()
+        name_index = NameIndex()
+        offset = 0
+        while True:
+            page = self.collection.get(
+                where={"type": "vino"},
+                include=['metadatas'],
+                limit=RESOURCE_SCAN_PAGE_SIZE,
+                offset=offset
+            )
+            catalog.add(page['ids'], page['metadatas'])
+            inventory.add(page['ids'], page['metadatas'])
+            name_index.add(*self._wine_names(page['ids'], page['metadatas']))
+            if len(page['ids']) < RESOURCE_SCAN_PAGE_SIZE:
+                break
+            offset += RESOURCE_SCAN_PAGE_SIZE
+        self.catalog = catalog
+        self.inventory = inventory
+        self.name_index = name_index
+        logger.info(f"Catálogo e inventario de vinos construidos: {len(catalog)} vinos")
+    
+    async def wine_catalog(self) -> WineCatalog:
+        """Catálogo de vinos; la primera construcción se hace fuera del event loop"""
+        if self.catalog is None:
+            await asyncio.to_thread(self._build_wine_indexes)
+        return self.catalog
+    
+    async def inventory_table(self) -> InventoryTable:
+        """Inventario columnar; la primera construcción se hace fuera del event loop"""
+        if self.inventory is None:
+            await asyncio.to_thread(self._build_wine_indexes)
+        return self.inventory
+    
+    async def wine_name_index(self) -> NameIndex:
+        """Índice de nombres de vino; la primera construcción se hace fuera del event loop"""
+        if self.name_index is None:
+            await asyncio.to_thread(self._build_wine_indexes)
+        return self.name_index
+    
+    async def resolve_wines(self, names: List[str]) -> tuple:
+        """
+        Resolver nombres de vino a sus documentos
+        
+        Cada nombre se resuelve con el índice de nombres (exacto o aproximado)
+        y todos los documentos se leen con un único `get` por IDs. Devuelve
+        (encontrados, no_encontrados): una lista de (nombre pedido, vino)
+        y otra de (nombre pedido, sugerencias).
+        """
+        name_index = await self.wine_name_index()
+        matches = {}
+        missing = []
+        for name in names:
+            candidates = name_index.lookup(name, limit=3)
+            if candidates:
+                matches[name] = candidates[0][0]
+            else:
+                missing.append(name)
+        
+        records = {}
+        doc_ids = list(dict.fromkeys(matches.values()))
+        if doc_ids:
+            page = await asyncio.to_thread(
+                self.collection.get, ids=doc_ids, include=['documents', 'metadatas']
+            )
+            for doc_id, content, metadata in zip(page['ids'], page['documents'], page['metadatas']):
+                records[doc_id] = {"id": doc_id, "content": content, "metadata": metadata or {}}
+        
+        # Dos nombres que resuelven al mismo vino cuentan una sola vez
+        found = {}
+        for name, doc_id in matches.items():
+            if doc_id in records and doc_id not in found:
+                found[doc_id] = (name, records[doc_id])
+        # Sin coincidencia: sugerir los nombres más parecidos con un umbral más bajo
+        not_found = [(name, [match[1] for match in name_index.lookup(name, limit=3, min_similarity=0.2)]) for name in missing]
+        return list(found.values()), not_found
+    
+    async def hybrid_search(self, query: str, max_results: int = 5, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Búsqueda híbrida (BM25 + vectores) de una consulta"""
+        return (await self.hybrid_search_batch([query], max_results, filters))[0]
+    
+    async def hybrid_search_batch(self, queries: List[str], max_results: int = 5, filters: Dict[str, Any] = None) -> List[List[Dict[str, Any]]]:
+        """Búsqueda híbrida de varias consultas: candidatos densos y BM25 fusionados por RRF"""
+        if not queries:
+            return []
+        
+        try:
+            filters = await self.resolve_filters(filters)
+            candidates = max(HYBRID_CANDIDATES, max_results)
+            dense_per_query = await self.semantic_search_batch(queries, max_results=candidates, filters=filters)
+            sparse_index = await asyncio.to_thread(self._get_sparse_index)
+            
+            # BM25 no conoce los metadatos: con filtros propone más candidatos y el
+            # filtro se comprueba solo sobre ellos, sin recorrer la colección
+            filtered = self.build_where(filters) is not None
+            sparse_k = candidates * HYBRID_FILTER_OVERSAMPLE if filtered else candidates
+            sparse_per_query = [sparse_index.search(query, sparse_k) for query in queries]
+            
+            # Los documentos que solo ha encontrado BM25 se leen (y se filtran) en una única llamada;
+            # los de la rama densa ya cumplen los filtros
+            documents = {source['id']: source for sources in dense_per_query for source in sources}
+            missing = list({doc_id for hits in sparse_per_query for doc_id, _ in hits} - documents.keys())
+            if missing:
+                fetched = await asyncio.to_thread(
+                    self.collection.get,
+                    ids=missing,
+                    include=['documents', 'metadatas'],
+                    **self.where_kwargs(filters)
+                )
+                for doc_id, content, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas']):
+                    documents[doc_id] = {'id': doc_id, 'content': content, 'metadata': metadata}
+            if filtered:
+                sparse_per_query = [
+                    [hit for hit in hits if hit[0] in documents][:candidates]
+                    for hits in sparse_per_query
+                ]
+            
+            return [
+                self._fuse_rankings(dense, sparse, documents, max_results)
+                for dense, sparse in zip(dense_per_query, sparse_per_query)
+            ]
+            
+        except Exception as e:
+            logger.error(f"Error en búsqueda híbrida: {e}")
+            return [[] for _ in queries]
+    
+    @staticmethod
+    def _fuse_rankings(dense: List[Dict[str, Any]], sparse: List[tuple], documents: Dict[str, Dict[str, Any]], max_results: int) -> List[Dict[str, Any]]:
+        """Reciprocal Rank Fusion: score = suma de 1 / (RRF_K + posición) en cada ranking"""
+        fused_scores: Dict[str, float] = {}
+        for rank, source in enumerate(dense, 1):
+            fused_scores[source['id']] = fused_scores.get(source['id'], 0.0) + 1 / (RRF_K + rank)
+        for rank, (doc_id, _) in enumerate(sparse, 1):
+            fused_scores[doc_id] = fused_scores.get(doc_id, 0.0) + 1 / (RRF_K + rank)
+        
+        vector_scores = {source['id']: source['relevance_score'] for source in dense}
+        bm25_scores = dict(sparse)
+        fused = []
+        for doc_id, score in heapq.nlargest(max_results, fused_scores.items(), key=lambda item: item[1]):
+            document = documents.get(doc_id)
+            if document is None:
+                continue
+            fused.append({
+                'id': doc_id,
+                'content': document['content'],
+                'metadata': document['metadata'],
+                'relevance_score': score,  # Score RRF
+                'vector_score': vector_scores.get(doc_id),
+                'bm25_score': bm25_scores.get(doc_id),
+                'rank': len(fused) + 1
+            })
+        return fused
+    
     async def agentic_query_expansion(self, query: str, context: Dict[str, Any] = None) -> List[str]:
-        """Expansión agéntica de consultas usando LLM"""
-        if not self.openai_client:
-            return [query]  # Fallback si no hay OpenAI
+        """Expansión agéntica de consultas: tesauro local y/o LLM según EXPANSION_STRATEGY
         
+        La expansión LLM se memoiza por consulta normalizada y contexto.
+        """
+        local = self._local_expansion(query, context)
+        if local is not None:
+            return local
+        return await self._llm_expansion(query, context)
+    
+    def _local_expansion(self, query: str, context: Dict[str, Any] = None) -> Optional[List[str]]:
+        """Expansión sin E/S (tesauro o caché de expansiones); None si hace falta llamar al LLM"""
+        if self.thesaurus is not None and EXPANSION_STRATEGY != "llm":
+            local_expansions = self.thesaurus.expand(query, max_expansions=4)
+            if local_expansions or EXPANSION_STRATEGY == "thesaurus":
+                self.expansion_sources["thesaurus"] += 1
+                return [query] + local_expansions
+        if EXPANSION_STRATEGY == "thesaurus" or not self.openai_client:
+            return [query]  # Sin tesauro aplicable ni LLM
+        
+        cached = self.expansion_cache.get(self.expansion_cache.key(query, context))
+        if cached is not None:
+            self.expansion_sources["cache"] += 1
+            return [query] + cached
+        return None
+    
+    async def _llm_expansion(self, query: str, context: Dict[str, Any] = None) -> List[str]:
+        """Expansión con el LLM (se cachea si la respuesta es válida)"""
+        cache_key = self.expansion_cache.key(query, context)
         try:
             system_prompt = """Eres un experto en expandir consultas para mejorar la recuperación de información.
             Dado una consulta del usuario, genera variaciones y reformulaciones que puedan ayudar a encontrar información relevante.
@@ -198,25 +844,30 @@ class AgenticRAGEngine:
             Genera 3-5 variaciones de esta consulta para mejorar la búsqueda.
             """
             
-            response = self.openai_client.chat.completions.create(
+            response = await self.chat_completion(
                 model=OPENAI_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
                 ],
                 temperature=0.7,
-                max_tokens=500
+                max_tokens=500,
+                timeout=OPENAI_EXPANSION_TIMEOUT
             )
+            self.expansion_sources["llm"] += 1  # Solo llamadas completadas
             
             result = response.choices[0].message.content
             
             # Intentar parsear JSON
             try:
                 expanded_queries = json.loads(result)
+                if isinstance(expanded_queries, dict) and 'queries' in expanded_queries:
+                    expanded_queries = expanded_queries['queries']
                 if isinstance(expanded_queries, list):
-                    return [query] + expanded_queries[:4]  # Original + 4 expansiones max
-                elif isinstance(expanded_queries, dict) and 'queries' in expanded_queries:
-                    return [query] + expanded_queries['queries'][:4]
+                    expansions = [str(expanded) for expanded in expanded_queries[:4]]  # Original + 4 expansiones max
+                    # Solo se cachean expansiones válidas: un fallo se reintenta en la próxima consulta
+                    self.expansion_cache.put(cache_key, expansions)
+                    return [query] + expansions
             except:
                 # Si falla el parsing, usar la consulta original
                 pass
@@ -255,7 +906,7 @@ class AgenticRAGEngine:
             Responde la pregunta basándote únicamente en las fuentes proporcionadas.
             """
             
-            response = self.openai_client.chat.completions.create(
+            response = await self.chat_completion(
                 model=OPENAI_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -271,31 +922,284 @@ class AgenticRAGEngine:
             logger.error(f"Error generando respuesta: {e}")
             return f"Error generando respuesta basada en {len(sources)} fuentes para: '{query}'"
     
-    async def agentic_rag_query(self, query: str, context: Dict[str, Any] = None, max_results: int = 5) -> RAGResponse:
-        """Consulta RAG agéntica completa"""
-        try:
-            # 1. Expansión agéntica de consulta
-            expanded_queries = await self.agentic_query_expansion(query, context)
-            logger.info(f"Consultas expandidas: {expanded_queries}")
-            
-            # 2. Búsqueda semántica multi-consulta
-            all_sources = []
-            for exp_query in expanded_queries:
-                sources = await self.semantic_search(exp_query, max_results=3)
-                all_sources.extend(sources)
-            
-            # 3. Deduplicación y ranking
-            seen_content = set()
-            unique_sources = []
-            for source in all_sources:
-                content_hash = hash(source['content'][:100])  # Hash de los primeros 100 chars
-                if content_hash not in seen_content:
-                    seen_content.add(content_hash)
+    async def agentic_retrieve(self, query: str, context: Dict[str, Any] = None, max_results: int = 5, expand: bool = True, mode: str = None, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Recuperación agéntica sin generación de respuesta (expansión opcional)
+        
+        `mode` elige la búsqueda: "vector" o "hybrid" (por defecto RETRIEVAL_MODE).
+        `filters` se aplica dentro de la consulta al índice (ver build_where).
+        """
+        sources, _ = await self._agentic_retrieve_with_path(query, context, max_results, expand, mode, filters)
+        return sources
+    
+    async def _agentic_retrieve_with_path(self, query: str, context: Dict[str, Any] = None, max_results: int = 5, expand: bool = True, mode: str = None, filters: Dict[str, Any] = None) -> tuple:
+        """agentic_retrieve que además devuelve la ruta de recuperación seguida"""
+        # 1-2. Expansión agéntica y búsqueda multi-consulta (un solo encode y una sola consulta por fase)
+        search_batch = self.hybrid_search_batch if (mode or RETRIEVAL_MODE) == "hybrid" else self.semantic_search_batch
+        if expand:
+            results_per_query, path = await self._speculative_search(query, context, search_batch, max_results, filters)
+        else:
+            results_per_query = await search_batch([query], max_results=max_results, filters=filters)
+            path = "no_expand"
+        self.retrieval_paths[path] += 1
+        
+        # 3. Deduplicación por ID y ranking por fusión de posiciones entre consultas
+        return self._fuse_queries(results_per_query, max_results), path
+    
+    @staticmethod
+    def _fuse_queries(results_per_query: List[List[Dict[str, Any]]], max_results: int) -> List[Dict[str, Any]]:
+        """
+        Fusión de los resultados de varias consultas con Reciprocal Rank Fusion
+        
+        Los documentos se identifican por ID (por contenido completo si no
+        tienen) y puntúan la suma de 1 / (RRF_K + posición) en cada lista donde
+        aparecen: solo cuentan las posiciones, porque los scores de consultas
+        distintas no están en la misma escala. Cada fuente conserva los datos de
+        su primera aparición y añade `fusion_score`. Los empates se deshacen por
+        orden de aparición, así que el resultado es estable. La acumulación
+        (bincount) y la selección de los `max_results` mejores (partition) son
+        O(total de resultados).
+        """
+        slots: Dict[Any, int] = {}
+        unique_sources: List[Dict[str, Any]] = []
+        hit_slots: List[int] = []
+        hit_ranks: List[int] = []
+        for sources in results_per_query:
+            for rank, source in enumerate(sources, 1):
+                key = source.get('id') or source['content']
+                slot = slots.get(key)
+                if slot is None:
+                    slot = slots[key] = len(unique_sources)
                     unique_sources.append(source)
+                hit_slots.append(slot)
+                hit_ranks.append(rank)
+        if not unique_sources or max_results <= 0:
+            return []
+        
+        scores = np.bincount(
+            np.asarray(hit_slots),
+            weights=1.0 / (RRF_K + np.asarray(hit_ranks, dtype=np.float64)),
+            minlength=len(unique_sources)
+        )
+        if len(unique_sources) > max_results:
+            # Umbral del k-ésimo mejor; los empates en el umbral entran todos y los ordena lexsort
+            threshold = np.partition(scores, -max_results)[-max_results]
+            candidates = np.flatnonzero(scores >= threshold)
+        else:
+            candidates = np.arange(len(unique_sources))
+        order = candidates[np.lexsort((candidates, -scores[candidates]))][:max_results]
+        return [
+            {**unique_sources[slot], 'fusion_score': float(scores[slot]), 'rank': position}
+            for position, slot in enumerate(order.tolist(), 1)
+        ]
+    
+    @staticmethod
+    def confidence_path(first_pass: List[Dict[str, Any]]) -> str:
+        """
+        Ruta de recuperación según la distribución de scores de la primera pasada
+        
+        - "direct": el mejor resultado es claro (≥ CONFIDENCE_HIGH y con margen
+          sobre el segundo): se responde sin expandir.
+        - "expand_wide": ningún resultado llega a CONFIDENCE_LOW: se expande y
+          cada consulta expandida recupera max_results en lugar de 3.
+        - "expand": caso intermedio, expansión normal.
+        
+        En búsqueda híbrida se usa la similitud vectorial (el score RRF solo
+        ordena, no mide confianza).
+        """
+        scores = sorted(
+            (score for score in (source.get('vector_score', source.get('relevance_score')) for source in first_pass)
+             if score is not None),
+            reverse=True
+        )
+        if not scores or scores[0] < CONFIDENCE_LOW:
+            return "expand_wide"
+        runner_up = scores[1] if len(scores) > 1 else float("-inf")
+        if scores[0] >= CONFIDENCE_HIGH and scores[0] - runner_up >= CONFIDENCE_MARGIN:
+            return "direct"
+        return "expand"
+    
+    async def _speculative_search(self, query: str, context: Dict[str, Any], search_batch, max_results: int, filters: Dict[str, Any] = None) -> tuple:
+        """
+        Búsqueda de la consulta original y expansión LLM acotada en tiempo
+        
+        Las expansiones locales (tesauro o caché) se resuelven antes, sin E/S.
+        La llamada LLM arranca en paralelo con la primera pasada (consulta
+        original); con CONFIDENCE_GATING espera antes a que la primera pasada
+        no sea concluyente (ver confidence_path), como mucho
+        EXPANSION_START_DELAY_MS, y en la ruta "direct" se cancela. Las
+        expansiones solo se buscan y se fusionan si llegan dentro de
+        EXPANSION_BUDGET_MS desde el inicio; si no, se responde con los
+        resultados de la consulta original. La expansión tardía sigue en
+        segundo plano y queda en la caché de expansiones para la siguiente
+        consulta igual. Devuelve (resultados por consulta, ruta).
+        """
+        started = time.perf_counter()
+        expanded_queries = self._local_expansion(query, context)
+        gate = asyncio.Event()
+        expansion = None
+        if expanded_queries is None:
+            expansion = self._track_expansion(asyncio.create_task(self._deferred_llm_expansion(query, context, gate)))
+        try:
+            results_per_query = await search_batch([query], max_results=max_results, filters=filters)
+        except BaseException:
+            if expansion is not None:
+                expansion.cancel()
+            raise
+        
+        path = self.confidence_path(results_per_query[0] if results_per_query else []) if CONFIDENCE_GATING else "expand"
+        if path == "direct":
+            if expansion is not None:
+                expansion.cancel()
+            logger.info(f"🎯 Primera pasada concluyente para '{query}': sin expansión")
+            return results_per_query, path
+        gate.set()
+        
+        if expansion is not None:
+            remaining = max(0.0, EXPANSION_BUDGET_MS / 1000 - (time.perf_counter() - started))
+            try:
+                expanded_queries = await asyncio.wait_for(asyncio.shield(expansion), timeout=remaining)
+            except asyncio.TimeoutError:
+                logger.info(f"⏱️ Expansión fuera de presupuesto ({EXPANSION_BUDGET_MS:.0f} ms): resultados de la consulta original")
+                return results_per_query, "expand_timeout"
+        
+        extra_queries = [expanded for expanded in expanded_queries if expanded != query]
+        if not extra_queries:
+            return results_per_query, path
+        logger.info(f"Consultas expandidas ({path}): {expanded_queries}")
+        per_query = max_results if path == "expand_wide" else 3
+        return results_per_query + await search_batch(extra_queries, max_results=per_query, filters=filters), path
+    
+    async def _deferred_llm_expansion(self, query: str, context: Dict[str, Any], gate: asyncio.Event) -> List[str]:
+        """Expansión LLM que, con CONFIDENCE_GATING, espera a la puerta abierta o a EXPANSION_START_DELAY_MS"""
+        if CONFIDENCE_GATING:
+            try:
+                await asyncio.wait_for(gate.wait(), timeout=EXPANSION_START_DELAY_MS / 1000)
+            except asyncio.TimeoutError:
+                pass  # Primera pasada lenta: se solapa con la llamada LLM
+        return await self._llm_expansion(query, context)
+    
+    def _track_expansion(self, task: asyncio.Task) -> asyncio.Task:
+        """Mantener viva una expansión hasta que termine (asyncio solo guarda referencias débiles a las tareas)"""
+        self._pending_expansions.add(task)
+        task.add_done_callback(self._expansion_done)
+        return task
+    
+    def _expansion_done(self, task: asyncio.Task):
+        self._pending_expansions.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error en expansión en segundo plano: {task.exception()}")
+    
+    async def plan_menu(self, dishes: List[str], event_style: str = "casual", guests: int = 4) -> List[Dict[str, Any]]:
+        """
+        Asignar un vino a cada plato de un menú
+        
+        Todos los platos se buscan en una sola consulta multi-query (un único
+        encode por lotes), así que la latencia no crece con el número de
+        platos. Devuelve un curso por plato con el vino, las botellas
+        necesarias y si el vino se repite por falta de alternativas.
+        """
+        queries = [f"vino maridaje {dish} {event_style}" for dish in dishes]
+        search_batch = self.hybrid_search_batch if RETRIEVAL_MODE == "hybrid" else self.semantic_search_batch
+        candidates = await search_batch(queries, max_results=MENU_CANDIDATES, filters={"type": "vino", "in_stock": True})
+        assignment = self._assign_menu_wines(candidates)
+        
+        bottles = math.ceil(guests / MENU_GLASSES_PER_BOTTLE)
+        return [
+            {
+                "dish": dish,
+                "wine": assignment[i][0],
+                "repeated": assignment[i][1],
+                "bottles": bottles if assignment[i][0] else 0
+            }
+            for i, dish in enumerate(dishes)
+        ]
+    
+    @staticmethod
+    def _assign_menu_wines(candidates: List[List[Dict[str, Any]]]) -> List[tuple]:
+        """
+        Asignación voraz plato -> vino sin repetir vinos
+        
+        Se recorren todos los pares (plato, vino) de mayor a menor relevancia
+        y se acepta cada par cuyo plato y vino estén libres. Un plato que se
+        queda sin candidatos libres repite su mejor vino. Devuelve por plato
+        (vino o None, repetido).
+        """
+        pairs = sorted(
+            ((source.get('relevance_score', 0), dish, rank, source)
+             for dish, sources in enumerate(candidates)
+             for rank, source in enumerate(sources)),
+            key=lambda pair: (-pair[0], pair[1], pair[2])
+        )
+        assignment: Dict[int, tuple] = {}
+        used = set()
+        for _, dish, _, source in pairs:
+            wine_id = source.get('id') or source['content']
+            if dish in assignment or wine_id in used:
+                continue
+            assignment[dish] = (source, False)
+            used.add(wine_id)
+        
+        return [
+            assignment.get(dish) or ((sources[0], True) if sources else (None, False))
+            for dish, sources in enumerate(candidates)
+        ]
+    
+    async def menu_pairing_notes(self, courses: List[Dict[str, Any]], event_style: str) -> str:
+        """Notas del sumiller para todo el menú con una única llamada al LLM (vacío sin LLM o si falla)"""
+        if not self.openai_client or not MENU_LLM_NOTES:
+            return ""
+        
+        try:
+            menu_text = "\n".join(
+                f"{i}. {course['dish']} -> {course['wine']['metadata'].get('name', 'Sin nombre')} "
+                f"({course['wine']['metadata'].get('wine_type', '')}, {course['wine']['metadata'].get('pairing', '')})"
+                for i, course in enumerate(courses, 1) if course['wine']
+            )
+            response = await self.chat_completion(
+                model=OPENAI_MODEL,
+                messages=[
+                    {"role": "system", "content": "Eres un sumiller experto. Justificas maridajes de forma breve y práctica."},
+                    {"role": "user", "content": f"""Menú para un evento {event_style}:
+{menu_text}
+
+Explica en una frase por plato por qué funciona cada maridaje y añade un consejo de servicio para el menú completo."""}
+                ],
+                temperature=0.3,
+                max_tokens=500
+            )
+            return response.choices[0].message.content or ""
+        except Exception as e:
+            logger.error(f"Error generando notas del menú: {e}")
+            return ""
+    
+    @staticmethod
+    def rerank_budget(budget_ms: Optional[float] = None) -> float:
+        """Presupuesto de reranking de una petición en ms (0: sin reranking)"""
+        if not RERANK_ENABLED:
+            return 0.0
+        return RERANK_BUDGET_MS if budget_ms is None else max(budget_ms, 0.0)
+    
+    async def rerank_sources(self, query: str, sources: List[Dict[str, Any]], max_results: int, budget_ms: float) -> tuple:
+        """Reordenar los candidatos con el cross-encoder y quedarse con `max_results` (devuelve fuentes e informe)"""
+        if budget_ms <= 0:
+            return sources[:max_results], None
+        reranked, report = await self.reranker.rerank(query, sources[:RERANK_CANDIDATES], budget_ms)
+        return reranked[:max_results], report
+    
+    async def agentic_rag_query(self, query: str, context: Dict[str, Any] = None, max_results: int = 5, mode: str = None, filters: Dict[str, Any] = None, rerank_budget_ms: Optional[float] = None) -> RAGResponse:
+        """Consulta RAG agéntica completa
+        
+        Con RERANK_ENABLED se recuperan RERANK_CANDIDATES candidatos y el
+        cross-encoder elige los `max_results` mejores dentro del presupuesto.
+        """
+        try:
+            # 1-3. Expansión (según la confianza de la primera pasada), búsqueda multi-consulta y ranking
+            budget_ms = self.rerank_budget(rerank_budget_ms)
+            candidates = max(max_results, RERANK_CANDIDATES) if budget_ms > 0 else max_results
+            top_sources, path = await self._agentic_retrieve_with_path(query, context, candidates, mode=mode, filters=filters)
             
-            # Ordenar por relevancia
-            unique_sources.sort(key=lambda x: x.get('relevance_score', 0), reverse=True)
-            top_sources = unique_sources[:max_results]
+            # 3b. Reranking con cross-encoder (opcional, acotado en tiempo)
+            top_sources, rerank_report = await self.rerank_sources(query, top_sources, max_results, budget_ms)
             
             # 4. Generación de respuesta
             answer = await self.generate_answer(query, top_sources, context)
@@ -303,7 +1207,9 @@ class AgenticRAGEngine:
             return RAGResponse(
                 answer=answer,
                 sources=top_sources,
-                context_used=context or {}
+                context_used=context or {},
+                retrieval_path=path,
+                rerank=rerank_report
             )
             
         except Exception as e:
@@ -341,6 +1247,11 @@ async def list_tools() -> List[types.Tool]:
                         "minimum": 1,
                         "maximum": 20,
                         "default": 5
+                    },
+                    "modo_busqueda": {
+                        "type": "string",
+                        "description": "Búsqueda 'vector' (semántica) o 'hybrid' (semántica + palabras exactas, mejor para nombres, uvas y regiones)",
+                        "enum": ["vector", "hybrid"]
                     }
                 },
                 "required": ["consulta"]
@@ -433,7 +1344,7 @@ async def list_tools() -> List[types.Tool]:
                 "properties": {
                     "nombre_vino": {
                         "type": "string",
-                        "description": "Nombre exacto del vino a analizar"
+                        "description": "Nombre del vino a analizar (admite erratas, acentos omitidos y nombres incompletos)"
                     },
                     "aspectos": {
                         "type": "array",
@@ -601,10 +1512,15 @@ async def list_tools() -> List[types.Tool]:
                         "type": "array",
                         "items": {
                             "type": "string",
-                            "enum": ["stock_total", "valor_total", "precio_promedio", "por_region", "por_tipo", "por_añada"]
+                            "enum": ["stock_total", "valor_total", "precio_promedio", "por_region", "por_tipo", "por_añada", "percentiles_precio", "stock_bajo"]
                         },
                         "description": "Estadísticas a incluir",
                         "default": ["stock_total", "valor_total", "precio_promedio"]
+                    },
+                    "umbral_stock_bajo": {
+                        "type": "integer",
+                        "description": "Unidades a partir de las que se avisa de stock bajo (con 'stock_bajo')",
+                        "minimum": 0
                     }
                 }
             }
@@ -632,8 +1548,40 @@ async def list_tools() -> List[types.Tool]:
         )
     ]
 
+_tool_defaults: Dict[str, Dict[str, Any]] = {}
+
+async def _canonical_arguments(name: str, arguments: dict) -> Dict[str, Any]:
+    """Argumentos con los valores por defecto del esquema y sin nulos (misma llamada -> misma clave)"""
+    if not _tool_defaults:
+        for tool in await list_tools():
+            _tool_defaults[tool.name] = {
+                prop: spec["default"]
+                for prop, spec in tool.inputSchema.get("properties", {}).items() if "default" in spec
+            }
+    return {
+        **_tool_defaults.get(name, {}),
+        **{key: value for key, value in (arguments or {}).items() if value is not None}
+    }
+
 @mcp_server.call_tool()
 async def call_tool(name: str, arguments: dict) -> List[types.TextContent]:
+    """Ejecutar herramientas (las deterministas se sirven desde la caché de resultados)"""
+    if name not in CACHEABLE_TOOLS or not rag_engine.tool_cache.enabled:
+        return await _run_tool(name, arguments)
+    
+    cache_arguments = await _canonical_arguments(name, arguments)
+    cached = rag_engine.tool_cache.get(name, cache_arguments)
+    if cached is not None:
+        return cached
+    
+    generation = rag_engine.tool_cache.generation
+    result = await _run_tool(name, arguments)
+    # Los errores no se cachean: la siguiente llamada vuelve a intentarlo
+    if result and not result[0].text.startswith("❌"):
+        rag_engine.tool_cache.put(name, cache_arguments, result, generation=generation)
+    return result
+
+async def _run_tool(name: str, arguments: dict) -> List[types.TextContent]:
     """Ejecutar herramientas"""
     try:
         # === HERRAMIENTAS RAG BÁSICAS ===
@@ -641,10 +1589,14 @@ async def call_tool(name: str, arguments: dict) -> List[types.TextContent]:
             consulta = arguments.get("consulta", "")
             max_resultados = arguments.get("max_resultados", 5)
             
-            response = await rag_engine.agentic_rag_query(consulta, max_results=max_resultados)
-            
-            # Filtrar solo vinos
-            vinos = [source for source in response.sources if source.get('metadata', {}).get('type') == 'vino']
+            # El filtro por tipo se aplica dentro del índice: los k resultados son vinos
+            vinos = await rag_engine.agentic_retrieve(
+                consulta,
+                max_results=max_resultados,
+                expand=TOOL_QUERY_EXPANSION,
+                mode=arguments.get("modo_busqueda"),
+                filters={"type": "vino"}
+            )
             
             result = f"🍷 **Búsqueda de vinos**: '{consulta}'\n\n"
             result += f"**Encontrados**: {len(vinos)} vinos\n\n"
@@ -682,15 +1634,13 @@ async def call_tool(name: str, arguments: dict) -> List[types.TextContent]:
             
             # Expandir la consulta para maridaje
             consulta_maridaje = f"vino maridaje {plato} {ocasion}"
-            response = await rag_engine.agentic_rag_query(consulta_maridaje, max_results=5)
-            
-            # Filtrar vinos y aplicar filtro de presupuesto si existe
-            vinos_sugeridos = []
-            for source in response.sources:
-                if source.get('metadata', {}).get('type') == 'vino':
-                    precio = source.get('metadata', {}).get('price', 0)
-                    if presupuesto_max is None or (precio and precio <= presupuesto_max):
-                        vinos_sugeridos.append(source)
+            # Tipo, presupuesto y disponibilidad se filtran dentro del índice
+            vinos_sugeridos = await rag_engine.agentic_retrieve(
+                consulta_maridaje,
+                max_results=5,
+                expand=TOOL_QUERY_EXPANSION,
+                filters={"type": "vino", "max_price": presupuesto_max, "in_stock": True}
+            )
             
             result = f"🍽️ **Sugerencias de maridaje para**: {plato}\n"
             result += f"**Ocasión**: {ocasion.title()}\n"
@@ -714,19 +1664,72 @@ async def call_tool(name: str, arguments: dict) -> List[types.TextContent]:
             
             return [types.TextContent(type="text", text=result)]
 
+        elif name == "crear_menu_maridaje":
+            platos = [plato for plato in (arguments.get("platos") or []) if plato]
+            estilo_evento = arguments.get("estilo_evento", "casual")
+            num_comensales = arguments.get("num_comensales", 4)
+
+            if not 2 <= len(platos) <= 6:
+                return [types.TextContent(type="text", text="❌ El menú debe tener entre 2 y 6 platos")]
+
+            # Una búsqueda por lotes para todos los platos y, como mucho, una llamada LLM
+            cursos = await rag_engine.plan_menu(platos, estilo_evento, num_comensales)
+            notas = await rag_engine.menu_pairing_notes(cursos, estilo_evento)
+
+            result = f"🍽️ **Menú maridaje**: {len(platos)} platos\n"
+            result += f"**Estilo**: {estilo_evento.title()} · **Comensales**: {num_comensales}\n\n"
+
+            compra: Dict[str, Dict[str, Any]] = {}
+            for i, curso in enumerate(cursos, 1):
+                result += f"**{i}. {curso['dish']}**\n"
+                if not curso['wine']:
+                    result += "   • Sin vino disponible para este plato\n\n"
+                    continue
+                metadata = curso['wine'].get('metadata', {})
+                result += f"   • Vino: {metadata.get('name', 'Sin nombre')} ({metadata.get('wine_type', 'N/A')}, {metadata.get('region', 'N/A')})\n"
+                result += f"   • Maridaje: {metadata.get('pairing', 'N/A')}\n"
+                result += f"   • Botellas: {curso['bottles']}\n"
+                if curso['repeated']:
+                    result += "   • Se repite: no hay otro vino adecuado disponible\n"
+                result += "\n"
+
+                linea = compra.setdefault(metadata.get('name', 'Sin nombre'), {"botellas": 0, "metadata": metadata})
+                linea["botellas"] += curso['bottles']
+
+            if compra:
+                result += f"**🛒 Lista de compra** ({MENU_GLASSES_PER_BOTTLE} copas por botella):\n"
+                total = 0.0
+                for nombre, linea in compra.items():
+                    precio = linea["metadata"].get('price')
+                    stock = linea["metadata"].get('stock')
+                    result += f"• {nombre}: {linea['botellas']} botellas"
+                    if isinstance(precio, (int, float)):
+                        subtotal = precio * linea["botellas"]
+                        total += subtotal
+                        result += f" ({subtotal:.2f}€)"
+                    if isinstance(stock, (int, float)) and stock < linea["botellas"]:
+                        result += f" ⚠️ solo {stock} en stock"
+                    result += "\n"
+                result += f"**Total estimado**: {total:.2f}€\n"
+
+            if notas:
+                result += f"\n**🍷 Notas del sumiller:**\n{notas}\n"
+
+            return [types.TextContent(type="text", text=result)]
+
         elif name == "explicar_concepto":
             concepto = arguments.get("concepto", "")
             nivel_detalle = arguments.get("nivel_detalle", "intermedio")
             
             # Buscar información del concepto en la base de conocimientos
-            response = await rag_engine.agentic_rag_query(f"concepto {concepto} sumilleria viticultura", max_results=3)
+            sources = await rag_engine.agentic_retrieve(f"concepto {concepto} sumilleria viticultura", max_results=3, expand=TOOL_QUERY_EXPANSION)
             
             result = f"📚 **Concepto**: {concepto.title()}\n"
             result += f"**Nivel**: {nivel_detalle.title()}\n\n"
             
             # Si hay información en la base de conocimientos
-            if response.sources and any('teoria' in s.get('metadata', {}).get('source', '') for s in response.sources):
-                teoria_source = next((s for s in response.sources if 'teoria' in s.get('metadata', {}).get('source', '')), None)
+            if sources and any('teoria' in s.get('metadata', {}).get('source', '') for s in sources):
+                teoria_source = next((s for s in sources if 'teoria' in s.get('metadata', {}).get('source', '')), None)
                 if teoria_source:
                     result += f"**Explicación desde la base de conocimientos:**\n"
                     result += f"{teoria_source.get('content', '')[:500]}...\n\n"
@@ -817,6 +1820,233 @@ async def call_tool(name: str, arguments: dict) -> List[types.TextContent]:
                 result += "• Espumosos siempre muy fríos\n"
             
             return [types.TextContent(type="text", text=result)]
+
+        # === HERRAMIENTAS DE ANÁLISIS DE VINOS (índice de nombres + lectura por IDs) ===
+        elif name == "analizar_vino":
+            nombre_vino = arguments.get("nombre_vino", "")
+            aspectos = arguments.get("aspectos") or ["aromas", "sabores", "maridajes"]
+
+            encontrados, no_encontrados = await rag_engine.resolve_wines([nombre_vino])
+            if not encontrados:
+                sugerencias = no_encontrados[0][1] if no_encontrados else []
+                result = f"❌ No se encontró el vino '{nombre_vino}' en el catálogo\n"
+                if sugerencias:
+                    result += f"**¿Quizás?**: {', '.join(sugerencias)}\n"
+                return [types.TextContent(type="text", text=result)]
+
+            metadata = encontrados[0][1]['metadata']
+            estilo = wine_style(metadata.get('name'))
+            decantacion = {
+                "gran_reserva": "Decantar 45-60 minutos antes; separa posibles posos",
+                "reserva": "Decantar 30 minutos antes para abrir aromas",
+                "crianza": "Airear 15-20 minutos en copa o decantador",
+                "joven": "No necesita decantación"
+            }
+            guarda = {
+                "gran_reserva": "15-20 años desde la añada",
+                "reserva": "10-15 años desde la añada",
+                "crianza": "5-8 años desde la añada",
+                "joven": "Consumir en 1-3 años"
+            }
+
+            result = f"🔍 **Análisis de vino**: {metadata.get('name', nombre_vino)}\n"
+            if fold_text(metadata.get('name', '')) != fold_text(nombre_vino):
+                result += f"**Coincidencia para**: '{nombre_vino}'\n"
+            result += f"**Tipo**: {metadata.get('wine_type', 'N/A')} · **Región**: {metadata.get('region', 'N/A')}\n"
+            result += f"**Uva**: {metadata.get('grape') or 'N/A'} · **Bodega**: {metadata.get('winery') or 'N/A'}\n"
+            result += f"**Añada**: {metadata.get('vintage', 'N/A')} · **Precio**: {metadata.get('price', 'N/A')}€ · **Puntuación**: {metadata.get('rating', 'N/A')}/100\n\n"
+
+            if "aromas" in aspectos or "sabores" in aspectos:
+                result += f"**👃 Nota de cata:**\n• {metadata.get('description') or 'Sin descripción'}\n\n"
+            if "estructura" in aspectos:
+                result += f"**🏗️ Estructura:**\n"
+                result += f"• Alcohol: {metadata.get('alcohol') or 'N/A'}% vol.\n"
+                result += f"• Crianza: {estilo.replace('_', ' ').title()}\n\n"
+            if "maridajes" in aspectos:
+                result += f"**🍽️ Maridajes:**\n• {metadata.get('pairing') or 'N/A'}\n\n"
+            if "temperatura" in aspectos:
+                result += f"**🌡️ Temperatura de servicio:**\n• {metadata.get('temperature') or 'N/A'}\n\n"
+            if "decantacion" in aspectos:
+                result += f"**🫗 Decantación:**\n• {decantacion[estilo]}\n\n"
+            if "guarda" in aspectos:
+                result += f"**⏳ Guarda:**\n• {guarda[estilo]}\n\n"
+
+            return [types.TextContent(type="text", text=result)]
+
+        elif name == "comparar_vinos":
+            vinos = arguments.get("vinos") or []
+            criterios = arguments.get("criterios") or ["precio", "calidad", "puntuacion"]
+
+            if len(vinos) < 2:
+                return [types.TextContent(type="text", text="❌ Indica al menos dos vinos para comparar")]
+
+            encontrados, no_encontrados = await rag_engine.resolve_wines(vinos)
+            if len(encontrados) < 2:
+                result = f"❌ No se encontraron suficientes vinos en el catálogo para comparar\n"
+                for nombre, sugerencias in no_encontrados:
+                    result += f"• '{nombre}'"
+                    if sugerencias:
+                        result += f" — **¿Quizás?**: {', '.join(sugerencias)}"
+                    result += "\n"
+                return [types.TextContent(type="text", text=result)]
+
+            columnas = {
+                "precio": ("💰 Precio", lambda m: f"{m.get('price', 'N/A')}€"),
+                "calidad": ("🏅 Crianza", lambda m: wine_style(m.get('name')).replace('_', ' ').title()),
+                "region": ("🗺️ Región", lambda m: m.get('region') or 'N/A'),
+                "tipo": ("🍷 Tipo", lambda m: m.get('wine_type') or 'N/A'),
+                "añada": ("📅 Añada", lambda m: m.get('vintage') or 'N/A'),
+                "maridajes": ("🍽️ Maridajes", lambda m: m.get('pairing') or 'N/A'),
+                "puntuacion": ("⭐ Puntuación", lambda m: f"{m.get('rating', 'N/A')}/100")
+            }
+
+            result = f"⚖️ **Comparación de vinos**\n"
+            result += f"**Vinos**: {' vs '.join(registro['metadata'].get('name', nombre) for nombre, registro in encontrados)}\n\n"
+
+            for criterio in criterios:
+                if criterio not in columnas:
+                    continue
+                titulo, valor = columnas[criterio]
+                result += f"**{titulo}:**\n"
+                for _, registro in encontrados:
+                    result += f"• {registro['metadata'].get('name', 'Sin nombre')}: {valor(registro['metadata'])}\n"
+                result += "\n"
+
+            # Relación calidad-precio: puntos por euro entre los vinos con ambos datos
+            valorados = [
+                registro['metadata'] for _, registro in encontrados
+                if isinstance(registro['metadata'].get('price'), (int, float)) and registro['metadata'].get('price')
+                and isinstance(registro['metadata'].get('rating'), (int, float))
+            ]
+            if len(valorados) >= 2:
+                mejor = max(valorados, key=lambda m: m['rating'] / m['price'])
+                result += f"**💡 Mejor relación calidad-precio**: {mejor.get('name')} ({mejor['rating'] / mejor['price']:.1f} puntos/€)\n"
+
+            for nombre, sugerencias in no_encontrados:
+                result += f"\n⚠️ No encontrado: '{nombre}'"
+                if sugerencias:
+                    result += f" (¿quizás {', '.join(sugerencias)}?)"
+            if no_encontrados:
+                result += "\n"
+
+            return [types.TextContent(type="text", text=result)]
+
+        # === HERRAMIENTAS DE CATÁLOGO (sin embeddings ni LLM) ===
+        elif name == "recomendar_por_presupuesto":
+            presupuesto_min = arguments.get("presupuesto_min", 0)
+            presupuesto_max = arguments.get("presupuesto_max")
+            tipo_vino = arguments.get("tipo_vino", "cualquiera")
+            num_recomendaciones = arguments.get("num_recomendaciones", 3)
+            
+            catalog = await rag_engine.wine_catalog()
+            vinos = catalog.by_budget(
+                min_price=presupuesto_min,
+                max_price=presupuesto_max,
+                wine_type=None if tipo_vino == "cualquiera" else tipo_vino,
+                k=num_recomendaciones
+            )
+            
+            result = f"💰 **Recomendaciones por presupuesto**: {presupuesto_min}€ - {presupuesto_max}€\n"
+            result += f"**Tipo**: {tipo_vino.title()}\n\n"
+            result += f"**Encontrados**: {len(vinos)} vinos\n\n"
+            
+            for i, metadata in enumerate(vinos, 1):
+                result += f"**{i}. {metadata.get('name', 'Sin nombre')}**\n"
+                result += f"   • Tipo: {metadata.get('wine_type', 'N/A')}\n"
+                result += f"   • Región: {metadata.get('region', 'N/A')}\n"
+                result += f"   • Precio: {metadata.get('price', 'N/A')}€\n"
+                result += f"   • Puntuación: {metadata.get('rating', 'N/A')}/100\n"
+                result += f"   • Maridaje: {metadata.get('pairing', 'N/A')}\n\n"
+            
+            if not vinos:
+                result += "No hay vinos disponibles en ese rango de precios. Prueba a ampliar el presupuesto o el tipo de vino.\n"
+            
+            return [types.TextContent(type="text", text=result)]
+        
+        elif name == "recomendar_por_region":
+            region = arguments.get("region", "")
+            estilo = arguments.get("estilo", "cualquiera")
+            max_resultados = arguments.get("max_resultados", 5)
+            
+            catalog = await rag_engine.wine_catalog()
+            regiones = catalog.resolve_region(region)
+            vinos = catalog.by_region(region, k=max_resultados, style=estilo)
+            
+            result = f"🗺️ **Vinos de la región**: {region}\n"
+            if regiones and [fold_text(r) for r in regiones] != [fold_text(region)]:
+                result += f"**Regiones encontradas**: {', '.join(regiones)}\n"
+            result += f"**Estilo**: {estilo.replace('_', ' ').title()}\n\n"
+            result += f"**Encontrados**: {len(vinos)} vinos\n\n"
+            
+            for i, metadata in enumerate(vinos, 1):
+                result += f"**{i}. {metadata.get('name', 'Sin nombre')}**\n"
+                result += f"   • Tipo: {metadata.get('wine_type', 'N/A')}\n"
+                result += f"   • Región: {metadata.get('region', 'N/A')}\n"
+                result += f"   • Añada: {metadata.get('vintage', 'N/A')}\n"
+                result += f"   • Precio: {metadata.get('price', 'N/A')}€\n"
+                result += f"   • Puntuación: {metadata.get('rating', 'N/A')}/100\n\n"
+            
+            if not regiones:
+                result += f"No hay vinos de '{region}' en el catálogo. Regiones disponibles: {', '.join(catalog.regions())}\n"
+            elif not vinos:
+                result += "No hay vinos de ese estilo en la región. Prueba con el estilo 'cualquiera'.\n"
+            
+            return [types.TextContent(type="text", text=result)]
+        
+        # === HERRAMIENTAS DE GESTIÓN DE BODEGA ===
+        elif name == "calcular_inventario":
+            filtros = arguments.get("filtros") or {}
+            estadisticas = arguments.get("incluir_estadisticas") or ["stock_total", "valor_total", "precio_promedio"]
+            umbral = arguments.get("umbral_stock_bajo", INVENTORY_LOW_STOCK_THRESHOLD)
+            
+            inventory = await rag_engine.inventory_table()
+            regiones = None
+            if filtros.get("region"):
+                catalog = await rag_engine.wine_catalog()
+                regiones = catalog.resolve_region(filtros["region"]) or [filtros["region"]]
+            
+            informe = inventory.report(
+                estadisticas,
+                wine_type=filtros.get("tipo"),
+                regions=regiones,
+                min_price=filtros.get("precio_min"),
+                max_price=filtros.get("precio_max"),
+                low_stock_threshold=umbral
+            )
+            
+            result = f"📦 **Inventario de vinos**\n"
+            filtros_texto = ", ".join(f"{clave}: {valor}" for clave, valor in filtros.items() if valor is not None)
+            result += f"**Filtros**: {filtros_texto or 'ninguno'}\n"
+            result += f"**Vinos**: {informe['vinos']}\n\n"
+            
+            if "stock_total" in informe:
+                result += f"• Stock total: {informe['stock_total']} botellas\n"
+            if "valor_total" in informe:
+                result += f"• Valor total: {informe['valor_total']:.2f}€\n"
+            if "precio_promedio" in informe:
+                precio_promedio = informe['precio_promedio']
+                result += f"• Precio promedio: {f'{precio_promedio:.2f}€' if precio_promedio is not None else 'N/A'}\n"
+            if "percentiles_precio" in informe:
+                percentiles = " · ".join(f"{p}: {valor:.2f}€" for p, valor in informe['percentiles_precio'].items())
+                result += f"• Percentiles de precio: {percentiles or 'N/A'}\n"
+            
+            for clave, titulo in (("por_tipo", "Por tipo"), ("por_region", "Por región")):
+                if clave in informe:
+                    result += f"\n**{titulo}:**\n"
+                    for etiqueta, grupo in sorted(informe[clave].items(), key=lambda item: -item[1]['valor']):
+                        result += f"• {etiqueta}: {grupo['vinos']} vinos, {grupo['stock']} botellas, {grupo['valor']:.2f}€\n"
+            if "por_añada" in informe:
+                result += f"\n**Por añada:**\n"
+                for anada, stock in informe['por_añada'].items():
+                    result += f"• {anada}: {stock} botellas\n"
+            if "stock_bajo" in informe:
+                result += f"\n**⚠️ Stock bajo (≤ {umbral} unidades):**\n"
+                for vino in informe['stock_bajo']:
+                    result += f"• {vino['name']}: {vino['stock']} botellas\n"
+                if not informe['stock_bajo']:
+                    result += "• Ningún vino por debajo del umbral\n"
+            
+            return [types.TextContent(type="text", text=result)]
         
         # Herramienta no encontrada
         else:
@@ -839,43 +2069,82 @@ async def list_resources() -> List[types.Resource]:
         types.Resource(
             uri="knowledge://documents",
             name="Documents Collection",
-            description="Colección completa de documentos",
+            description=(
+                "Colección de documentos paginada. Parámetros: cursor, limit "
+                f"(máx. {RESOURCE_MAX_PAGE_SIZE}) y fields (id, content, metadata, metadata.<clave>)"
+            ),
             mimeType="application/json"
         )
     ]
 
+def _parse_documents_query(query: str) -> Dict[str, Any]:
+    """Leer cursor, limit y fields de la query de knowledge://documents"""
+    params = parse_qs(query)
+    cursor = int(params.get("cursor", ["0"])[0] or 0)
+    limit = int(params.get("limit", [str(RESOURCE_PAGE_SIZE)])[0] or RESOURCE_PAGE_SIZE)
+    fields = [
+        field.strip()
+        for value in params.get("fields", ["content,metadata"])
+        for field in value.split(",") if field.strip()
+    ]
+    if cursor < 0 or limit < 1:
+        raise ValueError("cursor debe ser >= 0 y limit >= 1")
+    return {"cursor": cursor, "limit": min(limit, RESOURCE_MAX_PAGE_SIZE), "fields": fields}
+
 @mcp_server.read_resource()
 async def read_resource(uri: str) -> str:
     """Leer recurso solicitado"""
-    if uri == "knowledge://stats":
+    parsed_uri = urlsplit(str(uri))
+    resource = f"{parsed_uri.scheme}://{parsed_uri.netloc}{parsed_uri.path}"
+    
+    if resource == "knowledge://stats":
         if rag_engine.collection:
-            stats = rag_engine.collection.get()
             response = {
-                "total_documents": len(stats['ids']),
+                "total_documents": rag_engine.collection.count(),
+                "documents_by_type": await rag_engine.document_type_counts(),
                 "collection_name": "rag_documents",
                 "vector_db_type": VECTOR_DB_TYPE,
-                "embedding_model": "all-MiniLM-L6-v2"
+                "embedding_model": EMBEDDING_MODEL,
+                "embedding_cache": rag_engine.embedding_cache.stats()
             }
-            return json.dumps(response, indent=2)
+            return json.dumps(response, indent=2, ensure_ascii=False)
         else:
             return json.dumps({"error": "Colección no inicializada"})
             
-    elif uri == "knowledge://documents":
+    elif resource == "knowledge://documents":
         if rag_engine.collection:
-            docs = rag_engine.collection.get()
+            page = _parse_documents_query(parsed_uri.query)
+            fields = page["fields"]
+            metadata_keys = [field.split(".", 1)[1] for field in fields if field.startswith("metadata.")]
+            
+            # Proyección: solo se piden a la colección los campos solicitados
+            include = []
+            if "content" in fields:
+                include.append('documents')
+            if "metadata" in fields or metadata_keys:
+                include.append('metadatas')
+            
+            docs = rag_engine.collection.get(include=include, limit=page["limit"], offset=page["cursor"])
+            
+            documents = []
+            for i, doc_id in enumerate(docs['ids']):
+                document = {"id": doc_id}
+                if "content" in fields:
+                    content = docs['documents'][i]
+                    document["content"] = content[:200] + "..." if len(content) > 200 else content
+                if "metadata" in fields:
+                    document["metadata"] = docs['metadatas'][i]
+                elif metadata_keys:
+                    metadata = docs['metadatas'][i] or {}
+                    document["metadata"] = {key: metadata.get(key) for key in metadata_keys}
+                documents.append(document)
+            
+            has_more = len(documents) == page["limit"]
             response = {
-                "documents": [
-                    {
-                        "id": doc_id,
-                        "content": content[:200] + "..." if len(content) > 200 else content,
-                        "metadata": metadata
-                    }
-                    for doc_id, content, metadata in zip(
-                        docs['ids'],
-                        docs['documents'],
-                        docs['metadatas']
-                    )
-                ]
+                "documents": documents,
+                "cursor": str(page["cursor"]),
+                "next_cursor": str(page["cursor"] + len(documents)) if has_more else None,
+                "limit": page["limit"]
             }
             return json.dumps(response, indent=2, ensure_ascii=False)
         else:
@@ -886,78 +2155,228 @@ async def read_resource(uri: str) -> str:
 # FastAPI para HTTP (opcional)
 app = FastAPI(title="Agentic RAG MCP Server", version="1.0.0")
 
-@app.on_event("startup")
-async def startup_event():
-    """Inicializar al arrancar"""
-    await rag_engine.initialize()
+# Tarea de arranque en segundo plano (STARTUP_MODE=background)
+_startup_task: Optional[asyncio.Task] = None
+
+# Versión del formato de los documentos generados: al cambiarla se reindexan todos los archivos
+KNOWLEDGE_DOCUMENT_FORMAT = 3
+
+def _knowledge_file_documents(file_path: Path) -> List[Dict[str, Any]]:
+    """Documentos a indexar para un archivo de la base de conocimiento"""
+    if file_path.suffix == ".txt":
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        return [{
+            "content": content,
+            "metadata": {"source": file_path.name, "type": "text"},
+            "doc_id": file_path.stem
+        }]
     
-    # Cargar documentos de ejemplo si existen
-    knowledge_dir = Path("/app/knowledge_base")
-    if knowledge_dir.exists():
-        # Cargar archivos de texto
-        for file_path in knowledge_dir.glob("*.txt"):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    metadata = {"source": file_path.name, "type": "text"}
-                    await rag_engine.add_document(content, metadata, file_path.stem)
-                logger.info(f"Documento de texto cargado: {file_path.name}")
-            except Exception as e:
-                logger.error(f"Error cargando archivo de texto {file_path}: {e}")
-        
-        # Cargar archivos JSON (vinos)
-        for file_path in knowledge_dir.glob("*.json"):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    
-                # Si es el archivo de vinos
-                if file_path.name == "vinos.json" and isinstance(data, list):
-                    logger.info(f"Cargando {len(data)} vinos desde {file_path.name}")
-                    for i, vino in enumerate(data):
-                        # Crear contenido estructurado para cada vino
-                        content = f"""Vino: {vino.get('name', 'Sin nombre')}
+    with open(file_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    
+    # Para JSON que no son el archivo de vinos, cargar como documento único
+    if file_path.name != "vinos.json" or not isinstance(data, list):
+        return [{
+            "content": json.dumps(data, indent=2, ensure_ascii=False),
+            "metadata": {"source": file_path.name, "type": "json"},
+            "doc_id": file_path.stem
+        }]
+    
+    wine_documents = []
+    for i, vino in enumerate(data):
+        # Crear contenido estructurado para cada vino
+        content = f"""Vino: {vino.get('name', 'Sin nombre')}
 Tipo: {vino.get('type', 'Sin tipo')}
 Región: {vino.get('region', 'Sin región')}
+Uva: {vino.get('grape', 'Sin uva')}
 Año: {vino.get('vintage', 'Sin año')}
 Precio: {vino.get('price', 'Sin precio')}€
 Stock: {vino.get('stock', 'Sin stock')} unidades
 Maridaje: {vino.get('pairing', 'Sin maridaje')}
 Descripción: {vino.get('description', 'Sin descripción')}
 Puntuación: {vino.get('rating', 'Sin puntuación')}/100"""
-                        
-                        # Metadata rica para búsquedas
-                        metadata = {
-                            "source": file_path.name,
-                            "type": "vino",
-                            "name": vino.get('name', ''),
-                            "wine_type": vino.get('type', ''),
-                            "region": vino.get('region', ''),
-                            "vintage": vino.get('vintage', ''),
-                            "price": vino.get('price', ''),
-                            "rating": vino.get('rating', ''),
-                            "pairing": vino.get('pairing', ''),
-                            "index": i
-                        }
-                        
-                        doc_id = f"vino_{i}_{vino.get('name', 'sin_nombre').replace(' ', '_')}"
-                        await rag_engine.add_document(content, metadata, doc_id)
-                    
-                    logger.info(f"✅ {len(data)} vinos cargados exitosamente desde {file_path.name}")
-                else:
-                    # Para otros archivos JSON, cargar como documento único
-                    content = json.dumps(data, indent=2, ensure_ascii=False)
-                    metadata = {"source": file_path.name, "type": "json"}
-                    await rag_engine.add_document(content, metadata, file_path.stem)
-                    logger.info(f"Documento JSON cargado: {file_path.name}")
-                    
-            except Exception as e:
-                logger.error(f"Error cargando archivo JSON {file_path}: {e}")
+        
+        # Metadata rica para búsquedas
+        metadata = {
+            "source": file_path.name,
+            "type": "vino",
+            "name": vino.get('name', ''),
+            "wine_type": vino.get('type', ''),
+            "region": vino.get('region', ''),
+            "grape": vino.get('grape', ''),
+            "winery": vino.get('winery', ''),
+            "vintage": vino.get('vintage', ''),
+            "price": vino.get('price', ''),
+            "stock": vino.get('stock', ''),
+            "rating": vino.get('rating', ''),
+            "pairing": vino.get('pairing', ''),
+            "description": vino.get('description', ''),
+            "alcohol": vino.get('alcohol', ''),
+            "temperature": vino.get('temperature', ''),
+            "index": i
+        }
+        
+        doc_id = f"vino_{i}_{vino.get('name', 'sin_nombre').replace(' ', '_')}"
+        wine_documents.append({"content": content, "metadata": metadata, "doc_id": doc_id})
+    
+    return wine_documents
+
+def _file_sha256(file_path: Path) -> str:
+    """Hash del contenido de un archivo"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _manifest_path() -> Optional[Path]:
+    """Ruta del manifiesto de archivos indexados (solo con índice persistente)"""
+    persist_dir = NUMPY_STORE_DIR if VECTOR_DB_TYPE == "numpy" else CHROMA_PERSIST_DIR
+    return Path(persist_dir) / "knowledge_manifest.json" if persist_dir else None
+
+def _load_manifest() -> Dict[str, Any]:
+    path = _manifest_path()
+    if path is None or not path.exists():
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Manifiesto de la base de conocimiento ilegible, se reindexa todo: {e}")
+        return {}
+
+def _save_manifest(manifest: Dict[str, Any]):
+    path = _manifest_path()
+    if path is None:
+        return
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    tmp_path.replace(path)
+
+async def load_knowledge_base(knowledge_dir: Path):
+    """
+    Sincronizar la base de conocimiento con el índice vectorial
+    
+    Con índice persistente, un manifiesto guarda el hash y los IDs de cada archivo:
+    solo se reindexan los archivos nuevos o modificados, y se eliminan los
+    documentos de archivos borrados o cambiados.
+    """
+    # Un índice vacío (p. ej. en memoria) invalida cualquier manifiesto previo
+    manifest = _load_manifest() if rag_engine.collection.count() > 0 else {}
+    updated_manifest = {}
+    
+    for file_path in sorted(list(knowledge_dir.glob("*.txt")) + list(knowledge_dir.glob("*.json"))):
+        try:
+            file_hash = _file_sha256(file_path)
+            previous = manifest.get(file_path.name)
+            if previous and previous.get("sha256") == file_hash and previous.get("format") == KNOWLEDGE_DOCUMENT_FORMAT:
+                updated_manifest[file_path.name] = previous
+                logger.info(f"Sin cambios, se reutiliza el índice: {file_path.name}")
+                continue
+            
+            documents = _knowledge_file_documents(file_path)
+            if previous:
+                await rag_engine.delete_documents(previous.get("doc_ids", []))
+            # Upsert: sin manifiesto (o con uno anterior) un documento cambiado conserva su ID
+            doc_ids = await rag_engine.add_documents(documents, upsert=True)
+            updated_manifest[file_path.name] = {"sha256": file_hash, "format": KNOWLEDGE_DOCUMENT_FORMAT, "doc_ids": doc_ids}
+            logger.info(f"✅ {len(doc_ids)} documentos cargados desde {file_path.name}")
+            
+        except Exception as e:
+            logger.error(f"Error cargando archivo {file_path}: {e}")
+            # Conservar la entrada anterior: sus documentos siguen localizados y se reintenta al próximo arranque
+            if file_path.name in manifest:
+                updated_manifest[file_path.name] = manifest[file_path.name]
+    
+    # Archivos eliminados desde el último arranque
+    for file_name, entry in manifest.items():
+        if file_name not in updated_manifest:
+            await rag_engine.delete_documents(entry.get("doc_ids", []))
+            logger.info(f"Documentos de {file_name} eliminados del índice")
+    
+    _save_manifest(updated_manifest)
+    if VECTOR_DB_TYPE == "numpy":
+        # El almacén numpy añade cada escritura a su diario: una sola instantánea al terminar la sincronización
+        await asyncio.to_thread(rag_engine.collection.flush)
+
+async def _load_engine():
+    """Cargar modelo, índice y base de conocimiento"""
+    try:
+        await rag_engine.warm_up()
+        
+        # Cargar documentos de ejemplo si existen
+        knowledge_dir = Path(KNOWLEDGE_BASE_DIR)
+        if knowledge_dir.exists():
+            await load_knowledge_base(knowledge_dir)
+        
+        # Índices del catálogo listos antes de aceptar consultas
+        await rag_engine.wine_catalog()
+        
+        rag_engine.ready = True
+        logger.info("✅ Motor RAG listo")
+    except Exception as e:
+        logger.error(f"Error cargando el motor RAG: {e}")
+        raise
+
+async def ensure_engine_ready():
+    """Esperar a que termine la carga en segundo plano, o inicializar si no se lanzó"""
+    task = _startup_task
+    if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+        await asyncio.shield(task)
+    elif rag_engine.collection is None:
+        await rag_engine.initialize()
+
+@app.on_event("startup")
+async def startup_event():
+    """Inicializar al arrancar"""
+    global _startup_task
+    if STARTUP_MODE == "background":
+        # El puerto queda abierto mientras se cargan modelo e índice
+        _startup_task = asyncio.create_task(_load_engine())
+    else:
+        await _load_engine()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Cancelar la carga en segundo plano si sigue en curso"""
+    if _startup_task is not None and not _startup_task.done():
+        _startup_task.cancel()
 
 @app.get("/health")
 async def health_check():
     """Verificación de salud"""
-    return {"status": "healthy", "vector_db": VECTOR_DB_TYPE}
+    return {"status": "healthy", "vector_db": VECTOR_DB_TYPE, "ready": rag_engine.ready}
+
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: el proceso responde, aunque el motor siga cargando"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: modelo, índice y base de conocimiento cargados"""
+    if not rag_engine.ready:
+        failed = _startup_task is not None and _startup_task.done() and not _startup_task.cancelled() and _startup_task.exception() is not None
+        raise HTTPException(
+            status_code=503,
+            detail="Error cargando el motor RAG" if failed else "Motor RAG cargando"
+        )
+    return {"status": "ready", "documents": rag_engine.collection.count()}
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas internas del motor RAG"""
+    return {
+        "embedding_cache": rag_engine.embedding_cache.stats(),
+        "embedding_executor": rag_engine.embedding_executor.stats(),
+        "tool_cache": rag_engine.tool_cache.stats(),
+        "expansion_cache": rag_engine.expansion_cache.stats(),
+        "retrieval_paths": dict(rag_engine.retrieval_paths),
+        "expansion_sources": dict(rag_engine.expansion_sources),
+        "reranker": rag_engine.reranker.stats()
+    }
 
 @app.post("/query")
 async def query_rag_mcp(query_data: QueryRequest):
@@ -966,42 +2385,59 @@ async def query_rag_mcp(query_data: QueryRequest):
 
     try:
         # Asegurar que rag_engine esté inicializado
-        if rag_engine.collection is None:
-            await rag_engine.initialize()
-
-        # Paso 1: Obtener embeddings de la consulta
-        start_embedding = time.time()
-        query_embedding = rag_engine._embed_text(query_data.query)
-        end_embedding = time.time()
-        logger.info(f"Tiempo para obtener embedding de la consulta: {end_embedding - start_embedding:.4f}s")
-
-        # Paso 2: Buscar documentos relevantes en ChromaDB
-        start_chroma_search = time.time()
-        results = rag_engine.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=query_data.max_results,
-            include=['documents', 'metadatas', 'distances']
-        )
-        end_chroma_search = time.time()
-        logger.info(f"Tiempo para buscar en ChromaDB: {end_chroma_search - start_chroma_search:.4f}s")
-
-        # Procesar resultados
-        documents = results['documents'][0] if results and 'documents' in results else []
-        metadatas = results['metadatas'][0] if results and 'metadatas' in results else []
-        distances = results['distances'][0] if results and 'distances' in results else []
-
-        # Construir fuentes
-        sources = []
-        context_str = ""
-        for i, (doc_content, metadata, distance) in enumerate(zip(documents, metadatas, distances)):
-            source_entry = {
-                "content": doc_content,
-                "metadata": metadata,
-                "relevance_score": 1 - distance,
-                "rank": i + 1
-            }
-            sources.append(source_entry)
-            context_str += f"Fuente {i+1}:\n{doc_content}\n\n"
+        await ensure_engine_ready()
+
+        retrieval_mode = query_data.retrieval_mode or RETRIEVAL_MODE
+        filters = query_data.filters.model_dump(exclude_none=True) if query_data.filters else None
+        rerank_budget_ms = AgenticRAGEngine.rerank_budget(query_data.rerank_budget_ms)
+        candidates = max(query_data.max_results, RERANK_CANDIDATES) if rerank_budget_ms > 0 else query_data.max_results
+        if retrieval_mode == "hybrid":
+            # Pasos 1-2: búsqueda híbrida (BM25 + vectores fusionados por RRF)
+            start_hybrid_search = time.time()
+            sources = await rag_engine.hybrid_search(query_data.query, max_results=candidates, filters=filters)
+            end_hybrid_search = time.time()
+            logger.info(f"Tiempo para la búsqueda híbrida: {end_hybrid_search - start_hybrid_search:.4f}s")
+        else:
+            # Paso 1: Obtener embeddings de la consulta
+            start_embedding = time.time()
+            query_embedding = await rag_engine.embed_text(query_data.query)
+            end_embedding = time.time()
+            logger.info(f"Tiempo para obtener embedding de la consulta: {end_embedding - start_embedding:.4f}s")
+
+            # Paso 2: Buscar documentos relevantes en ChromaDB
+            start_chroma_search = time.time()
+            filters = await rag_engine.resolve_filters(filters)
+            results = rag_engine.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=candidates,
+                include=['documents', 'metadatas', 'distances'],
+                **AgenticRAGEngine.where_kwargs(filters)
+            )
+            end_chroma_search = time.time()
+            logger.info(f"Tiempo para buscar en ChromaDB: {end_chroma_search - start_chroma_search:.4f}s")
+
+            # Procesar resultados
+            documents = results['documents'][0] if results and 'documents' in results else []
+            metadatas = results['metadatas'][0] if results and 'metadatas' in results else []
+            distances = results['distances'][0] if results and 'distances' in results else []
+
+            # Construir fuentes
+            sources = []
+            for i, (doc_content, metadata, distance) in enumerate(zip(documents, metadatas, distances)):
+                sources.append({
+                    "content": doc_content,
+                    "metadata": metadata,
+                    "relevance_score": 1 - distance,
+                    "rank": i + 1
+                })
+
+        # Paso 2b: Reranking con cross-encoder (opcional, acotado en tiempo)
+        rerank_report = None
+        if rerank_budget_ms > 0:
+            sources, rerank_report = await rag_engine.rerank_sources(query_data.query, sources, query_data.max_results, rerank_budget_ms)
+            logger.info(f"Tiempo para el reranking: {rerank_report['ms'] / 1000:.4f}s ({rerank_report['status']})")
+
+        context_str = "".join(f"Fuente {i+1}:\n{source['content']}\n\n" for i, source in enumerate(sources))
 
         # Paso 3: Generar respuesta usando OpenAI
         start_openai_call = time.time()
@@ -1014,7 +2450,7 @@ async def query_rag_mcp(query_data: QueryRequest):
                 ]
                 
                 logger.info(f"Intentando llamada a OpenAI con modelo: {OPENAI_MODEL}")
-                response = rag_engine.openai_client.chat.completions.create(
+                response = await rag_engine.chat_completion(
                     model=OPENAI_MODEL,
                     messages=messages,
                     temperature=0.7,
@@ -1042,7 +2478,8 @@ async def query_rag_mcp(query_data: QueryRequest):
         return {
             "answer": llm_answer,
             "sources": sources,
-            "context_used": {"query": query_data.query, "context": context_str}
+            "context_used": {"query": query_data.query, "context": context_str},
+            "rerank": rerank_report
         }
 
     except Exception as e:
@@ -1056,6 +2493,7 @@ async def query_rag_mcp(query_data: QueryRequest):
 @app.post("/documents")
 async def add_document_endpoint(request: DocumentRequest):
     """Endpoint HTTP para agregar documentos"""
+    await ensure_engine_ready()
     doc_id = await rag_engine.add_document(
         request.content,
         request.metadata,
@@ -1063,6 +2501,15 @@ async def add_document_endpoint(request: DocumentRequest):
     )
     return {"doc_id": doc_id, "status": "added"}
 
+@app.post("/documents/bulk")
+async def add_documents_endpoint(request: BulkDocumentRequest):
+    """Endpoint HTTP para agregar documentos en lote"""
+    await ensure_engine_ready()
+    doc_ids = await rag_engine.add_documents([
+        document.model_dump() for document in request.documents
+    ])
+    return {"doc_ids": doc_ids, "status": "added", "count": len(doc_ids)}
+
 @app.get("/debug/connectivity")
 async def debug_connectivity():
     """Endpoint de diagnóstico de conectividad"""
@@ -1095,7 +2542,7 @@ async def debug_connectivity():
     # Test 4: Test con OpenAI client
     try:
         if rag_engine.openai_client:
-            test_response = rag_engine.openai_client.chat.completions.create(
+            test_response = await rag_engine.openai_client.chat.completions.create(
                 model="gpt-3.5-turbo",
                 messages=[{"role": "user", "content": "test"}],
                 max_tokens=5,
@@ -1147,13 +2594,8 @@ async def main():
         import uvicorn
         uvicorn.run(app, host="0.0.0.0", port=8000)
     else:
-        # Modo MCP stdio por defecto
-        await rag_engine.initialize()
-        
-        # Cargar documentos desde directorio local si existe
-        knowledge_dir = Path("knowledge_base")
-        if knowledge_dir.exists():
-            await startup_event()
+        # Modo MCP stdio por defecto: carga completa antes de atender al cliente
+        await _load_engine()
         
         async with stdio_server() as (read_stream, write_stream):
             await mcp_server.run(
@@ -0,0 +1,109 @@
+"""
+Índice de nombres de vino
+Búsqueda exacta por nombre normalizado (hash) y búsqueda aproximada por
+trigramas, tolerante a erratas, acentos y nombres incompletos
+"""
+
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sparse_index import fold_text
+
+def normalize_name(name: str) -> str:
+    """Nombre sin acentos, mayúsculas ni signos de puntuación"""
+    return " ".join(re.findall(r"[a-z0-9]+", fold_text(str(name or ""))))
+
+def trigrams(name: str) -> Set[str]:
+    """Trigramas de cada palabra con relleno ("  rioja " -> "  r", " ri", "rio"...)"""
+    grams = set()
+    for word in normalize_name(name).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class NameIndex:
+    """
+    Nombre de vino -> IDs de documento
+
+    La búsqueda exacta es un dict por nombre normalizado. La aproximada
+    cuenta los trigramas compartidos a través de un índice invertido
+    trigrama -> IDs y puntúa cada candidato como la media entre la cobertura
+    de la consulta y el coeficiente de Dice, así que "albarino rias baxas"
+    y "Albariño" encuentran "Albariño Rías Baixas".
+    """
+
+    def __init__(self, min_similarity: float = 0.45):
+        self.min_similarity = min_similarity
+        self._exact: Dict[str, Set[str]] = {}
+        self._names: Dict[str, str] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self._postings: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._names
+
+    def add(self, doc_ids: Iterable[str], names: Iterable[str]):
+        """Indexar nombres (los IDs ya indexados o sin nombre se ignoran)"""
+        with self._lock:
+            for doc_id, name in zip(doc_ids, names):
+                if not name or doc_id in self._names:
+                    continue
+                self._names[doc_id] = name
+                self._exact.setdefault(normalize_name(name), set()).add(doc_id)
+                grams = trigrams(name)
+                self._grams[doc_id] = grams
+                for gram in grams:
+                    self._postings.setdefault(gram, set()).add(doc_id)
+
+    def remove(self, doc_ids: Iterable[str]):
+        """Eliminar nombres del índice"""
+        with self._lock:
+            for doc_id in doc_ids:
+                name = self._names.pop(doc_id, None)
+                if name is None:
+                    continue
+                key = normalize_name(name)
+                self._exact[key].discard(doc_id)
+                if not self._exact[key]:
+                    del self._exact[key]
+                for gram in self._grams.pop(doc_id):
+                    self._postings[gram].discard(doc_id)
+                    if not self._postings[gram]:
+                        del self._postings[gram]
+
+    def lookup(self, name: str, limit: int = 3, min_similarity: float = None) -> List[Tuple[str, str, float]]:
+        """
+        Resolver un nombre a documentos como tuplas (id, nombre, similitud)
+
+        Una coincidencia exacta devuelve similitud 1.0 y corta la búsqueda;
+        si no, los candidatos aproximados por encima de `min_similarity`
+        (por defecto, el umbral del índice).
+        """
+        threshold = self.min_similarity if min_similarity is None else min_similarity
+        with self._lock:
+            exact = self._exact.get(normalize_name(name))
+            if exact:
+                return [(doc_id, self._names[doc_id], 1.0) for doc_id in sorted(exact)][:limit]
+
+            query_grams = trigrams(name)
+            if not query_grams:
+                return []
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self._postings.get(gram, ()))
+
+            matches = []
+            for doc_id, overlap in shared.items():
+                coverage = overlap / len(query_grams)
+                dice = 2 * overlap / (len(query_grams) + len(self._grams[doc_id]))
+                score = (coverage + dice) / 2
+                if score >= threshold:
+                    matches.append((doc_id, self._names[doc_id], round(score, 3)))
+            matches.sort(key=lambda match: (-match[2], match[1]))
+            return matches[:limit]
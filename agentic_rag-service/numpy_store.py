@@ -0,0 +1,399 @@
+"""
+Almacén vectorial en proceso basado en numpy
+Búsqueda exacta top-k con productos escalares vectorizados y filtros por metadatos,
+con la misma interfaz de colección que usa AgenticRAGEngine con ChromaDB
+"""
+
+import base64
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_COMPARISONS = {
+    '$gt': np.greater,
+    '$gte': np.greater_equal,
+    '$lt': np.less,
+    '$lte': np.less_equal,
+}
+
+def where_mask(where: Optional[Dict[str, Any]], column: Callable[..., np.ndarray], size: int) -> np.ndarray:
+    """
+    Evaluar un filtro `where` con la sintaxis de ChromaDB como máscara booleana
+
+    Soporta igualdad implícita ({"type": "vino"}), $eq, $ne, $gt, $gte, $lt, $lte,
+    $in, $nin, $and y $or. `column(key, numeric=False)` devuelve los valores de un
+    metadato para todas las filas: como objetos (None si falta) o, con
+    numeric=True, como float64 (NaN si falta o no es numérico).
+    """
+    mask = np.ones(size, dtype=bool)
+    if not where:
+        return mask
+
+    for key, condition in where.items():
+        if key == '$and':
+            for clause in condition:
+                mask &= where_mask(clause, column, size)
+        elif key == '$or':
+            any_mask = np.zeros(size, dtype=bool)
+            for clause in condition:
+                any_mask |= where_mask(clause, column, size)
+            mask &= any_mask
+        else:
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for operator, operand in condition.items():
+                mask &= _compare(column, key, operator, operand, size)
+    return mask
+
+def _compare(column: Callable[..., np.ndarray], key: str, operator: str, operand: Any, size: int) -> np.ndarray:
+    if operator in _COMPARISONS:
+        # Comparación numérica: los valores no numéricos (NaN) nunca cumplen el filtro
+        with np.errstate(invalid='ignore'):
+            return _COMPARISONS[operator](column(key, numeric=True), operand)
+
+    values = column(key)
+    if operator == '$eq':
+        return np.asarray(values == operand, dtype=bool)
+    if operator == '$ne':
+        return np.asarray(values != operand, dtype=bool)
+    if operator in ('$in', '$nin'):
+        matches = np.zeros(size, dtype=bool)
+        for option in operand:
+            matches |= np.asarray(values == option, dtype=bool)
+        return matches if operator == '$in' else ~matches
+    raise ValueError(f"Operador de filtro no soportado: {operator}")
+
+def metadata_column(metadatas: List[Dict[str, Any]], key: str, numeric: bool = False) -> np.ndarray:
+    """Columna de un metadato a partir de una lista de diccionarios"""
+    if numeric:
+        return np.array([
+            value if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+            for value in (metadata.get(key) for metadata in metadatas)
+        ], dtype=np.float64)
+    column = np.empty(len(metadatas), dtype=object)
+    column[:] = [metadata.get(key) for metadata in metadatas]
+    return column
+
+class NumpyVectorStore:
+    """
+    Colección vectorial en memoria con matriz float32 contigua
+
+    Los vectores se guardan normalizados, así que la similitud coseno es un
+    producto escalar y la distancia devuelta es 1 - similitud (como ChromaDB
+    con hnsw:space=cosine). Con `path`, la colección se persiste en disco: una
+    instantánea (embeddings.npy + records.json, la matriz se abre con
+    np.load(mmap_mode='r')) y un diario append-only (journal.jsonl) con las
+    escrituras posteriores. Cada escritura solo añade sus filas al diario, fuera
+    del lock de lectura; flush() vuelca el diario a una instantánea nueva.
+    """
+
+    JOURNAL_FILE = "journal.jsonl"
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else None
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._documents: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._size = 0
+        self._columns: Dict[tuple, np.ndarray] = {}
+        self._pending: List[Dict[str, Any]] = []  # Entradas del diario aún sin escribir
+        self._dirty = False  # Hay escrituras posteriores a la última instantánea
+        self._io_lock = threading.Lock()  # Serializa la escritura del diario y las instantáneas
+
+        if self.path is not None:
+            self._load()
+
+    # === PERSISTENCIA ===
+
+    def _load(self):
+        records_path = self.path / "records.json"
+        matrix_path = self.path / "embeddings.npy"
+        if records_path.exists() and matrix_path.exists():
+            with open(records_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            self._ids = records['ids']
+            self._documents = records['documents']
+            self._metadatas = records['metadatas']
+            self._id_to_row = {doc_id: row for row, doc_id in enumerate(self._ids)}
+            self._matrix = np.load(matrix_path, mmap_mode='r')
+            self._size = len(self._ids)
+
+        replayed = self._replay_journal()
+        if replayed:
+            self._dirty = True
+            self.flush()
+            self._matrix = np.load(matrix_path, mmap_mode='r')
+        logger.info(f"Almacén numpy cargado: {self._size} vectores desde {self.path} ({replayed} escrituras del diario)")
+
+    def _replay_journal(self) -> int:
+        """Aplicar las escrituras del diario posteriores a la instantánea"""
+        journal_path = self.path / self.JOURNAL_FILE
+        if not journal_path.exists():
+            return 0
+        replayed = 0
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Línea incompleta de una escritura interrumpida
+                if entry['op'] == 'add':
+                    vectors = np.frombuffer(base64.b64decode(entry['vectors']), dtype=np.float32).reshape(len(entry['ids']), -1)
+                    self._apply_add(entry['ids'], vectors, entry['documents'], entry['metadatas'])
+                elif entry['op'] == 'delete':
+                    self._apply_delete(entry['ids'])
+                replayed += 1
+        return replayed
+
+    def _write_pending(self):
+        """Añadir al diario las escrituras pendientes (fuera del lock de lectura)"""
+        if self.path is None:
+            return
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.path / self.JOURNAL_FILE, 'a', encoding='utf-8') as f:
+                for entry in pending:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        """
+        Volcar el estado a una instantánea nueva y vaciar el diario
+
+        Es O(N): se llama una vez al terminar una carga, no por escritura. Bajo
+        el lock de lectura solo se toma una vista del estado; la matriz activa
+        no se modifica después (add escribe filas nuevas y delete crea otra).
+        """
+        if self.path is None:
+            return
+        with self._io_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                self._pending = []  # Ya incluidas en la instantánea
+                matrix = self._active_matrix()
+                records = {
+                    'ids': list(self._ids),
+                    'documents': list(self._documents),
+                    'metadatas': list(self._metadatas)
+                }
+
+            self.path.mkdir(parents=True, exist_ok=True)
+            matrix_tmp = self.path / "embeddings.tmp.npy"
+            records_tmp = self.path / "records.tmp.json"
+            np.save(matrix_tmp, matrix)
+            with open(records_tmp, 'w', encoding='utf-8') as f:
+                json.dump(records, f, ensure_ascii=False)
+            matrix_tmp.replace(self.path / "embeddings.npy")
+            records_tmp.replace(self.path / "records.json")
+            (self.path / self.JOURNAL_FILE).unlink(missing_ok=True)
+
+    # === ESCRITURA ===
+
+    def _active_matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._matrix[:self._size]
+
+    def _ensure_capacity(self, extra_rows: int, dim: int):
+        """Reservar filas por duplicación para que añadir sea O(1) amortizado"""
+        needed = self._size + extra_rows
+        if self._matrix is not None and self._matrix.shape[1] != dim:
+            raise ValueError(f"Dimensión de embedding {dim} distinta de la colección ({self._matrix.shape[1]})")
+
+        writable = isinstance(self._matrix, np.ndarray) and not isinstance(self._matrix, np.memmap)
+        if self._matrix is not None and writable and self._matrix.shape[0] >= needed:
+            return
+
+        capacity = max(needed, 2 * (self._matrix.shape[0] if self._matrix is not None else 0), 64)
+        matrix = np.empty((capacity, dim), dtype=np.float32)
+        if self._size:
+            matrix[:self._size] = self._matrix[:self._size]
+        self._matrix = matrix
+
+    def add(self, ids: List[str], embeddings, documents: List[str] = None, metadatas: List[Dict[str, Any]] = None):
+        """Agregar documentos (los IDs ya existentes se ignoran, como en ChromaDB)"""
+        with self._lock:
+            self._add_locked(ids, embeddings, documents, metadatas)
+        self._write_pending()
+
+    def upsert(self, ids: List[str], embeddings, documents: List[str] = None, metadatas: List[Dict[str, Any]] = None):
+        """Agregar documentos reemplazando los que ya existen con el mismo ID"""
+        with self._lock:
+            existing = [doc_id for doc_id in dict.fromkeys(ids) if doc_id in self._id_to_row]
+            if existing:
+                self._delete_locked(existing)
+            self._add_locked(ids, embeddings, documents, metadatas)
+        self._write_pending()
+
+    def _add_locked(self, ids: List[str], embeddings, documents: List[str] = None, metadatas: List[Dict[str, Any]] = None):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        documents = documents or [""] * len(ids)
+        metadatas = metadatas or [{}] * len(ids)
+        seen = set()
+        rows = []
+        for i, doc_id in enumerate(ids):
+            if doc_id in self._id_to_row or doc_id in seen:
+                logger.warning(f"ID existente, se ignora: {doc_id}")
+                continue
+            seen.add(doc_id)
+            rows.append(i)
+        if not rows:
+            return
+
+        vectors = embeddings[rows]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        new_ids = [ids[i] for i in rows]
+        new_documents = [documents[i] for i in rows]
+        new_metadatas = [metadatas[i] or {} for i in rows]
+        self._apply_add(new_ids, vectors, new_documents, new_metadatas)
+        if self.path is not None:
+            self._dirty = True
+            self._pending.append({
+                'op': 'add',
+                'ids': new_ids,
+                'documents': new_documents,
+                'metadatas': new_metadatas,
+                'vectors': base64.b64encode(np.ascontiguousarray(vectors, dtype=np.float32).tobytes()).decode('ascii')
+            })
+
+    def _apply_add(self, ids: List[str], vectors: np.ndarray, documents: List[str], metadatas: List[Dict[str, Any]]):
+        """Añadir filas ya normalizadas con IDs nuevos"""
+        self._ensure_capacity(len(ids), vectors.shape[1])
+        self._matrix[self._size:self._size + len(ids)] = vectors
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            self._id_to_row[doc_id] = len(self._ids)
+            self._ids.append(doc_id)
+            self._documents.append(document)
+            self._metadatas.append(metadata)
+        self._size += len(ids)
+        self._columns.clear()
+
+    def delete(self, ids: List[str] = None, where: Dict[str, Any] = None):
+        """Eliminar documentos por ID y/o filtro de metadatos"""
+        with self._lock:
+            mask = np.zeros(self._size, dtype=bool)
+            if ids is not None:
+                rows = [self._id_to_row[doc_id] for doc_id in ids if doc_id in self._id_to_row]
+                mask[rows] = True
+            if where is not None:
+                where_rows = where_mask(where, self._column, self._size)
+                mask = mask & where_rows if ids is not None else where_rows
+            if not mask.any():
+                return
+
+            self._delete_locked([self._ids[row] for row in np.flatnonzero(mask)])
+        self._write_pending()
+
+    def _delete_locked(self, ids: List[str]):
+        self._apply_delete(ids)
+        if self.path is not None:
+            self._dirty = True
+            self._pending.append({'op': 'delete', 'ids': ids})
+
+    def _apply_delete(self, ids: List[str]):
+        """Eliminar filas por ID compactando la matriz"""
+        mask = np.zeros(self._size, dtype=bool)
+        mask[[self._id_to_row[doc_id] for doc_id in ids if doc_id in self._id_to_row]] = True
+        keep = np.flatnonzero(~mask)
+        self._matrix = np.ascontiguousarray(self._active_matrix()[keep])
+        self._ids = [self._ids[row] for row in keep]
+        self._documents = [self._documents[row] for row in keep]
+        self._metadatas = [self._metadatas[row] for row in keep]
+        self._id_to_row = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._size = len(self._ids)
+        self._columns.clear()
+
+    # === LECTURA ===
+
+    def _column(self, key: str, numeric: bool = False) -> np.ndarray:
+        """Columna de un metadato para todas las filas (cacheada hasta la próxima escritura)"""
+        column = self._columns.get((key, numeric))
+        if column is None:
+            column = metadata_column(self._metadatas, key, numeric)
+            self._columns[(key, numeric)] = column
+        return column
+
+    def count(self) -> int:
+        return self._size
+
+    def _rows_payload(self, rows, include: List[str]) -> Dict[str, Any]:
+        return {
+            'ids': [self._ids[row] for row in rows],
+            'documents': [self._documents[row] for row in rows] if 'documents' in include else None,
+            'metadatas': [self._metadatas[row] for row in rows] if 'metadatas' in include else None,
+            'embeddings': self._active_matrix()[list(rows)] if 'embeddings' in include else None
+        }
+
+    def get(self, ids: List[str] = None, where: Dict[str, Any] = None, limit: int = None,
+            offset: int = None, include: List[str] = None) -> Dict[str, Any]:
+        """Recuperar documentos por ID, filtro y/o página"""
+        include = ['documents', 'metadatas'] if include is None else include
+        with self._lock:
+            if ids is not None:
+                rows = [self._id_to_row[doc_id] for doc_id in ids if doc_id in self._id_to_row]
+                if where:
+                    mask = where_mask(where, self._column, self._size)
+                    rows = [row for row in rows if mask[row]]
+            else:
+                rows = np.flatnonzero(where_mask(where, self._column, self._size)).tolist()
+
+            start = offset or 0
+            rows = rows[start:start + limit] if limit is not None else rows[start:]
+            return self._rows_payload(rows, include)
+
+    def query(self, query_embeddings, n_results: int = 10, where: Dict[str, Any] = None,
+              include: List[str] = None) -> Dict[str, Any]:
+        """Top-k exacto por similitud coseno para una o varias consultas"""
+        include = ['documents', 'metadatas', 'distances'] if include is None else include
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            # Sin filtro se usa la matriz activa directamente (sin copiarla con indexado avanzado)
+            candidates = np.flatnonzero(where_mask(where, self._column, self._size)) if where else None
+            k = min(n_results, self._size if candidates is None else len(candidates))
+
+            results = {key: [] for key in ('ids', 'documents', 'metadatas', 'distances', 'embeddings')}
+            if k == 0:
+                for _ in queries:
+                    for key in results:
+                        results[key].append([])
+            else:
+                # Una sola multiplicación matriz-matriz para todas las consultas
+                matrix = self._active_matrix() if candidates is None else self._active_matrix()[candidates]
+                scores = queries @ matrix.T
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                top_scores = np.take_along_axis(scores, top, axis=1)
+                order = np.argsort(-top_scores, axis=1)
+                top = np.take_along_axis(top, order, axis=1)
+                top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+                for query_rows, query_scores in zip(top, top_scores):
+                    rows = query_rows if candidates is None else candidates[query_rows]
+                    payload = self._rows_payload(rows, include)
+                    for key in ('ids', 'documents', 'metadatas', 'embeddings'):
+                        results[key].append(payload[key])
+                    results['distances'].append((1 - query_scores).tolist())
+
+            if 'distances' not in include:
+                results['distances'] = None
+            for key in ('documents', 'metadatas', 'embeddings'):
+                if key not in include:
+                    results[key] = None
+            return results
@@ -0,0 +1,133 @@
+"""
+Reranking con cross-encoder
+Puntúa los pares (consulta, fuente) de los mejores candidatos en CPU, por
+lotes y dentro de un presupuesto de milisegundos por petición
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class CrossEncoderReranker:
+    """
+    Reordenación de fuentes con un cross-encoder cargado en el primer uso
+
+    Los candidatos se puntúan en lotes de `batch_size` en un hilo dedicado.
+    Antes de cada lote se estima su coste con la media móvil de ms por par:
+    si no cabe en lo que queda de presupuesto, se para y solo se reordena el
+    prefijo ya puntuado (las demás fuentes mantienen su orden detrás). Un
+    lote que se pasa del presupuesto no se espera. Sin ningún lote puntuado
+    las fuentes se devuelven tal cual.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 16, max_chars: int = 1000):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_chars = max_chars  # Texto de cada fuente que ve el modelo
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self._ms_per_pair: Optional[float] = None  # Media móvil exponencial del coste por par
+        self._lock = threading.Lock()
+        self.stats_counters = {
+            'reranked': 0,
+            'truncated': 0,
+            'skipped': 0,
+            'failed': 0,
+            'total_ms': 0.0
+        }
+
+    @property
+    def model(self):
+        """Cross-encoder, cargado en el primer uso"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    logger.info(f"Cargando cross-encoder {self.model_name}")
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def _score(self, query: str, contents: List[str]) -> List[float]:
+        """Puntuar un lote de pares y actualizar el coste medio por par"""
+        started = time.perf_counter()
+        scores = self.model.predict(
+            [(query, content[:self.max_chars]) for content in contents],
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        )
+        ms_per_pair = (time.perf_counter() - started) * 1000 / max(len(contents), 1)
+        with self._lock:
+            self._ms_per_pair = ms_per_pair if self._ms_per_pair is None else 0.8 * self._ms_per_pair + 0.2 * ms_per_pair
+        return [float(score) for score in scores]
+
+    async def warm_up(self):
+        """Cargar el modelo y medir el coste por par antes de la primera petición"""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._score, "warm-up", ["warm-up"])
+
+    def _record(self, status: str, elapsed_ms: float):
+        with self._lock:
+            self.stats_counters[status] += 1
+            self.stats_counters['total_ms'] += elapsed_ms
+
+    async def rerank(self, query: str, sources: List[Dict[str, Any]], budget_ms: float) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Reordenar `sources` por score del cross-encoder dentro de `budget_ms`
+
+        Devuelve (fuentes, informe) con el estado ("reranked", "truncated",
+        "skipped" o "failed"), los candidatos puntuados y los ms empleados.
+        Las fuentes puntuadas llevan `rerank_score`.
+        """
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        scores: List[float] = []
+        status = "reranked"
+        try:
+            for start in range(0, len(sources), self.batch_size):
+                batch = sources[start:start + self.batch_size]
+                remaining_ms = budget_ms - (time.perf_counter() - started) * 1000
+                if self._ms_per_pair is not None and self._ms_per_pair * len(batch) > remaining_ms:
+                    status = "truncated"
+                    break
+                future = loop.run_in_executor(self._executor, self._score, query, [source['content'] for source in batch])
+                future.add_done_callback(lambda done: done.cancelled() or done.exception())
+                try:
+                    scores.extend(await asyncio.wait_for(asyncio.shield(future), timeout=max(remaining_ms, 0) / 1000))
+                except asyncio.TimeoutError:
+                    status = "truncated"
+                    break
+        except Exception as e:
+            logger.error(f"Error en reranking con cross-encoder: {e}")
+            status = "failed"
+            scores = []
+
+        if not scores and status != "failed":
+            status = "skipped"
+        scored = sorted(
+            ({**source, 'rerank_score': score} for source, score in zip(sources, scores)),
+            key=lambda source: source['rerank_score'],
+            reverse=True
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._record(status, elapsed_ms)
+        if status != "reranked":
+            logger.info(f"⏱️ Reranking {status}: {len(scores)}/{len(sources)} candidatos en {elapsed_ms:.1f} ms (presupuesto {budget_ms:.0f} ms)")
+        return scored + sources[len(scores):], {"status": status, "candidates": len(scores), "ms": round(elapsed_ms, 2)}
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores por estado, tiempo medio y coste estimado por par"""
+        with self._lock:
+            calls = sum(self.stats_counters[status] for status in ('reranked', 'truncated', 'skipped', 'failed'))
+            return {
+                **self.stats_counters,
+                'total_ms': round(self.stats_counters['total_ms'], 2),
+                'avg_ms': round(self.stats_counters['total_ms'] / calls, 2) if calls else 0.0,
+                'ms_per_pair': round(self._ms_per_pair, 3) if self._ms_per_pair is not None else None,
+                'model': self.model_name,
+                'model_loaded': self._model is not None
+            }
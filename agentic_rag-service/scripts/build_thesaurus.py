@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Script para construir el tesauro de expansión de consultas
+Mina relaciones uva <-> región <-> tipo de vino <-> plato de la base de
+conocimiento y de consultas registradas y las guarda en un JSON compacto
+que el servicio carga al arrancar (THESAURUS_PATH)
+"""
+
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+# Agregar el directorio padre al path para importar módulos
+sys.path.append(str(Path(__file__).parent.parent))
+
+from thesaurus import Thesaurus, build_thesaurus
+
+# Configurar logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description='Construcción del tesauro de expansión de consultas')
+    parser.add_argument('--knowledge-dir', '-k', default='knowledge_base',
+                       help='Directorio con vinos.json y conceptos_sumilleria.txt')
+    parser.add_argument('--queries', '-q', action='append', default=[],
+                       help='Fichero de consultas (una por línea o log del servicio); se puede repetir')
+    parser.add_argument('--output', '-o', default='data/thesaurus.json',
+                       help='Fichero de salida del tesauro')
+    parser.add_argument('--max-related', type=int, default=8,
+                       help='Términos relacionados por término')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                       help='Mostrar ejemplos de expansión')
+
+    args = parser.parse_args()
+
+    knowledge_dir = Path(args.knowledge_dir)
+    vinos_path = knowledge_dir / 'vinos.json'
+    conceptos_path = knowledge_dir / 'conceptos_sumilleria.txt'
+    if not vinos_path.exists() and not conceptos_path.exists():
+        print(f"\n❌ No hay vinos.json ni conceptos_sumilleria.txt en {knowledge_dir}")
+        sys.exit(1)
+
+    try:
+        data, stats = build_thesaurus(
+            vinos_path=str(vinos_path) if vinos_path.exists() else None,
+            conceptos_path=str(conceptos_path) if conceptos_path.exists() else None,
+            query_paths=args.queries,
+            max_related=args.max_related
+        )
+
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+
+        logger.info(f"✅ Tesauro guardado en {output}:")
+        logger.info(f"   - Vinos: {stats['vinos']}")
+        logger.info(f"   - Consultas registradas: {stats['consultas']}")
+        logger.info(f"   - Términos: {stats['terminos']}")
+        logger.info(f"   - Tamaño: {output.stat().st_size} bytes")
+
+        if args.verbose:
+            thesaurus = Thesaurus(data['terms'])
+            print("\n📋 EJEMPLOS:")
+            for query in ("vino para carne", "tinto barato", "vino para paella"):
+                print(f"  {query} -> {thesaurus.expand(query)}")
+
+        print("\n🎉 Tesauro construido exitosamente!")
+
+    except Exception as e:
+        logger.error(f"Error construyendo el tesauro: {e}")
+        print(f"\n💥 Error inesperado: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
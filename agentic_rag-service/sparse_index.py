@@ -0,0 +1,107 @@
+"""
+Índice disperso BM25 para recuperación léxica
+Índice invertido en memoria con tokenización en español sin acentos
+("Albariño" y "albarino", "Penedès" y "penedes" comparten término)
+"""
+
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Palabras vacías frecuentes en español (ya sin acentos)
+SPANISH_STOPWORDS = frozenset("""
+a al algo con como de del desde donde e el ella ellos en entre era es esa ese eso esta este esto
+fue ha hay la las le les lo los mas me mi muy no o para pero por que quien se sea ser si sin sobre
+son su sus tambien te tiene un una uno unos unas y ya
+""".split())
+
+def fold_text(text: str) -> str:
+    """Minúsculas y sin diacríticos (ñ -> n, è -> e, · -> separador)"""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def tokenize(text: str) -> List[str]:
+    """Tokens normalizados de un texto, sin palabras vacías"""
+    return [token for token in _TOKEN_PATTERN.findall(fold_text(text)) if token not in SPANISH_STOPWORDS]
+
+class BM25Index:
+    """
+    Índice invertido BM25 (Okapi)
+
+    Guarda por término las frecuencias en cada documento y por documento su
+    longitud, así que agregar o eliminar documentos es incremental y la
+    búsqueda solo recorre las listas de los términos de la consulta.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._doc_terms: Dict[str, List[str]] = {}  # Para eliminar sin recorrer todo el vocabulario
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_lengths
+
+    def add(self, doc_ids: Iterable[str], texts: Iterable[str]):
+        """Indexar documentos (los IDs ya indexados se ignoran, como en la colección)"""
+        with self._lock:
+            for doc_id, text in zip(doc_ids, texts):
+                if doc_id in self._doc_lengths:
+                    continue
+                frequencies = Counter(tokenize(text))
+                for term, count in frequencies.items():
+                    self._postings.setdefault(term, {})[doc_id] = count
+                length = sum(frequencies.values())
+                self._doc_terms[doc_id] = list(frequencies)
+                self._doc_lengths[doc_id] = length
+                self._total_length += length
+
+    def remove(self, doc_ids: Iterable[str]):
+        """Eliminar documentos del índice"""
+        with self._lock:
+            for doc_id in doc_ids:
+                if doc_id not in self._doc_lengths:
+                    continue
+                for term in self._doc_terms.pop(doc_id):
+                    postings = self._postings[term]
+                    del postings[doc_id]
+                    if not postings:
+                        del self._postings[term]
+                self._total_length -= self._doc_lengths.pop(doc_id)
+
+    def search(self, query: str, k: int = 10, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """Top-k documentos por puntuación BM25 como pares (id, score)
+
+        Con `allowed`, solo puntúan los documentos de ese conjunto de IDs.
+        """
+        with self._lock:
+            total_docs = len(self._doc_lengths)
+            if total_docs == 0:
+                return []
+            avg_length = self._total_length / total_docs
+
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, frequency in postings.items():
+                    if allowed is not None and doc_id not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
@@ -34,6 +34,31 @@ class TestHealthEndpoint:
             assert "vector_db" in data  # Corregido: el endpoint devuelve 'vector_db', no 'service'
             assert data["status"] == "healthy"
             assert data["vector_db"] == "chroma"
+    
+    def test_liveness_check(self):
+        """Test del endpoint /health/live"""
+        client = TestClient(app)
+        response = client.get("/health/live")
+        assert response.status_code == 200
+        assert response.json()["status"] == "alive"
+    
+    def test_readiness_check_while_loading(self):
+        """Test de /health/ready antes de que el motor esté cargado"""
+        client = TestClient(app)
+        with patch.object(rag_engine, 'ready', False):
+            response = client.get("/health/ready")
+        assert response.status_code == 503
+    
+    def test_readiness_check_when_ready(self):
+        """Test de /health/ready con el motor cargado"""
+        client = TestClient(app)
+        mock_collection = Mock()
+        mock_collection.count.return_value = 9
+        with patch.object(rag_engine, 'ready', True), \
+             patch.object(rag_engine, 'collection', mock_collection):
+            response = client.get("/health/ready")
+        assert response.status_code == 200
+        assert response.json()["documents"] == 9
 
 
 class TestQueryEndpoint:
@@ -54,7 +79,7 @@ class TestQueryEndpoint:
                 'metadatas': [[{'source': 'test'}]],
                 'distances': [[0.1]]
             }
-            mock_engine._embed_text.return_value = [0.1, 0.2, 0.3]
+            mock_engine.embed_text = AsyncMock(return_value=[0.1, 0.2, 0.3])
             mock_engine.openai_client = None  # Sin OpenAI para simplificar
             
             response = self.client.post(
@@ -69,6 +94,63 @@ class TestQueryEndpoint:
             assert "context_used" in data
             assert len(data["sources"]) >= 0
     
+    def test_query_endpoint_hybrid_mode(self):
+        """Test de búsqueda híbrida seleccionada por petición"""
+        with patch('main.rag_engine') as mock_engine:
+            mock_engine.hybrid_search = AsyncMock(return_value=[{
+                'id': 'vino_1_Albariño_Rías_Baixas',
+                'content': 'Vino: Albariño Rías Baixas',
+                'metadata': {'type': 'vino'},
+                'relevance_score': 0.032,
+                'rank': 1
+            }])
+            mock_engine.embed_text = AsyncMock()
+            mock_engine.openai_client = None
+
+            response = self.client.post(
+                "/query",
+                json={"query": "albarino", "max_results": 3, "retrieval_mode": "hybrid"}
+            )
+
+            assert response.status_code == 200
+            data = response.json()
+            assert data["sources"][0]["content"] == 'Vino: Albariño Rías Baixas'
+            assert "Albariño" in data["context_used"]["context"]
+            mock_engine.hybrid_search.assert_awaited_once_with("albarino", max_results=3, filters=None)
+            mock_engine.embed_text.assert_not_called()
+
+    def test_query_endpoint_filters(self):
+        """Test de filtros estructurados enviados al índice"""
+        with patch('main.rag_engine') as mock_engine:
+            mock_engine.collection = Mock()
+            mock_engine.collection.query.return_value = {
+                'documents': [[]],
+                'metadatas': [[]],
+                'distances': [[]]
+            }
+            mock_engine.embed_text = AsyncMock(return_value=[0.1, 0.2, 0.3])
+            mock_engine.resolve_filters = AsyncMock(side_effect=lambda filters: filters)
+            mock_engine.openai_client = None
+
+            response = self.client.post(
+                "/query",
+                json={"query": "tinto", "filters": {"type": "vino", "max_price": 30}}
+            )
+
+            assert response.status_code == 200
+            assert mock_engine.collection.query.call_args.kwargs['where'] == {
+                "$and": [{"type": "vino"}, {"price": {"$lte": 30.0}}]
+            }
+
+    def test_query_endpoint_invalid_retrieval_mode(self):
+        """Test de modo de recuperación no soportado"""
+        response = self.client.post(
+            "/query",
+            json={"query": "test", "retrieval_mode": "keyword"}
+        )
+
+        assert response.status_code == 422
+
     def test_query_endpoint_validation_error(self):
         """Test de error de validación en /query"""
         response = self.client.post(
@@ -89,7 +171,7 @@ class TestQueryEndpoint:
                 'metadatas': [[]],
                 'distances': [[]]
             }
-            mock_engine._embed_text.return_value = [0.1, 0.2, 0.3]
+            mock_engine.embed_text = AsyncMock(return_value=[0.1, 0.2, 0.3])
             mock_engine.openai_client = None
             
             response = self.client.post(
@@ -131,6 +213,25 @@ class TestDocumentsEndpoint:
             assert data["doc_id"] == "doc_123"
             assert data["status"] == "added"
     
+    def test_add_documents_bulk_success(self):
+        """Test exitoso de carga en lote"""
+        with patch.object(rag_engine, 'add_documents', new_callable=AsyncMock) as mock_add:
+            mock_add.return_value = ["doc_a", "doc_b"]
+            
+            response = self.client.post(
+                "/documents/bulk",
+                json={"documents": [
+                    {"content": "Primer documento"},
+                    {"content": "Segundo documento", "metadata": {"source": "test"}}
+                ]}
+            )
+            
+            assert response.status_code == 200
+            data = response.json()
+            assert data["doc_ids"] == ["doc_a", "doc_b"]
+            assert data["count"] == 2
+            mock_add.assert_called_once()
+    
     def test_add_document_validation_error(self):
         """Test de error de validación al agregar documento"""
         response = self.client.post(
@@ -189,7 +290,7 @@ class TestErrorHandling:
         with patch('main.rag_engine') as mock_engine:
             # Configurar el mock para que lance una excepción
             mock_engine.collection = None  # Esto causará error en el endpoint
-            mock_engine._embed_text.side_effect = Exception("Test error")
+            mock_engine.embed_text = AsyncMock(side_effect=Exception("Test error"))
             
             response = self.client.post(
                 "/query",
@@ -234,7 +335,7 @@ class TestQueryValidation:
                 'metadatas': [[]],
                 'distances': [[]]
             }
-            mock_engine._embed_text.return_value = [0.1, 0.2, 0.3]
+            mock_engine.embed_text = AsyncMock(return_value=[0.1, 0.2, 0.3])
             mock_engine.openai_client = None
             
             response = self.client.post(
@@ -257,7 +358,7 @@ class TestQueryValidation:
                 'metadatas': [[]],
                 'distances': [[]]
             }
-            mock_engine._embed_text.return_value = [0.1, 0.2, 0.3]
+            mock_engine.embed_text = AsyncMock(return_value=[0.1, 0.2, 0.3])
             mock_engine.openai_client = None
             
             response = self.client.post(
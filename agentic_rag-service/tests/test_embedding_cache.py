@@ -0,0 +1,112 @@
+"""
+Tests unitarios para la caché de embeddings
+"""
+import pytest
+import numpy as np
+import sys
+import os
+
+# Agregar el directorio padre al path para importar los módulos del servicio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_cache import EmbeddingCache
+
+
+class TestEmbeddingCache:
+    """Tests para la caché de embeddings en memoria y disco"""
+    
+    def test_miss_then_hit(self):
+        """Test de fallo inicial y acierto tras guardar"""
+        cache = EmbeddingCache("test-model")
+        
+        assert cache.get_many(["hola"]) == [None]
+        cache.put_many(["hola"], np.array([[1.0, 2.0]]))
+        
+        vector = cache.get_many(["hola"])[0]
+        assert vector.tolist() == [1.0, 2.0]
+        
+        stats = cache.stats()
+        assert stats['misses'] == 1
+        assert stats['memory_hits'] == 1
+        assert stats['hit_rate'] == 0.5
+    
+    def test_lru_eviction(self):
+        """Test de expulsión del elemento menos usado"""
+        cache = EmbeddingCache("test-model", max_memory_items=2)
+        cache.put_many(["a", "b"], np.eye(2))
+        cache.get_many(["a"])  # 'a' pasa a ser el más reciente
+        cache.put_many(["c"], np.array([[1.0, 1.0]]))
+        
+        a, b, c = cache.get_many(["a", "b", "c"])
+        assert a is not None
+        assert b is None
+        assert c is not None
+    
+    def test_key_depends_on_model(self):
+        """Test de que modelos distintos no comparten entradas"""
+        cache_a = EmbeddingCache("model-a")
+        cache_b = EmbeddingCache("model-b")
+        assert cache_a._key("vino") != cache_b._key("vino")
+    
+    def test_disk_tier_survives_restart(self, tmp_path):
+        """Test de persistencia del nivel en disco entre instancias"""
+        cache = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+        cache.put_many(["tinto", "blanco"], np.array([[0.1, 0.2], [0.3, 0.4]]))
+        cache.put_many(["tinto"], np.array([[0.1, 0.2]]))  # Duplicado: no se reescribe
+        
+        restarted = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+        assert restarted.stats()['disk_items'] == 2
+        
+        tinto, blanco, rosado = restarted.get_many(["tinto", "blanco", "rosado"])
+        assert tinto == pytest.approx([0.1, 0.2])
+        assert blanco == pytest.approx([0.3, 0.4])
+        assert rosado is None
+        assert restarted.stats()['disk_hits'] == 2
+    
+    def test_disk_tier_drops_misaligned_rows(self, tmp_path):
+        """Test de que claves y filas desalineadas vacían el nivel en disco"""
+        cache = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+        cache.put_many(["a", "b"], np.array([[1.0, 2.0], [3.0, 4.0]]))
+        
+        vectors_path = cache._vectors_path
+        vectors_path.write_bytes(vectors_path.read_bytes()[:-4])
+        
+        restarted = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+        assert restarted.stats()['disk_items'] == 0
+        assert restarted.get_many(["a", "b"]) == [None, None]
+
+        # Las nuevas filas quedan alineadas con sus claves
+        restarted.put_many(["c"], np.array([[5.0, 6.0]]))
+        reopened = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+        assert reopened.stats()['disk_items'] == 1
+        assert reopened.get_many(["c"])[0] == pytest.approx([5.0, 6.0])
+    
+    def test_disk_tier_trims_partial_row(self, tmp_path):
+        """Test de que los bytes de una fila a medias se descartan sin perder las demás"""
+        cache = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+        cache.put_many(["a"], np.array([[1.0, 2.0]]))
+        with open(cache._vectors_path, 'ab') as f:
+            f.write(b'\x00' * 4)
+        
+        restarted = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+        assert restarted.get_many(["a"])[0] == pytest.approx([1.0, 2.0])
+        assert cache._vectors_path.stat().st_size == 8
+    
+    def test_disk_tier_shared_by_two_writers(self, tmp_path):
+        """Test de dos instancias escribiendo en el mismo directorio sin desalinear filas"""
+        first = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+        second = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+        first.put_many(["tinto"], np.array([[0.1, 0.2]]))
+        second.put_many(["blanco", "tinto"], np.array([[0.3, 0.4], [0.1, 0.2]]))
+        first.put_many(["rosado"], np.array([[0.5, 0.6]]))
+        
+        reopened = EmbeddingCache("test-model", cache_dir=str(tmp_path))
+        assert reopened.stats()['disk_items'] == 3
+        tinto, blanco, rosado = reopened.get_many(["tinto", "blanco", "rosado"])
+        assert tinto == pytest.approx([0.1, 0.2])
+        assert blanco == pytest.approx([0.3, 0.4])
+        assert rosado == pytest.approx([0.5, 0.6])
+        assert first.get_many(["blanco"])[0] == pytest.approx([0.3, 0.4])
+
+if __name__ == "__main__":
+    pytest.main([__file__])
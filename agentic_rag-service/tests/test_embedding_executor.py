@@ -0,0 +1,69 @@
+"""
+Tests unitarios para el executor de embeddings
+"""
+import pytest
+import asyncio
+import time
+import sys
+import os
+
+# Agregar el directorio padre al path para importar los módulos del servicio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_executor import EmbeddingExecutor
+
+
+class TestEmbeddingExecutor:
+    """Tests para el pool acotado de inferencia"""
+    
+    def test_invalid_mode(self):
+        """Test de modo no soportado"""
+        with pytest.raises(ValueError):
+            EmbeddingExecutor(mode="gpu")
+    
+    @pytest.mark.asyncio
+    async def test_run_returns_result_and_counts(self):
+        """Test de ejecución y contadores"""
+        executor = EmbeddingExecutor(max_workers=1)
+        
+        result = await executor.run(lambda texts: [len(t) for t in texts], ["a", "bb"])
+        
+        assert result == [1, 2]
+        stats = executor.stats()
+        assert stats['completed'] == 1
+        assert stats['queue_depth'] == 0
+        assert stats['peak_queue_depth'] == 1
+    
+    @pytest.mark.asyncio
+    async def test_run_does_not_block_event_loop(self):
+        """Test de que una inferencia lenta no detiene otras corrutinas"""
+        executor = EmbeddingExecutor(max_workers=1)
+        ticks = []
+        
+        async def ticker():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+        
+        await asyncio.gather(executor.run(time.sleep, 0.2), ticker())
+        
+        assert len(ticks) == 5
+        assert ticks[-1] - ticks[0] < 0.2
+    
+    @pytest.mark.asyncio
+    async def test_run_counts_failures(self):
+        """Test de propagación de errores"""
+        executor = EmbeddingExecutor()
+        
+        def fail():
+            raise RuntimeError("encode error")
+        
+        with pytest.raises(RuntimeError):
+            await executor.run(fail)
+        
+        assert executor.stats()['failed'] == 1
+        assert executor.stats()['queue_depth'] == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
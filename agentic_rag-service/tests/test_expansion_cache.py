@@ -0,0 +1,64 @@
+"""
+Tests unitarios para la caché de expansiones de consultas
+"""
+import pytest
+import sys
+import os
+from unittest.mock import patch
+
+# Agregar el directorio padre al path para importar los módulos del servicio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expansion_cache import ExpansionCache, normalize_query
+
+
+class TestExpansionCache:
+    """Tests de claves normalizadas, TTL, LRU y persistencia"""
+
+    def test_key_normalizes_query_and_context(self):
+        """Test de normalización de la consulta y del contexto"""
+        assert normalize_query("  ¿Vino para CARNE? ") == "vino para carne"
+        assert ExpansionCache.key("¿Tinto barato?", {"a": 1, "b": 2}) == ExpansionCache.key("tinto barato", {"b": 2, "a": 1})
+        assert ExpansionCache.key("tinto barato") == ExpansionCache.key("tinto barato", {})
+        assert ExpansionCache.key("tinto barato") != ExpansionCache.key("tinto barato", {"ocasion": "boda"})
+
+    def test_ttl_and_lru(self):
+        """Test de expiración por TTL y límite de entradas"""
+        cache = ExpansionCache(max_items=2, ttl_seconds=10)
+        with patch("expansion_cache.time.time", return_value=100.0):
+            cache.put("a", ["a1"])
+            cache.put("b", ["b1"])
+            cache.put("c", ["c1"])
+            assert cache.get("a") is None
+            assert cache.get("b") == ["b1"]
+        with patch("expansion_cache.time.time", return_value=111.0):
+            assert cache.get("c") is None
+
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['expired'] == 1
+
+    def test_disk_persistence(self, tmp_path):
+        """Test de que las expansiones sobreviven a un reinicio y el fichero se compacta"""
+        cache = ExpansionCache(cache_dir=str(tmp_path))
+        key = ExpansionCache.key("vino para carne")
+        cache.put(key, ["tinto con cuerpo"])
+        cache.put(key, ["tinto con cuerpo", "vino para asado"])
+        with open(tmp_path / ExpansionCache.FILE_NAME, "a", encoding="utf-8") as f:
+            f.write('{"key": "incompleta"')  # Escritura interrumpida
+
+        reloaded = ExpansionCache(cache_dir=str(tmp_path))
+
+        assert reloaded.get(key) == ["tinto con cuerpo", "vino para asado"]
+        assert len((tmp_path / ExpansionCache.FILE_NAME).read_text(encoding="utf-8").splitlines()) == 1
+
+    def test_disabled_with_zero_ttl(self, tmp_path):
+        """Test de caché desactivada con TTL 0"""
+        cache = ExpansionCache(ttl_seconds=0, cache_dir=str(tmp_path))
+        cache.put("a", ["a1"])
+        assert cache.get("a") is None
+        assert not (tmp_path / ExpansionCache.FILE_NAME).exists()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
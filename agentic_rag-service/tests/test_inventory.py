@@ -0,0 +1,76 @@
+"""
+Tests unitarios para la tabla columnar de inventario
+"""
+import pytest
+import sys
+import os
+
+# Agregar el directorio padre al path para importar los módulos del servicio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inventory import InventoryTable
+
+
+WINES = {
+    "ribera": {"type": "vino", "name": "Ribera del Duero Reserva", "wine_type": "Tinto", "region": "Ribera del Duero", "price": 28.5, "stock": 45, "vintage": 2019},
+    "albarino": {"type": "vino", "name": "Albariño Rías Baixas", "wine_type": "Blanco", "region": "Rías Baixas", "price": 18.9, "stock": 67, "vintage": 2022},
+    "rioja": {"type": "vino", "name": "Rioja Gran Reserva", "wine_type": "Tinto", "region": "Rioja", "price": 45.0, "stock": 23, "vintage": "2016"},
+    "cava": {"type": "vino", "name": "Cava Brut Nature", "wine_type": "Espumoso", "region": "Penedès", "price": 12.5, "stock": 89, "vintage": 2020},
+}
+
+
+def _inventory():
+    inventory = InventoryTable()
+    inventory.add(list(WINES) + ["concepto"], list(WINES.values()) + [{"type": "text"}])
+    return inventory
+
+
+class TestInventoryTable:
+    """Tests de las agregaciones filtradas del inventario"""
+
+    def test_totals(self):
+        """Test de stock, valor y precio promedio sin filtros"""
+        report = _inventory().report(["stock_total", "valor_total", "precio_promedio"])
+
+        assert report["vinos"] == 4
+        assert report["stock_total"] == 224
+        assert report["valor_total"] == pytest.approx(28.5 * 45 + 18.9 * 67 + 45.0 * 23 + 12.5 * 89)
+        assert report["precio_promedio"] == pytest.approx(26.23, abs=0.01)
+
+    def test_filters(self):
+        """Test de filtros por tipo (sin acentos ni mayúsculas), región y precio"""
+        inventory = _inventory()
+
+        assert inventory.report(["stock_total"], wine_type="tinto")["stock_total"] == 68
+        assert inventory.report(["stock_total"], regions=["Penedes"])["stock_total"] == 89
+        assert inventory.report(["stock_total"], min_price=15, max_price=30)["stock_total"] == 112
+
+    def test_group_by_and_percentiles(self):
+        """Test de agrupaciones por tipo y añada y percentiles de precio"""
+        report = _inventory().report(["por_tipo", "por_añada", "percentiles_precio"])
+
+        assert report["por_tipo"]["Tinto"] == {"vinos": 2, "stock": 68, "valor": round(28.5 * 45 + 45.0 * 23, 2)}
+        assert report["por_añada"] == {2016: 23, 2019: 45, 2020: 89, 2022: 67}
+        assert report["percentiles_precio"]["p50"] == pytest.approx(23.7)
+
+    def test_low_stock_alerts(self):
+        """Test de alertas de stock bajo ordenadas de menor a mayor"""
+        report = _inventory().report(["stock_bajo"], low_stock_threshold=50)
+
+        assert [wine["id"] for wine in report["stock_bajo"]] == ["rioja", "ribera"]
+
+    def test_remove_moves_last_row(self):
+        """Test de borrado O(1) manteniendo la tabla coherente"""
+        inventory = _inventory()
+        inventory.remove(["ribera", "inexistente"])
+        inventory.add(["godello"], [{"type": "vino", "wine_type": "Blanco", "price": 22.3, "stock": 34}])
+
+        report = inventory.report(["stock_total", "por_tipo"])
+        assert len(inventory) == 4
+        assert "ribera" not in inventory
+        assert report["stock_total"] == 67 + 23 + 89 + 34
+        assert report["por_tipo"]["Blanco"]["vinos"] == 2
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
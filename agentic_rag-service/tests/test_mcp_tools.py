@@ -0,0 +1,433 @@
+"""
+Tests de las herramientas MCP del Agentic RAG Service
+"""
+import pytest
+import json
+from collections import Counter
+from unittest.mock import Mock, patch, AsyncMock
+import sys
+import os
+
+# Configurar entorno de test antes de importar main
+os.environ["ENVIRONMENT"] = "test"
+os.environ["USE_EMBEDDED_CHROMA"] = "true"
+os.environ["OPENAI_API_KEY"] = "test-key-not-used"
+os.environ["LOG_LEVEL"] = "ERROR"
+
+# Agregar el directorio padre al path para importar main
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import call_tool, read_resource, rag_engine
+
+
+WINE_SOURCE = {
+    'content': 'Vino: Albariño Rías Baixas',
+    'metadata': {
+        'type': 'vino',
+        'name': 'Albariño Rías Baixas',
+        'wine_type': 'Blanco',
+        'region': 'Rías Baixas',
+        'price': 18.9,
+        'rating': 88,
+        'pairing': 'Mariscos, pescados'
+    },
+    'relevance_score': 0.8
+}
+
+
+class TestRetrievalOnlyTools:
+    """Tests de las herramientas que solo usan las fuentes recuperadas"""
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("name,arguments", [
+        ("buscar_vinos", {"consulta": "blanco para marisco"}),
+        ("sugerir_maridaje", {"plato": "marisco"}),
+        ("explicar_concepto", {"concepto": "taninos"}),
+    ])
+    async def test_tools_skip_llm(self, name, arguments):
+        """Test de que las herramientas no generan respuesta ni expanden con LLM"""
+        with patch.object(rag_engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search, \
+             patch.object(rag_engine, 'agentic_query_expansion', new_callable=AsyncMock) as mock_expand, \
+             patch.object(rag_engine, 'generate_answer', new_callable=AsyncMock) as mock_generate:
+            mock_search.return_value = [[WINE_SOURCE]]
+            
+            result = await call_tool(name, arguments)
+            
+            assert result[0].text
+            mock_search.assert_called_once()
+            mock_expand.assert_not_called()
+            mock_generate.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_buscar_vinos_lists_wines(self):
+        """Test de formato de la búsqueda de vinos"""
+        with patch.object(rag_engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search:
+            mock_search.return_value = [[WINE_SOURCE]]
+            
+            result = await call_tool("buscar_vinos", {"consulta": "albariño"})
+            
+            assert "Albariño Rías Baixas" in result[0].text
+            assert "**Encontrados**: 1 vinos" in result[0].text
+            assert mock_search.call_args.kwargs['filters'] == {"type": "vino"}
+    
+    @pytest.mark.asyncio
+    async def test_sugerir_maridaje_filters_inside_index(self):
+        """Test de que tipo, presupuesto y stock se aplican en la consulta al índice"""
+        with patch.object(rag_engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search:
+            mock_search.return_value = [[WINE_SOURCE]]
+            
+            result = await call_tool("sugerir_maridaje", {"plato": "marisco", "presupuesto_max": 20})
+            
+            assert "Albariño Rías Baixas" in result[0].text
+            assert mock_search.call_args.kwargs['filters'] == {
+                "type": "vino", "max_price": 20, "in_stock": True
+            }
+
+
+
+
+class TestToolResultCache:
+    """Tests de la caché de resultados de las herramientas deterministas"""
+    
+    @pytest.mark.asyncio
+    async def test_repeated_calls_are_served_from_cache(self):
+        """Test de que una llamada repetida no vuelve a consultar la base de conocimiento"""
+        from tool_cache import ToolResultCache
+        with patch.object(rag_engine, 'tool_cache', ToolResultCache()), \
+             patch.object(rag_engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search:
+            mock_search.return_value = [[WINE_SOURCE]]
+            
+            first = await call_tool("explicar_concepto", {"concepto": "taninos"})
+            # Mismos argumentos con el valor por defecto explícito y en otro orden
+            second = await call_tool("explicar_concepto", {"nivel_detalle": "intermedio", "concepto": "taninos"})
+            rag_engine.tool_cache.invalidate()
+            third = await call_tool("explicar_concepto", {"concepto": "taninos"})
+            
+            assert first[0].text == second[0].text == third[0].text
+            assert mock_search.call_count == 2
+            assert rag_engine.tool_cache.stats()['hits'] == 1
+    
+    @pytest.mark.asyncio
+    async def test_non_deterministic_tools_and_errors_are_not_cached(self):
+        """Test de que solo se cachean las herramientas deterministas y sin error"""
+        from tool_cache import ToolResultCache
+        with patch.object(rag_engine, 'tool_cache', ToolResultCache()), \
+             patch.object(rag_engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search:
+            mock_search.return_value = [[WINE_SOURCE]]
+            
+            await call_tool("buscar_vinos", {"consulta": "albariño"})
+            await call_tool("buscar_vinos", {"consulta": "albariño"})
+            await call_tool("explicar_concepto", {"concepto": "taninos", "nivel_detalle": "experto"})
+            
+            assert mock_search.call_count == 3
+            assert rag_engine.tool_cache.stats()['items'] == 0
+
+
+class TestMenuPlanner:
+    """Tests del planificador de menús con maridaje"""
+    
+    @pytest.mark.asyncio
+    async def test_crear_menu_single_search_and_llm_call(self):
+        """Test de una sola búsqueda por lotes y una sola llamada LLM para todo el menú"""
+        rioja = {
+            'id': 'rioja', 'content': 'Vino: Rioja Gran Reserva', 'relevance_score': 0.7,
+            'metadata': {'type': 'vino', 'name': 'Rioja Gran Reserva', 'wine_type': 'Tinto', 'price': 45.0, 'stock': 1}
+        }
+        albarino = {**WINE_SOURCE, 'id': 'albarino'}
+        llm_response = Mock()
+        llm_response.choices = [Mock(message=Mock(content="El albariño realza el marisco."))]
+        
+        with patch.object(rag_engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search, \
+             patch.object(rag_engine, 'chat_completion', new_callable=AsyncMock) as mock_llm:
+            mock_search.return_value = [[albarino, rioja], [albarino, rioja], [rioja]]
+            mock_llm.return_value = llm_response
+            
+            result = await call_tool("crear_menu_maridaje", {
+                "platos": ["marisco", "pulpo", "cordero"], "num_comensales": 8
+            })
+        
+        text = result[0].text
+        mock_search.assert_called_once()
+        assert len(mock_search.call_args.args[0]) == 3
+        mock_llm.assert_called_once()
+        # Cada plato tiene su vino; el cordero repite porque no queda otro candidato
+        assert text.count("Vino: Albariño Rías Baixas") == 1
+        assert text.count("Vino: Rioja Gran Reserva") == 2
+        assert "Se repite" in text
+        assert "• Botellas: 2" in text
+        assert "• Rioja Gran Reserva: 4 botellas (180.00€) ⚠️ solo 1 en stock" in text
+        assert "El albariño realza el marisco." in text
+    
+    @pytest.mark.asyncio
+    async def test_crear_menu_requires_two_to_six_dishes(self):
+        """Test de validación del número de platos"""
+        with patch.object(rag_engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search:
+            result = await call_tool("crear_menu_maridaje", {"platos": ["marisco"]})
+        
+        assert "entre 2 y 6 platos" in result[0].text
+        mock_search.assert_not_called()
+
+
+class TestCatalogTools:
+    """Tests de las herramientas resueltas con el catálogo en memoria"""
+    
+    @pytest.mark.asyncio
+    async def test_recomendar_por_presupuesto_without_search_or_llm(self):
+        """Test de recomendación por presupuesto sin embeddings ni LLM"""
+        from wine_catalog import WineCatalog
+        catalog = WineCatalog()
+        catalog.add(
+            ["albarino", "rioja", "verdejo"],
+            [
+                WINE_SOURCE['metadata'],
+                {'type': 'vino', 'name': 'Rioja Gran Reserva', 'wine_type': 'Tinto', 'price': 45.0, 'rating': 94},
+                {'type': 'vino', 'name': 'Verdejo Rueda', 'wine_type': 'Blanco', 'price': 14.5, 'rating': 86}
+            ]
+        )
+        
+        with patch.object(rag_engine, 'catalog', catalog), \
+             patch.object(rag_engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search, \
+             patch.object(rag_engine, 'chat_completion', new_callable=AsyncMock) as mock_llm:
+            result = await call_tool("recomendar_por_presupuesto", {
+                "presupuesto_min": 10, "presupuesto_max": 20, "tipo_vino": "blanco"
+            })
+        
+        text = result[0].text
+        assert "**Encontrados**: 2 vinos" in text
+        assert text.index("Albariño Rías Baixas") < text.index("Verdejo Rueda")
+        assert "Rioja" not in text
+        mock_search.assert_not_called()
+        mock_llm.assert_not_called()
+
+    
+    @pytest.mark.asyncio
+    async def test_recomendar_por_region_resolves_aliases(self):
+        """Test de recomendación por región con alias y sin búsqueda semántica"""
+        from wine_catalog import WineCatalog
+        catalog = WineCatalog()
+        catalog.add(
+            ["ribera", "rioja"],
+            [
+                {'type': 'vino', 'name': 'Ribera del Duero Reserva', 'region': 'Ribera del Duero', 'rating': 92},
+                {'type': 'vino', 'name': 'Rioja Gran Reserva', 'region': 'Rioja', 'rating': 94}
+            ]
+        )
+        
+        with patch.object(rag_engine, 'catalog', catalog), \
+             patch.object(rag_engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search:
+            found = await call_tool("recomendar_por_region", {"region": "ribera"})
+            missing = await call_tool("recomendar_por_region", {"region": "Toro"})
+        
+        assert "Ribera del Duero Reserva" in found[0].text
+        assert "**Regiones encontradas**: Ribera del Duero" in found[0].text
+        assert "Rioja" not in found[0].text
+        assert "Regiones disponibles: Ribera del Duero, Rioja" in missing[0].text
+        mock_search.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_calcular_inventario_uses_columnar_table(self):
+        """Test del informe de inventario con filtros y alertas de stock"""
+        from inventory import InventoryTable
+        from wine_catalog import WineCatalog
+        wines = [
+            {'type': 'vino', 'name': 'Ribera del Duero Reserva', 'wine_type': 'Tinto', 'region': 'Ribera del Duero', 'price': 28.5, 'stock': 45},
+            {'type': 'vino', 'name': 'Rioja Gran Reserva', 'wine_type': 'Tinto', 'region': 'Rioja', 'price': 45.0, 'stock': 23}
+        ]
+        catalog, inventory = WineCatalog(), InventoryTable()
+        catalog.add(["ribera", "rioja"], wines)
+        inventory.add(["ribera", "rioja"], wines)
+        
+        with patch.object(rag_engine, 'catalog', catalog), \
+             patch.object(rag_engine, 'inventory', inventory):
+            total = await call_tool("calcular_inventario", {
+                "filtros": {"tipo": "tinto"},
+                "incluir_estadisticas": ["stock_total", "valor_total", "stock_bajo"]
+            })
+            ribera = await call_tool("calcular_inventario", {"filtros": {"region": "ribera"}})
+        
+        assert "Stock total: 68 botellas" in total[0].text
+        assert "Valor total: 2317.50€" in total[0].text
+        assert "Rioja Gran Reserva: 23 botellas" in total[0].text
+        assert "Stock total: 45 botellas" in ribera[0].text
+
+    @pytest.mark.asyncio
+    async def test_analizar_vino_resolves_fuzzy_name(self):
+        """Test de análisis con nombre aproximado y lectura por IDs"""
+        from name_index import NameIndex
+        name_index = NameIndex()
+        name_index.add(["albarino"], ["Albariño Rías Baixas"])
+        mock_collection = Mock()
+        mock_collection.get.return_value = {
+            'ids': ['albarino'],
+            'documents': [WINE_SOURCE['content']],
+            'metadatas': [{**WINE_SOURCE['metadata'], 'temperature': '8-10°C', 'description': 'Aromas cítricos'}]
+        }
+
+        with patch.object(rag_engine, 'name_index', name_index), \
+             patch.object(rag_engine, 'collection', mock_collection), \
+             patch.object(rag_engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search:
+            result = await call_tool("analizar_vino", {
+                "nombre_vino": "albarino rias baxas", "aspectos": ["aromas", "temperatura", "decantacion"]
+            })
+            missing = await call_tool("analizar_vino", {"nombre_vino": "Vega Sicilia"})
+
+        text = result[0].text
+        assert "**Análisis de vino**: Albariño Rías Baixas" in text
+        assert "Aromas cítricos" in text
+        assert "8-10°C" in text
+        assert "No necesita decantación" in text
+        assert "No se encontró el vino 'Vega Sicilia'" in missing[0].text
+        mock_collection.get.assert_called_once_with(ids=['albarino'], include=['documents', 'metadatas'])
+        mock_search.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_comparar_vinos_single_batched_get(self):
+        """Test de comparación con un único get por IDs para todos los vinos"""
+        from name_index import NameIndex
+        rioja = {'type': 'vino', 'name': 'Rioja Gran Reserva', 'wine_type': 'Tinto', 'price': 45.0, 'rating': 94}
+        name_index = NameIndex()
+        name_index.add(["albarino", "rioja"], ["Albariño Rías Baixas", "Rioja Gran Reserva"])
+        mock_collection = Mock()
+        mock_collection.get.return_value = {
+            'ids': ['albarino', 'rioja'],
+            'documents': ['', ''],
+            'metadatas': [WINE_SOURCE['metadata'], rioja]
+        }
+
+        with patch.object(rag_engine, 'name_index', name_index), \
+             patch.object(rag_engine, 'collection', mock_collection):
+            result = await call_tool("comparar_vinos", {
+                "vinos": ["Albariño", "rioja gran reserva", "Riojo Grand"],
+                "criterios": ["precio", "calidad"]
+            })
+
+        text = result[0].text
+        assert "**Vinos**: Albariño Rías Baixas vs Rioja Gran Reserva\n" in text
+        assert "• Rioja Gran Reserva: 45.0€" in text
+        assert "• Rioja Gran Reserva: Gran Reserva" in text
+        assert "**💡 Mejor relación calidad-precio**: Albariño Rías Baixas" in text
+        mock_collection.get.assert_called_once()
+        assert sorted(mock_collection.get.call_args.kwargs['ids']) == ['albarino', 'rioja']
+
+    @pytest.mark.asyncio
+    async def test_comparar_vinos_single_match_returns_error(self):
+        """Test de comparación con un solo vino resuelto: error con sugerencias"""
+        from name_index import NameIndex
+        name_index = NameIndex()
+        name_index.add(["albarino", "rioja"], ["Albariño Rías Baixas", "Rioja Gran Reserva"])
+        mock_collection = Mock()
+        mock_collection.get.return_value = {
+            'ids': ['albarino'],
+            'documents': [''],
+            'metadatas': [WINE_SOURCE['metadata']]
+        }
+
+        with patch.object(rag_engine, 'name_index', name_index), \
+             patch.object(rag_engine, 'collection', mock_collection):
+            result = await call_tool("comparar_vinos", {"vinos": ["Albariño", "Rioja Crianza Alavesa"]})
+
+        text = result[0].text
+        assert text.startswith("❌")
+        assert "• 'Rioja Crianza Alavesa'" in text
+        assert "Rioja Gran Reserva" in text
+        assert "Comparación de vinos" not in text
+
+    @pytest.mark.asyncio
+    async def test_comparar_vinos_no_match_returns_error(self):
+        """Test de comparación sin ningún vino resuelto"""
+        from name_index import NameIndex
+        name_index = NameIndex()
+        name_index.add(["albarino"], ["Albariño Rías Baixas"])
+        mock_collection = Mock()
+        mock_collection.get.return_value = {'ids': [], 'documents': [], 'metadatas': []}
+
+        with patch.object(rag_engine, 'name_index', name_index), \
+             patch.object(rag_engine, 'collection', mock_collection):
+            result = await call_tool("comparar_vinos", {"vinos": ["Priorat", "Ribera"]})
+
+        text = result[0].text
+        assert text.startswith("❌")
+        assert "• 'Priorat'" in text
+        assert "• 'Ribera'" in text
+        assert "Comparación de vinos" not in text
+
+
+class TestKnowledgeResources:
+    """Tests de los recursos knowledge://"""
+    
+    @pytest.mark.asyncio
+    async def test_stats_uses_count_and_cached_type_counts(self):
+        """Test de estadísticas sin descargar los documentos"""
+        mock_collection = Mock()
+        mock_collection.count.return_value = 3
+        mock_collection.get.return_value = {
+            'ids': ['a', 'b', 'c'],
+            'metadatas': [{'type': 'vino'}, {'type': 'vino'}, {'type': 'text'}]
+        }
+        
+        with patch.object(rag_engine, 'collection', mock_collection), \
+             patch.object(rag_engine, '_type_counts', None):
+            first = json.loads(await read_resource("knowledge://stats"))
+            second = json.loads(await read_resource("knowledge://stats"))
+        
+        assert first['total_documents'] == 3
+        assert first['documents_by_type'] == {'vino': 2, 'text': 1}
+        assert second['documents_by_type'] == first['documents_by_type']
+        # Los contadores se calculan una sola vez y solo con metadatos
+        mock_collection.get.assert_called_once()
+        assert mock_collection.get.call_args.kwargs['include'] == ['metadatas']
+    
+    @pytest.mark.asyncio
+    async def test_delete_decrements_type_counts_without_rescan(self):
+        """Test de que borrar documentos descuenta sus tipos sin recorrer la colección"""
+        mock_collection = Mock()
+        mock_collection.get.return_value = {'ids': ['b', 'c'], 'metadatas': [{'type': 'vino'}, {'type': 'text'}]}
+        
+        with patch.object(rag_engine, 'collection', mock_collection), \
+             patch.object(rag_engine, '_type_counts', Counter({'vino': 2, 'text': 1})):
+            await rag_engine.delete_documents(['b', 'c'])
+            assert await rag_engine.document_type_counts() == {'vino': 1}
+        
+        # Una sola lectura de los documentos borrados, por ID
+        mock_collection.get.assert_called_once()
+        assert mock_collection.get.call_args.kwargs == {'ids': ['b', 'c'], 'include': ['metadatas']}
+        mock_collection.delete.assert_called_once_with(ids=['b', 'c'])
+    
+    @pytest.mark.asyncio
+    async def test_documents_pagination_and_projection(self):
+        """Test de paginación por cursor y proyección de campos"""
+        mock_collection = Mock()
+        mock_collection.get.return_value = {
+            'ids': ['a', 'b'],
+            'metadatas': [{'name': 'Vino A', 'price': 10}, {'name': 'Vino B', 'price': 20}]
+        }
+        
+        with patch.object(rag_engine, 'collection', mock_collection):
+            page = json.loads(await read_resource("knowledge://documents?cursor=4&limit=2&fields=id,metadata.name"))
+        
+        mock_collection.get.assert_called_once_with(include=['metadatas'], limit=2, offset=4)
+        assert page['documents'] == [
+            {'id': 'a', 'metadata': {'name': 'Vino A'}},
+            {'id': 'b', 'metadata': {'name': 'Vino B'}}
+        ]
+        assert page['next_cursor'] == '6'
+    
+    @pytest.mark.asyncio
+    async def test_documents_last_page(self):
+        """Test de la última página: sin cursor siguiente"""
+        mock_collection = Mock()
+        mock_collection.get.return_value = {
+            'ids': ['z'],
+            'documents': ['Contenido'],
+            'metadatas': [{}]
+        }
+        
+        with patch.object(rag_engine, 'collection', mock_collection):
+            page = json.loads(await read_resource("knowledge://documents?limit=10"))
+        
+        assert page['documents'][0]['content'] == 'Contenido'
+        assert page['next_cursor'] is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
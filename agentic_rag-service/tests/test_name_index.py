@@ -0,0 +1,71 @@
+"""
+Tests unitarios para el índice de nombres de vino
+"""
+import pytest
+import sys
+import os
+
+# Agregar el directorio padre al path para importar los módulos del servicio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from name_index import NameIndex, normalize_name
+
+
+NAMES = {
+    "ribera": "Ribera del Duero Reserva",
+    "albarino": "Albariño Rías Baixas",
+    "rioja": "Rioja Gran Reserva",
+    "cava": "Cava Brut Nature",
+    "godello": "Godello Valdeorras",
+    "mencia": "Mencía Bierzo",
+}
+
+
+def _index():
+    index = NameIndex()
+    index.add(list(NAMES), list(NAMES.values()))
+    return index
+
+
+class TestNameIndex:
+    """Tests de la resolución exacta y aproximada de nombres"""
+
+    def test_normalize_name(self):
+        """Test de normalización sin acentos, mayúsculas ni signos"""
+        assert normalize_name("  Albariño, Rías-Baixas ") == "albarino rias baixas"
+
+    def test_exact_lookup(self):
+        """Test de coincidencia exacta sin acentos ni mayúsculas"""
+        assert _index().lookup("ALBARIÑO rias baixas") == [("albarino", "Albariño Rías Baixas", 1.0)]
+
+    def test_fuzzy_lookup_tolerates_typos_and_partial_names(self):
+        """Test de erratas, acentos omitidos y nombres incompletos"""
+        index = _index()
+
+        assert index.lookup("albarino rias baxas", limit=1)[0][0] == "albarino"
+        assert index.lookup("Rioja Gran Reserba", limit=1)[0][0] == "rioja"
+        assert index.lookup("godelo", limit=1)[0][0] == "godello"
+        assert index.lookup("mencia", limit=1)[0][0] == "mencia"
+
+    def test_unknown_name_below_threshold(self):
+        """Test de nombres sin parecido y umbral por consulta"""
+        index = _index()
+
+        assert index.lookup("Vega Sicilia Único") == []
+        assert index.lookup("") == []
+        assert index.lookup("Ribera Sacra", min_similarity=0.2)[0][0] == "ribera"
+
+    def test_incremental_add_and_remove(self):
+        """Test de sincronización incremental con la ingesta"""
+        index = _index()
+        index.add(["verdejo"], ["Verdejo Rueda"])
+        index.remove(["cava", "inexistente"])
+
+        assert index.lookup("verdejo", limit=1)[0][0] == "verdejo"
+        assert index.lookup("Cava Brut Nature") == []
+        assert "cava" not in index
+        assert len(index) == 6
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,146 @@
+"""
+Tests unitarios para el almacén vectorial numpy
+"""
+import pytest
+import numpy as np
+import sys
+import os
+
+# Agregar el directorio padre al path para importar los módulos del servicio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from numpy_store import NumpyVectorStore
+
+
+def _wine_store(path=None):
+    store = NumpyVectorStore(path=path)
+    store.add(
+        ids=["tinto", "blanco", "rosado", "concepto"],
+        embeddings=[[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.7, 0.7, 0.0], [0.0, 0.0, 1.0]],
+        documents=["Vino tinto", "Vino blanco", "Vino rosado", "Taninos"],
+        metadatas=[
+            {"type": "vino", "wine_type": "Tinto", "price": 25.0},
+            {"type": "vino", "wine_type": "Blanco", "price": 12.0},
+            {"type": "vino", "wine_type": "Rosado", "price": 9.5},
+            {"type": "concepto"}
+        ]
+    )
+    return store
+
+
+class TestNumpyVectorStore:
+    """Tests para búsqueda, filtros y persistencia del almacén numpy"""
+
+    def test_query_returns_exact_top_k(self):
+        """Test de orden por similitud coseno y distancias estilo ChromaDB"""
+        store = _wine_store()
+
+        results = store.query(query_embeddings=[[1.0, 0.1, 0.0]], n_results=2)
+
+        assert results['ids'] == [["tinto", "rosado"]]
+        assert results['documents'][0] == ["Vino tinto", "Vino rosado"]
+        assert results['distances'][0][0] < results['distances'][0][1]
+        assert results['distances'][0][0] == pytest.approx(1 - 1 / np.sqrt(1.01), abs=1e-6)
+
+    def test_query_batch(self):
+        """Test de varias consultas en una sola llamada"""
+        store = _wine_store()
+
+        results = store.query(query_embeddings=np.array([[0.0, 1.0, 0.0], [0.0, 0.0, 1.0]]), n_results=1)
+
+        assert results['ids'] == [["blanco"], ["concepto"]]
+
+    def test_query_with_where_mask(self):
+        """Test de filtros por metadatos con la sintaxis de ChromaDB"""
+        store = _wine_store()
+
+        results = store.query(
+            query_embeddings=[[1.0, 0.0, 0.0]],
+            n_results=5,
+            where={"$and": [{"type": "vino"}, {"price": {"$lt": 20}}]}
+        )
+        assert results['ids'] == [["rosado", "blanco"]]
+
+        results = store.query(
+            query_embeddings=[[1.0, 0.0, 0.0]],
+            n_results=5,
+            where={"wine_type": {"$in": ["Blanco", "Tinto"]}}
+        )
+        assert sorted(results['ids'][0]) == ["blanco", "tinto"]
+
+    def test_duplicate_ids_are_ignored(self):
+        """Test de que un ID existente no se sobrescribe"""
+        store = _wine_store()
+        store.add(ids=["tinto"], embeddings=[[0.0, 1.0, 0.0]], documents=["Otro"], metadatas=[{}])
+
+        assert store.count() == 4
+        assert store.get(ids=["tinto"])['documents'] == ["Vino tinto"]
+
+    def test_upsert_replaces_existing_ids(self, tmp_path):
+        """Test de que upsert reemplaza el documento con el mismo ID y se persiste"""
+        store = _wine_store(path=str(tmp_path))
+        store.upsert(ids=["tinto", "cava"], embeddings=[[0.0, 0.0, 1.0], [0.0, 1.0, 1.0]],
+                     documents=["Tinto nuevo", "Cava"], metadatas=[{"type": "vino"}, {"type": "vino"}])
+
+        for reopened in (store, NumpyVectorStore(path=str(tmp_path))):
+            assert reopened.count() == 5
+            assert reopened.get(ids=["tinto"])['documents'] == ["Tinto nuevo"]
+            assert reopened.query(query_embeddings=[[1.0, 0.0, 0.0]], n_results=1)['ids'] == [["rosado"]]
+
+    def test_delete_and_paginated_get(self):
+        """Test de borrado con compactación y lectura paginada"""
+        store = _wine_store()
+        store.delete(ids=["blanco"])
+
+        assert store.count() == 3
+        assert store.get(limit=2, offset=0)['ids'] == ["tinto", "rosado"]
+        assert store.get(limit=2, offset=2)['ids'] == ["concepto"]
+        assert store.query(query_embeddings=[[0.0, 1.0, 0.0]], n_results=1)['ids'] == [["rosado"]]
+
+    def test_persistence_reopens_memory_mapped(self, tmp_path):
+        """Test de persistencia en disco y reapertura con mmap"""
+        _wine_store(path=str(tmp_path))
+
+        reopened = NumpyVectorStore(path=str(tmp_path))
+        assert reopened.count() == 4
+        assert isinstance(reopened._matrix, np.memmap)
+        assert reopened.query(query_embeddings=[[0.0, 0.0, 1.0]], n_results=1)['ids'] == [["concepto"]]
+
+        # La primera escritura copia la matriz a memoria y se persiste
+        reopened.add(ids=["espumoso"], embeddings=[[0.0, 0.5, 0.5]], documents=["Cava"], metadatas=[{"type": "vino"}])
+        assert NumpyVectorStore(path=str(tmp_path)).count() == 5
+
+    def test_writes_append_to_journal_until_flush(self, tmp_path):
+        """Test de que cada escritura solo añade al diario y flush() crea la instantánea"""
+        store = _wine_store(path=str(tmp_path))
+        store.flush()
+        snapshot_mtime = (tmp_path / "embeddings.npy").stat().st_mtime_ns
+        assert not (tmp_path / NumpyVectorStore.JOURNAL_FILE).exists()
+
+        store.add(ids=["espumoso"], embeddings=[[0.0, 0.5, 0.5]], documents=["Cava"], metadatas=[{"type": "vino"}])
+        store.delete(ids=["blanco"])
+
+        # La instantánea no se reescribe: dos líneas en el diario
+        assert (tmp_path / "embeddings.npy").stat().st_mtime_ns == snapshot_mtime
+        assert len((tmp_path / NumpyVectorStore.JOURNAL_FILE).read_text(encoding="utf-8").splitlines()) == 2
+
+        # Al reabrir se aplica el diario y se compacta en una instantánea nueva
+        reopened = NumpyVectorStore(path=str(tmp_path))
+        assert reopened.count() == 4
+        assert reopened.get(ids=["espumoso", "blanco"])['documents'] == ["Cava"]
+        assert reopened.query(query_embeddings=[[0.0, 0.5, 0.5]], n_results=1)['ids'] == [["espumoso"]]
+        assert isinstance(reopened._matrix, np.memmap)
+        assert not (tmp_path / NumpyVectorStore.JOURNAL_FILE).exists()
+
+    def test_unfiltered_and_filtered_queries_agree(self):
+        """Test de que la ruta sin filtro (matriz activa directa) y la filtrada devuelven las mismas filas"""
+        store = _wine_store()
+
+        results = store.query(query_embeddings=[[1.0, 0.1, 0.0]], n_results=2)
+        filtered = store.query(query_embeddings=[[1.0, 0.1, 0.0]], n_results=2, where={"type": "vino"})
+
+        assert results['ids'] == filtered['ids'] == [["tinto", "rosado"]]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -4,6 +4,7 @@ Tests unitarios para el motor RAG agéntico - REFACTORIZADO
 import pytest
 import asyncio
 import json
+import numpy as np
 from unittest.mock import Mock, patch, AsyncMock, MagicMock
 import sys
 import os
@@ -32,21 +33,44 @@ class TestAgenticRAGEngine:
         assert hasattr(engine, 'collection')
         assert hasattr(engine, 'openai_client')
     
+    def test_embedding_model_is_lazy(self):
+        """Test de que crear el motor no carga el modelo de embeddings"""
+        with patch('sentence_transformers.SentenceTransformer') as mock_model_class:
+            engine = AgenticRAGEngine()
+            mock_model_class.assert_not_called()
+            
+            engine.embedding_model
+            engine.embedding_model
+            mock_model_class.assert_called_once()
+    
     def test_embed_text(self):
-        """Test de generación de embeddings - CORREGIDO"""
+        """Test de generación de embeddings"""
         engine = AgenticRAGEngine()
         
         # Mock del modelo de embedding
         with patch.object(engine.embedding_model, 'encode') as mock_encode:
-            # Configurar el mock para que devuelva un objeto con método tolist()
-            mock_result = Mock()
-            mock_result.tolist.return_value = [0.1, 0.2, 0.3]
-            mock_encode.return_value = mock_result
+            mock_encode.return_value = np.array([[0.1, 0.2, 0.3]], dtype=np.float32)
             
             result = engine._embed_text("test text")
             
-            assert result == [0.1, 0.2, 0.3]
-            mock_encode.assert_called_once_with("test text")
+            assert result == pytest.approx([0.1, 0.2, 0.3])
+            mock_encode.assert_called_once()
+            assert mock_encode.call_args.args[0] == ["test text"]
+    
+    def test_embed_texts_uses_cache(self):
+        """Test de que los textos ya codificados no vuelven al modelo"""
+        engine = AgenticRAGEngine()
+        
+        with patch.object(engine.embedding_model, 'encode') as mock_encode:
+            mock_encode.side_effect = lambda texts, **kwargs: np.ones((len(texts), 3), dtype=np.float32)
+            
+            engine._embed_texts(["vino tinto", "vino blanco"])
+            result = engine._embed_texts(["vino blanco", "cava", "cava"])
+            
+            assert len(result) == 3
+            assert mock_encode.call_count == 2
+            assert mock_encode.call_args.args[0] == ["cava"]
+            assert engine.embedding_cache.stats()['memory_hits'] == 1
     
     @pytest.mark.asyncio
     async def test_add_document(self):
@@ -60,17 +84,19 @@ class TestAgenticRAGEngine:
         engine.collection = mock_collection
         
         # Mock del método de embedding
-        with patch.object(engine, '_embed_text') as mock_embed:
-            mock_embed.return_value = [0.1, 0.2, 0.3]
+        with patch.object(engine, '_embed_texts') as mock_embed:
+            mock_embed.return_value = [[0.1, 0.2, 0.3]]
             
             doc_id = await engine.add_document(
                 content="Test document",
                 metadata={"source": "test"}
             )
             
-            assert doc_id == "doc_1"
+            assert doc_id == AgenticRAGEngine._content_doc_id("Test document", {"source": "test"})
+            assert doc_id.startswith("doc_")
             mock_collection.add.assert_called_once()
-            mock_embed.assert_called_once_with("Test document")
+            mock_collection.get.assert_not_called()
+            mock_embed.assert_called_once_with(["Test document"])
     
     @pytest.mark.asyncio
     async def test_add_document_with_custom_id(self):
@@ -84,8 +110,8 @@ class TestAgenticRAGEngine:
         engine.collection = mock_collection
         
         # Mock del método de embedding
-        with patch.object(engine, '_embed_text') as mock_embed:
-            mock_embed.return_value = [0.1, 0.2, 0.3]
+        with patch.object(engine, '_embed_texts') as mock_embed:
+            mock_embed.return_value = [[0.1, 0.2, 0.3]]
             
             doc_id = await engine.add_document(
                 content="Test document",
@@ -96,6 +122,51 @@ class TestAgenticRAGEngine:
             assert doc_id == "custom_doc_id"
             mock_collection.add.assert_called_once()
     
+    @pytest.mark.asyncio
+    async def test_add_documents_batches_writes(self):
+        """Test de carga en lote: un encode y un add por bloque"""
+        engine = AgenticRAGEngine()
+        
+        mock_collection = Mock()
+        mock_collection.get.return_value = {'ids': ['existing']}
+        engine.collection = mock_collection
+        
+        documents = [{"content": f"Doc {i}", "metadata": {"source": "test"}} for i in range(5)]
+        documents[0]["doc_id"] = "custom"
+        
+        with patch('main.VECTOR_DB_WRITE_BATCH_SIZE', 2), \
+             patch.object(engine, '_embed_texts') as mock_embed:
+            mock_embed.side_effect = lambda texts: [[0.1, 0.2, 0.3] for _ in texts]
+            
+            doc_ids = await engine.add_documents(documents)
+            
+            assert doc_ids[0] == "custom"
+            assert len(set(doc_ids)) == 5
+            assert mock_embed.call_count == 3
+            assert mock_collection.add.call_count == 3
+            mock_collection.get.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_add_documents_content_ids_are_stable(self):
+        """Test de IDs por contenido: deterministas y sin duplicados por lote"""
+        engine = AgenticRAGEngine()
+        engine.collection = Mock()
+        
+        documents = [
+            {"content": "Mismo texto", "metadata": {"source": "a"}},
+            {"content": "Mismo texto", "metadata": {"source": "a"}},
+            {"content": "Mismo texto", "metadata": {"source": "b"}}
+        ]
+        
+        with patch.object(engine, '_embed_texts') as mock_embed:
+            mock_embed.side_effect = lambda texts: [[0.1, 0.2, 0.3] for _ in texts]
+            
+            doc_ids = await engine.add_documents(documents)
+            
+            assert doc_ids[0] == doc_ids[1]
+            assert doc_ids[0] != doc_ids[2]
+            assert engine.collection.add.call_args.kwargs['ids'] == [doc_ids[0], doc_ids[2]]
+    
     @pytest.mark.asyncio
     async def test_semantic_search(self):
         """Test de búsqueda semántica - CORREGIDO"""
@@ -148,6 +219,30 @@ class TestAgenticRAGEngine:
             
             assert len(results) == 0
     
+    @pytest.mark.asyncio
+    async def test_semantic_search_batch_single_query_call(self):
+        """Test de búsqueda multi-consulta: un encode y una consulta al índice"""
+        engine = AgenticRAGEngine()
+        
+        mock_collection = Mock()
+        mock_collection.query.return_value = {
+            'documents': [['Doc A'], ['Doc B']],
+            'metadatas': [[{'source': 'a'}], [{'source': 'b'}]],
+            'distances': [[0.1], [0.3]]
+        }
+        engine.collection = mock_collection
+        
+        with patch.object(engine, '_embed_array') as mock_embed:
+            mock_embed.return_value = np.zeros((2, 3), dtype=np.float32)
+            
+            results = await engine.semantic_search_batch(["query a", "query b"], max_results=1)
+            
+            mock_embed.assert_called_once_with(["query a", "query b"])
+            mock_collection.query.assert_called_once()
+            assert isinstance(mock_collection.query.call_args.kwargs['query_embeddings'], np.ndarray)
+            assert [r[0]['content'] for r in results] == ['Doc A', 'Doc B']
+            assert results[1][0]['relevance_score'] == pytest.approx(0.7)
+    
     @pytest.mark.asyncio
     async def test_agentic_query_expansion_without_openai(self):
         """Test de expansión de consulta sin OpenAI"""
@@ -169,7 +264,7 @@ class TestAgenticRAGEngine:
         mock_choice = Mock()
         mock_choice.message.content = '["expanded query 1", "expanded query 2"]'
         mock_response.choices = [mock_choice]
-        mock_client.chat.completions.create.return_value = mock_response
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
         engine.openai_client = mock_client
         
         # Mock json.loads en el módulo main para parsear la respuesta
@@ -181,6 +276,65 @@ class TestAgenticRAGEngine:
             # El método real devuelve [query_original] + expansiones
             assert result == ["test query", "expanded query 1", "expanded query 2"]
             mock_client.chat.completions.create.assert_called_once()
+            assert mock_client.chat.completions.create.call_args.kwargs['timeout'] > 0
+    
+    @pytest.mark.asyncio
+    async def test_agentic_query_expansion_is_cached(self):
+        """Test de que una consulta repetida (normalizada) no vuelve a llamar al LLM"""
+        engine = AgenticRAGEngine()
+        mock_response = Mock()
+        mock_response.choices = [Mock(message=Mock(content='["tinto para carne roja", "vino con asado"]'))]
+        
+        with patch.object(engine, 'chat_completion', new_callable=AsyncMock, return_value=mock_response) as mock_llm:
+            first = await engine.agentic_query_expansion("Vino para carne")
+            second = await engine.agentic_query_expansion("¿vino para  CARNE?")
+            other_context = await engine.agentic_query_expansion("vino para carne", {"ocasion": "boda"})
+        
+        assert first == ["Vino para carne", "tinto para carne roja", "vino con asado"]
+        assert second == ["¿vino para  CARNE?", "tinto para carne roja", "vino con asado"]
+        assert other_context[1:] == first[1:]
+        # El contexto forma parte de la clave: dos llamadas al LLM en total
+        assert mock_llm.call_count == 2
+        assert engine.expansion_cache.stats()['hits'] == 1
+    
+    @pytest.mark.asyncio
+    async def test_agentic_query_expansion_uses_thesaurus(self):
+        """Test de que el tesauro local evita la llamada al LLM y de la caída al LLM sin términos conocidos"""
+        from thesaurus import Thesaurus
+        engine = AgenticRAGEngine()
+        engine.thesaurus = Thesaurus({"cordero": ["tinto", "Rioja"]})
+        mock_response = Mock()
+        mock_response.choices = [Mock(message=Mock(content='["espumoso para brindar"]'))]
+        
+        with patch('main.EXPANSION_STRATEGY', 'thesaurus_llm'), \
+             patch.object(engine, 'chat_completion', new_callable=AsyncMock, return_value=mock_response) as mock_llm:
+            local = await engine.agentic_query_expansion("vino para cordero")
+            mock_llm.assert_not_called()
+            fallback = await engine.agentic_query_expansion("algo para brindar")
+        
+        assert local == ["vino para cordero", "vino para cordero tinto", "vino para cordero Rioja"]
+        assert fallback == ["algo para brindar", "espumoso para brindar"]
+        assert mock_llm.call_count == 1
+        assert engine.expansion_sources == {"thesaurus": 1, "llm": 1}
+        
+        # Solo tesauro: sin términos conocidos no se expande
+        with patch('main.EXPANSION_STRATEGY', 'thesaurus'), \
+             patch.object(engine, 'chat_completion', new_callable=AsyncMock) as mock_llm:
+            assert await engine.agentic_query_expansion("algo para brindar") == ["algo para brindar"]
+            mock_llm.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_failed_expansion_is_not_cached(self):
+        """Test de que una respuesta no parseable no se cachea"""
+        engine = AgenticRAGEngine()
+        mock_response = Mock()
+        mock_response.choices = [Mock(message=Mock(content='no es JSON'))]
+        
+        with patch.object(engine, 'chat_completion', new_callable=AsyncMock, return_value=mock_response) as mock_llm:
+            assert await engine.agentic_query_expansion("vino para carne") == ["vino para carne"]
+            assert await engine.agentic_query_expansion("vino para carne") == ["vino para carne"]
+        
+        assert mock_llm.call_count == 2
     
     @pytest.mark.asyncio
     async def test_generate_answer_without_openai(self):
@@ -205,7 +359,7 @@ class TestAgenticRAGEngine:
         mock_choice = Mock()
         mock_choice.message.content = "Generated answer from OpenAI"
         mock_response.choices = [mock_choice]
-        mock_client.chat.completions.create.return_value = mock_response
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
         engine.openai_client = mock_client
         
         sources = [{'content': 'Test doc', 'metadata': {}}]
@@ -214,19 +368,53 @@ class TestAgenticRAGEngine:
         assert result == "Generated answer from OpenAI"
         mock_client.chat.completions.create.assert_called_once()
     
+    def test_openai_client_is_async(self):
+        """Test de que el motor usa el cliente asíncrono de OpenAI"""
+        with patch('main.OPENAI_API_KEY', 'test-key'):
+            engine = AgenticRAGEngine()
+        
+        import openai
+        assert isinstance(engine.openai_client, openai.AsyncOpenAI)
+    
+    @pytest.mark.asyncio
+    async def test_chat_completion_concurrency_cap(self):
+        """Test de que las llamadas al LLM respetan el límite de concurrencia"""
+        engine = AgenticRAGEngine()
+        engine._llm_slots = asyncio.Semaphore(2)
+        in_flight = 0
+        peak = 0
+        
+        async def slow_create(**kwargs):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return Mock()
+        
+        mock_client = Mock()
+        mock_client.chat.completions.create = slow_create
+        engine.openai_client = mock_client
+        
+        await asyncio.gather(*[engine.chat_completion(model="test", messages=[]) for _ in range(6)])
+        
+        assert peak == 2
+    
     @pytest.mark.asyncio
     async def test_agentic_rag_query_complete(self):
         """Test de consulta RAG agéntica completa - CORREGIDO"""
         engine = AgenticRAGEngine()
+        engine.openai_client = Mock()  # Sin tesauro ni caché: la expansión va al LLM
         
         # Mock de métodos internos
-        with patch.object(engine, 'agentic_query_expansion') as mock_expand, \
-             patch.object(engine, 'semantic_search') as mock_search, \
+        with patch.object(engine, '_llm_expansion') as mock_expand, \
+             patch.object(engine, 'semantic_search_batch') as mock_search, \
              patch.object(engine, 'generate_answer') as mock_generate:
             
             mock_expand.return_value = ["test query", "expanded query"]
             mock_search.return_value = [
-                {'content': 'Test doc', 'metadata': {}, 'relevance_score': 0.9}
+                [{'content': 'Test doc', 'metadata': {}, 'relevance_score': 0.9}],
+                [{'content': 'Test doc', 'metadata': {}, 'relevance_score': 0.9}]
             ]
             mock_generate.return_value = "Generated answer"
             
@@ -238,13 +426,41 @@ class TestAgenticRAGEngine:
             # El método real devuelve context or {} por defecto
             assert result.context_used == {}
     
+    @pytest.mark.asyncio
+    async def test_agentic_rag_query_reranks_candidates(self):
+        """Test de que el cross-encoder elige las fuentes entre RERANK_CANDIDATES candidatos"""
+        engine = AgenticRAGEngine()
+        candidates = [
+            {'id': f'doc_{i}', 'content': f'Doc {i}', 'metadata': {}, 'relevance_score': 0.9 - i * 0.01}
+            for i in range(6)
+        ]
+        engine.reranker._model = Mock(predict=Mock(side_effect=lambda pairs, **kwargs: [float(i) for i in range(len(pairs))]))
+        
+        with patch('main.RERANK_ENABLED', True), \
+             patch('main.RERANK_CANDIDATES', 6), \
+             patch.object(engine, '_agentic_retrieve_with_path', new_callable=AsyncMock, return_value=(candidates, "direct")) as mock_retrieve, \
+             patch.object(engine, 'generate_answer', new_callable=AsyncMock, return_value="Generated answer") as mock_generate:
+            result = await engine.agentic_rag_query("test query", max_results=2)
+            
+            # Se recuperan 6 candidatos y el reranking se queda con los 2 mejores
+            assert mock_retrieve.call_args.args[2] == 6
+            assert [source['id'] for source in result.sources] == ['doc_5', 'doc_4']
+            assert result.rerank['status'] == "reranked"
+            assert result.rerank['candidates'] == 6
+            assert mock_generate.call_args.args[1] == result.sources
+            
+            # Presupuesto 0 en la petición: sin reranking
+            result = await engine.agentic_rag_query("test query", max_results=2, rerank_budget_ms=0)
+            assert mock_retrieve.call_args.args[2] == 2
+            assert result.rerank is None
+    
     @pytest.mark.asyncio
     async def test_initialize_with_embedded_chroma(self):
         """Test de inicialización con ChromaDB embebido"""
         engine = AgenticRAGEngine()
         
         # Mock de ChromaDB
-        with patch('main.chromadb.EphemeralClient') as mock_client:
+        with patch('chromadb.EphemeralClient') as mock_client:
             mock_db = Mock()
             mock_collection = Mock()
             mock_db.create_collection.return_value = mock_collection
@@ -255,6 +471,520 @@ class TestAgenticRAGEngine:
             assert engine.vector_db is not None
             assert engine.collection is not None
             mock_client.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_initialize_with_persistent_chroma(self, tmp_path):
+        """Test de inicialización con ChromaDB embebido persistente"""
+        engine = AgenticRAGEngine()
+        
+        with patch('main.CHROMA_PERSIST_DIR', str(tmp_path)), \
+             patch('chromadb.PersistentClient') as mock_client:
+            mock_client.return_value = Mock()
+            
+            await engine.initialize()
+            
+            mock_client.assert_called_once()
+            assert mock_client.call_args.kwargs['path'] == str(tmp_path)
+
+    @pytest.mark.asyncio
+    async def test_initialize_with_numpy_store(self, tmp_path):
+        """Test de inicialización con el almacén vectorial numpy en proceso"""
+        from numpy_store import NumpyVectorStore
+        engine = AgenticRAGEngine()
+
+        with patch('main.VECTOR_DB_TYPE', 'numpy'), \
+             patch('main.NUMPY_STORE_DIR', str(tmp_path)), \
+             patch('chromadb.HttpClient') as mock_client:
+            await engine.initialize()
+
+            mock_client.assert_not_called()
+            assert isinstance(engine.collection, NumpyVectorStore)
+
+            with patch.object(engine, '_embed_texts', return_value=[[1.0, 0.0], [0.0, 1.0]]), \
+                 patch.object(engine, '_embed_text', return_value=[0.0, 1.0]):
+                await engine.add_documents([
+                    {"content": "Tinto", "metadata": {"type": "vino"}, "doc_id": "tinto"},
+                    {"content": "Blanco", "metadata": {"type": "vino"}, "doc_id": "blanco"}
+                ])
+                results = await engine.semantic_search("vino blanco", max_results=1)
+
+            assert results[0]['content'] == "Blanco"
+            assert results[0]['relevance_score'] == pytest.approx(1.0)
+
+    @pytest.mark.asyncio
+    async def test_hybrid_search_fuses_bm25_and_vectors(self):
+        """Test de búsqueda híbrida: BM25 rescata nombres exactos que los vectores ordenan mal"""
+        from numpy_store import NumpyVectorStore
+        engine = AgenticRAGEngine()
+        engine.collection = NumpyVectorStore()
+        engine.collection.add(
+            ids=["rioja", "albarino", "cava"],
+            embeddings=[[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]],
+            documents=["Vino: Rioja Gran Reserva", "Vino: Albariño Rías Baixas", "Vino: Cava Brut Nature"],
+            metadatas=[{"type": "vino"}, {"type": "vino"}, {"type": "vino"}]
+        )
+
+        # La rama densa prefiere Rioja; BM25 encuentra "albarino" sin acento
+        with patch('main.HYBRID_CANDIDATES', 2), \
+             patch.object(engine, '_embed_array', return_value=np.array([[0.9, 0.1, 0.3]], dtype=np.float32)):
+            vector_results = await engine.semantic_search_batch(["albarino"], max_results=2)
+            hybrid_results = await engine.hybrid_search("albarino", max_results=2)
+
+        assert [source['id'] for source in vector_results[0]] == ["rioja", "cava"]
+        assert hybrid_results[0]['id'] == "rioja"
+        assert hybrid_results[1]['id'] == "albarino"
+        assert hybrid_results[1]['content'] == "Vino: Albariño Rías Baixas"
+        assert hybrid_results[1]['vector_score'] is None
+        assert hybrid_results[1]['bm25_score'] > 0
+
+        # El índice BM25 se mantiene al agregar y eliminar documentos
+        with patch.object(engine, '_embed_texts', return_value=[[0.0, 1.0, 1.0]]):
+            await engine.add_documents([{"content": "Vino: Godello Valdeorras", "doc_id": "godello"}])
+        assert "godello" in engine.sparse_index
+        await engine.delete_documents(["albarino"])
+        assert "albarino" not in engine.sparse_index
+
+    def test_build_where(self):
+        """Test de traducción de filtros estructurados a `where` de ChromaDB"""
+        assert AgenticRAGEngine.build_where(None) is None
+        assert AgenticRAGEngine.build_where({"max_price": None}) is None
+        assert AgenticRAGEngine.build_where({"type": "vino"}) == {"type": "vino"}
+        assert AgenticRAGEngine.build_where({
+            "type": "vino", "wine_type": "tinto", "min_price": 10, "max_price": 30, "in_stock": True
+        }) == {"$and": [
+            {"type": "vino"},
+            {"wine_type": "Tinto"},
+            {"price": {"$gte": 10}},
+            {"price": {"$lte": 30}},
+            {"stock": {"$gt": 0}}
+        ]}
+        assert AgenticRAGEngine.build_where({"region": ["Rioja"]}) == {"region": "Rioja"}
+        assert AgenticRAGEngine.build_where({"region": ["Rioja", "Rioja Alavesa"]}) == {"region": {"$in": ["Rioja", "Rioja Alavesa"]}}
+
+    @pytest.mark.asyncio
+    async def test_region_filter_uses_catalog_aliases(self):
+        """Test de que el filtro de región acepta el nombre sin acentos, en minúsculas o con alias"""
+        from numpy_store import NumpyVectorStore
+        engine = AgenticRAGEngine()
+        engine.collection = NumpyVectorStore()
+        engine.collection.add(
+            ids=["rioja", "albarino", "ribera"],
+            embeddings=[[1.0, 0.0], [0.9, 0.1], [0.8, 0.2]],
+            documents=["Vino: Rioja Crianza", "Vino: Albariño", "Vino: Ribera Reserva"],
+            metadatas=[
+                {"type": "vino", "name": "Rioja Crianza", "region": "Rioja"},
+                {"type": "vino", "name": "Albariño", "region": "Rías Baixas"},
+                {"type": "vino", "name": "Ribera Reserva", "region": "Ribera del Duero"}
+            ]
+        )
+
+        with patch.object(engine, '_embed_text', return_value=[1.0, 0.0]):
+            for region, expected in [("rioja", "rioja"), ("Rias Baixas", "albarino"), ("D.O. Ribera", "ribera")]:
+                results = await engine.semantic_search("vino", max_results=3, filters={"type": "vino", "region": region})
+                assert [source['id'] for source in results] == [expected]
+            assert await engine.semantic_search("vino", max_results=3, filters={"region": "Priorat"}) == []
+
+    @pytest.mark.asyncio
+    async def test_filters_are_applied_inside_the_index(self):
+        """Test de que un k fijo devuelve k resultados que cumplen los filtros"""
+        from numpy_store import NumpyVectorStore
+        engine = AgenticRAGEngine()
+        engine.collection = NumpyVectorStore()
+        engine.collection.add(
+            ids=["concepto", "caro", "agotado", "barato", "otro_barato"],
+            embeddings=[[1.0, 0.0], [0.9, 0.1], [0.8, 0.2], [0.5, 0.5], [0.1, 0.9]],
+            documents=["Taninos", "Gran Reserva", "Crianza", "Joven", "Rosado"],
+            metadatas=[
+                {"type": "concepto"},
+                {"type": "vino", "price": 60.0, "stock": 5},
+                {"type": "vino", "price": 15.0, "stock": 0},
+                {"type": "vino", "price": 12.0, "stock": 10},
+                {"type": "vino", "price": 9.0, "stock": 3}
+            ]
+        )
+        filters = {"type": "vino", "max_price": 20, "in_stock": True}
+
+        with patch.object(engine, '_embed_array', return_value=np.array([[1.0, 0.0]], dtype=np.float32)), \
+             patch.object(engine, '_embed_text', return_value=[1.0, 0.0]):
+            vector_results = await engine.semantic_search("tinto", max_results=2, filters=filters)
+            hybrid_results = await engine.hybrid_search("joven rosado crianza", max_results=2, filters=filters)
+
+        assert [source['id'] for source in vector_results] == ["barato", "otro_barato"]
+        assert sorted(source['id'] for source in hybrid_results) == ["barato", "otro_barato"]
+        
+        # BM25 solo comprueba el filtro sobre sus candidatos: ninguna lectura de la colección completa
+        with patch.object(engine, '_embed_array', return_value=np.array([[1.0, 0.0]], dtype=np.float32)), \
+             patch.object(engine.collection, 'get', wraps=engine.collection.get) as mock_get:
+            hybrid_results = await engine.hybrid_search("crianza gran reserva", max_results=2, filters=filters)
+        
+        assert all(call.kwargs.get('ids') for call in mock_get.call_args_list)
+        assert "agotado" not in [source['id'] for source in hybrid_results]
+        assert "caro" not in [source['id'] for source in hybrid_results]
+
+    @pytest.mark.asyncio
+    async def test_agentic_retrieve_selects_hybrid_mode(self):
+        """Test de selección del modo de recuperación por llamada"""
+        engine = AgenticRAGEngine()
+
+        with patch.object(engine, 'hybrid_search_batch', new_callable=AsyncMock) as mock_hybrid, \
+             patch.object(engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_vector:
+            mock_hybrid.return_value = [[{'id': 'a', 'content': 'A', 'metadata': {}, 'relevance_score': 0.03}]]
+
+            results = await engine.agentic_retrieve("albarino", expand=False, mode="hybrid")
+
+            assert results[0]['id'] == 'a'
+            mock_vector.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_writes_invalidate_tool_cache(self):
+        """Test de que agregar o eliminar documentos invalida la caché de herramientas"""
+        engine = AgenticRAGEngine()
+        engine.collection = Mock()
+        engine.tool_cache.put("guia_cata", {}, "guía")
+
+        with patch.object(engine, 'embed_texts', new_callable=AsyncMock, return_value=[[0.1]]):
+            await engine.add_documents([{"content": "Vino: Godello Valdeorras", "doc_id": "godello"}])
+        assert engine.tool_cache.get("guia_cata", {}) is None
+
+        engine.tool_cache.put("guia_cata", {}, "guía")
+        await engine.delete_documents(["godello"])
+        assert engine.tool_cache.get("guia_cata", {}) is None
+        assert engine.tool_cache.stats()['invalidations'] == 2
+
+    @pytest.mark.asyncio
+    async def test_slow_expansion_answers_from_original_query(self):
+        """Test de que una expansión lenta no retrasa la respuesta más allá del presupuesto"""
+        engine = AgenticRAGEngine()
+        engine.openai_client = Mock()  # Sin tesauro ni caché: la expansión va al LLM
+        original_hit = {'id': 'a', 'content': 'A', 'metadata': {}, 'relevance_score': 0.5}
+
+        async def slow_expansion(query, context=None):
+            await asyncio.sleep(5)
+            return [query, "expandida"]
+
+        with patch('main.EXPANSION_BUDGET_MS', 50), \
+             patch.object(engine, '_llm_expansion', side_effect=slow_expansion), \
+             patch.object(engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search:
+            mock_search.return_value = [[original_hit]]
+
+            started = asyncio.get_running_loop().time()
+            results = await engine.agentic_retrieve("albarino", mode="vector")
+            elapsed = asyncio.get_running_loop().time() - started
+
+            # La expansión tardía sigue viva en el motor hasta que termina
+            assert len(engine._pending_expansions) == 1
+            pending = list(engine._pending_expansions)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            await asyncio.sleep(0)
+
+        assert [source['id'] for source in results] == ['a']
+        assert elapsed < 1
+        mock_search.assert_called_once()
+        assert mock_search.call_args.args[0] == ["albarino"]
+        assert engine.retrieval_paths["expand_timeout"] == 1
+        assert not engine._pending_expansions
+
+    @pytest.mark.asyncio
+    async def test_failed_background_expansion_is_logged(self):
+        """Test de que el error de una expansión en segundo plano se registra y no queda sin recuperar"""
+        engine = AgenticRAGEngine()
+
+        async def failing_expansion():
+            raise RuntimeError("LLM caído")
+
+        with patch('main.logger') as mock_logger:
+            task = engine._track_expansion(asyncio.create_task(failing_expansion()))
+            await asyncio.gather(task, return_exceptions=True)
+            await asyncio.sleep(0)
+
+        assert not engine._pending_expansions
+        assert "LLM caído" in mock_logger.error.call_args.args[0]
+
+    @pytest.mark.asyncio
+    async def test_expansion_within_budget_is_merged(self):
+        """Test de que las expansiones a tiempo se buscan y se fusionan con la consulta original"""
+        engine = AgenticRAGEngine()
+        engine.openai_client = Mock()  # Sin tesauro ni caché: la expansión va al LLM
+
+        with patch('main.EXPANSION_BUDGET_MS', 1000), \
+             patch.object(engine, '_llm_expansion', new_callable=AsyncMock) as mock_expand, \
+             patch.object(engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search:
+            mock_expand.return_value = ["albarino", "blanco gallego"]
+            mock_search.side_effect = [
+                [[{'id': 'a', 'content': 'A', 'metadata': {}, 'relevance_score': 0.6}]],
+                [[{'id': 'b', 'content': 'B', 'metadata': {}, 'relevance_score': 0.9}]]
+            ]
+
+            results = await engine.agentic_retrieve("albarino", mode="vector")
+
+        # Ambos son primeros en su lista: el empate RRF se deshace por orden de aparición
+        assert [source['id'] for source in results] == ['a', 'b']
+        assert [call.args[0] for call in mock_search.call_args_list] == [["albarino"], ["blanco gallego"]]
+
+    def test_confidence_path(self):
+        """Test de la decisión de ruta según los scores de la primera pasada"""
+        def hits(*scores):
+            return [{'relevance_score': score} for score in scores]
+
+        assert AgenticRAGEngine.confidence_path(hits(0.92, 0.55)) == "direct"
+        assert AgenticRAGEngine.confidence_path(hits(0.92)) == "direct"
+        assert AgenticRAGEngine.confidence_path(hits(0.8, 0.78)) == "expand"
+        assert AgenticRAGEngine.confidence_path(hits(0.5, 0.4)) == "expand"
+        assert AgenticRAGEngine.confidence_path(hits(0.2, 0.1)) == "expand_wide"
+        assert AgenticRAGEngine.confidence_path([]) == "expand_wide"
+        # Híbrida: cuenta la similitud vectorial, no el score RRF
+        assert AgenticRAGEngine.confidence_path([
+            {'relevance_score': 0.03, 'vector_score': 0.9},
+            {'relevance_score': 0.02, 'vector_score': None}
+        ]) == "direct"
+
+    @pytest.mark.asyncio
+    async def test_confident_first_pass_skips_expansion(self):
+        """Test de que una primera pasada concluyente cancela la expansión antes de llamar al LLM"""
+        engine = AgenticRAGEngine()
+        engine.openai_client = Mock()  # Sin tesauro ni caché: la expansión va al LLM
+
+        async def first_pass(queries, max_results=5, filters=None):
+            await asyncio.sleep(0.01)  # Más rápida que EXPANSION_START_DELAY_MS
+            return [[
+                {'id': 'rioja', 'content': 'Rioja Gran Reserva', 'metadata': {}, 'relevance_score': 0.93},
+                {'id': 'ribera', 'content': 'Ribera del Duero', 'metadata': {}, 'relevance_score': 0.61}
+            ]]
+
+        with patch('main.EXPANSION_START_DELAY_MS', 200), \
+             patch.object(engine, 'chat_completion', new_callable=AsyncMock) as mock_llm, \
+             patch.object(engine, 'semantic_search_batch', side_effect=first_pass) as mock_search, \
+             patch.object(engine, 'generate_answer', new_callable=AsyncMock, return_value="respuesta"):
+
+            result = await engine.agentic_rag_query("Rioja Gran Reserva")
+
+            pending = list(engine._pending_expansions)
+            await asyncio.gather(*pending, return_exceptions=True)
+            await asyncio.sleep(0)
+
+        assert result.retrieval_path == "direct"
+        assert [source['id'] for source in result.sources] == ['rioja', 'ribera']
+        mock_search.assert_called_once()
+        mock_llm.assert_not_called()
+        assert all(task.cancelled() for task in pending)
+        assert not engine._pending_expansions
+        assert engine.retrieval_paths == {"direct": 1}
+        assert engine.expansion_sources == {}
+
+    @pytest.mark.asyncio
+    async def test_cached_expansion_resolves_without_llm_task(self):
+        """Test de que una expansión cacheada se resuelve sin crear la tarea LLM"""
+        engine = AgenticRAGEngine()
+        engine.openai_client = Mock()
+        engine.expansion_cache.put(engine.expansion_cache.key("albarino"), ["blanco gallego"])
+
+        with patch.object(engine, '_llm_expansion', new_callable=AsyncMock) as mock_llm, \
+             patch.object(engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search:
+            mock_search.side_effect = [
+                [[{'id': 'a', 'content': 'A', 'metadata': {}, 'relevance_score': 0.5}]],
+                [[{'id': 'b', 'content': 'B', 'metadata': {}, 'relevance_score': 0.6}]]
+            ]
+            results = await engine.agentic_retrieve("albarino", mode="vector")
+
+        mock_llm.assert_not_called()
+        assert [source['id'] for source in results] == ['a', 'b']
+        assert engine.expansion_sources == {"cache": 1}
+
+    @pytest.mark.asyncio
+    async def test_gated_expansion_overlaps_first_pass(self):
+        """Test de que con CONFIDENCE_GATING la expansión corre en paralelo con la primera pasada"""
+        engine = AgenticRAGEngine()
+        engine.openai_client = Mock()  # Sin tesauro ni caché: la expansión va al LLM
+        events = []
+
+        async def expansion(query, context=None):
+            events.append("expansion_start")
+            await asyncio.sleep(0.2)
+            return [query, "blanco gallego"]
+
+        async def search(queries, max_results=5, filters=None):
+            if queries == ["albarino"]:
+                await asyncio.sleep(0.2)
+                events.append("first_pass_end")
+                return [[{'id': 'a', 'content': 'A', 'metadata': {}, 'relevance_score': 0.5}]]
+            return [[{'id': 'b', 'content': 'B', 'metadata': {}, 'relevance_score': 0.6}]]
+
+        with patch('main.CONFIDENCE_GATING', True), \
+             patch('main.EXPANSION_BUDGET_MS', 2000), \
+             patch.object(engine, '_llm_expansion', side_effect=expansion), \
+             patch.object(engine, 'semantic_search_batch', side_effect=search):
+            started = asyncio.get_running_loop().time()
+            results = await engine.agentic_retrieve("albarino", mode="vector")
+            elapsed = asyncio.get_running_loop().time() - started
+
+        assert events.index("expansion_start") < events.index("first_pass_end")
+        # Primera pasada y expansión se solapan: ~0,2 s en lugar de ~0,4 s
+        assert elapsed < 0.35
+        assert [source['id'] for source in results] == ['a', 'b']
+        assert engine.retrieval_paths == {"expand": 1}
+
+    @pytest.mark.asyncio
+    async def test_low_confidence_widens_expansion_depth(self):
+        """Test de que una primera pasada débil expande con más resultados por consulta"""
+        engine = AgenticRAGEngine()
+        engine.openai_client = Mock()  # Sin tesauro ni caché: la expansión va al LLM
+
+        with patch.object(engine, '_llm_expansion', new_callable=AsyncMock) as mock_expand, \
+             patch.object(engine, 'semantic_search_batch', new_callable=AsyncMock) as mock_search:
+            mock_expand.return_value = ["algo para la paella", "vino para arroz"]
+            mock_search.side_effect = [
+                [[{'id': 'a', 'content': 'A', 'metadata': {}, 'relevance_score': 0.2}]],
+                [[{'id': 'b', 'content': 'B', 'metadata': {}, 'relevance_score': 0.5}]]
+            ]
+
+            results = await engine.agentic_retrieve("algo para la paella", max_results=5)
+
+        assert [source['id'] for source in results] == ['a', 'b']
+        assert mock_search.call_args_list[1].kwargs['max_results'] == 5
+        assert engine.retrieval_paths == {"expand_wide": 1}
+
+    def test_fuse_queries_dedups_by_id_with_rrf(self):
+        """Test de fusión RRF por ID entre consultas expandidas"""
+        def hit(doc_id, score, content=None):
+            return {'id': doc_id, 'content': content or f"Vino: {doc_id}", 'metadata': {}, 'relevance_score': score}
+
+        fused = AgenticRAGEngine._fuse_queries([
+            [hit('a', 0.9), hit('b', 0.8), hit('c', 0.7)],
+            [hit('c', 0.95), hit('b', 0.3)],
+            # Misma plantilla de inicio que otro documento: no se colapsa
+            [hit('d', 0.99, content="Vino: a" + " " * 100 + "otro texto")]
+        ], max_results=3)
+
+        # b: 1/62 + 1/62; c: 1/63 + 1/61; a y d: 1/61 (a aparece antes)
+        assert [source['id'] for source in fused] == ['c', 'b', 'a']
+        assert [source['rank'] for source in fused] == [1, 2, 3]
+        assert fused[0]['fusion_score'] == pytest.approx(1 / 63 + 1 / 61)
+        # Se conservan los datos de la primera aparición
+        assert fused[0]['relevance_score'] == 0.7
+
+        fused = AgenticRAGEngine._fuse_queries([[hit('a', 0.9)], [hit('d', 0.99)], [hit('e', 0.5)]], max_results=5)
+        assert [source['id'] for source in fused] == ['a', 'd', 'e']
+        assert AgenticRAGEngine._fuse_queries([[], []], max_results=5) == []
+
+    def test_fuse_queries_is_stable_on_ties_at_cutoff(self):
+        """Test de que los empates en el corte se resuelven por orden de aparición"""
+        lists = [[{'id': f'doc_{i}', 'content': 'Vino', 'metadata': {}}] for i in range(10)]
+
+        fused = AgenticRAGEngine._fuse_queries(lists, max_results=3)
+
+        assert [source['id'] for source in fused] == ['doc_0', 'doc_1', 'doc_2']
+
+    def test_assign_menu_wines_avoids_duplicates(self):
+        """Test de asignación plato -> vino sin repetir y con repetición como último recurso"""
+        def wine(doc_id, score):
+            return {'id': doc_id, 'content': doc_id, 'metadata': {}, 'relevance_score': score}
+
+        assignment = AgenticRAGEngine._assign_menu_wines([
+            [wine('albarino', 0.9), wine('verdejo', 0.7)],
+            [wine('albarino', 0.95), wine('godello', 0.6)],
+            [wine('albarino', 0.5)],
+            []
+        ])
+
+        assert [(source['id'] if source else None, repeated) for source, repeated in assignment] == [
+            ('verdejo', False), ('albarino', False), ('albarino', True), (None, False)
+        ]
+
+
+class TestKnowledgeBaseSync:
+    """Tests de la sincronización incremental de la base de conocimiento"""
+    
+    @pytest.mark.asyncio
+    async def test_only_changed_files_are_reindexed(self, tmp_path):
+        """Test de reutilización del índice para archivos sin cambios"""
+        import main
+        
+        knowledge_dir = tmp_path / "knowledge_base"
+        knowledge_dir.mkdir()
+        (knowledge_dir / "a.txt").write_text("Texto A", encoding="utf-8")
+        (knowledge_dir / "b.txt").write_text("Texto B", encoding="utf-8")
+        
+        mock_collection = Mock()
+        mock_collection.count.return_value = 0
+        
+        with patch('main.CHROMA_PERSIST_DIR', str(tmp_path)), \
+             patch.object(main.rag_engine, 'collection', mock_collection), \
+             patch.object(main.rag_engine, 'add_documents', new_callable=AsyncMock) as mock_add, \
+             patch.object(main.rag_engine, 'delete_documents', new_callable=AsyncMock) as mock_delete:
+            mock_add.side_effect = lambda documents, upsert=False: [doc["doc_id"] for doc in documents]
+            
+            await main.load_knowledge_base(knowledge_dir)
+            assert mock_add.call_count == 2
+            
+            # Segundo arranque: un archivo modificado y otro eliminado
+            mock_collection.count.return_value = 2
+            mock_add.reset_mock()
+            (knowledge_dir / "a.txt").write_text("Texto A modificado", encoding="utf-8")
+            (knowledge_dir / "b.txt").unlink()
+            
+            await main.load_knowledge_base(knowledge_dir)
+            
+            mock_add.assert_called_once()
+            assert mock_add.call_args.args[0][0]["content"] == "Texto A modificado"
+            deleted = [call.args[0] for call in mock_delete.call_args_list]
+            assert deleted == [["a"], ["b"]]
+            
+            manifest = json.loads((tmp_path / "knowledge_manifest.json").read_text(encoding="utf-8"))
+            assert list(manifest) == ["a.txt"]
+            
+            # Tercer arranque sin cambios: nada que indexar
+            mock_add.reset_mock()
+            await main.load_knowledge_base(knowledge_dir)
+            mock_add.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_sync_without_manifest_rewrites_existing_ids(self, tmp_path):
+        """Test de que un documento cambiado con el mismo ID se reescribe aunque falte el manifiesto"""
+        import main
+        from numpy_store import NumpyVectorStore
+        
+        knowledge_dir = tmp_path / "knowledge_base"
+        knowledge_dir.mkdir()
+        (knowledge_dir / "a.txt").write_text("Texto A modificado", encoding="utf-8")
+        
+        # Índice persistido con la versión anterior y sin manifiesto
+        collection = NumpyVectorStore()
+        collection.add(ids=["a"], embeddings=[[1.0, 0.0]], documents=["Texto A"], metadatas=[{"type": "texto"}])
+        engine = AgenticRAGEngine()
+        engine.collection = collection
+        await engine.document_type_counts()
+        
+        with patch('main.CHROMA_PERSIST_DIR', str(tmp_path)), \
+             patch.object(main, 'rag_engine', engine), \
+             patch.object(engine, '_embed_texts', return_value=[[0.0, 1.0]]):
+            await main.load_knowledge_base(knowledge_dir)
+        
+        assert collection.count() == 1
+        assert collection.get(ids=["a"])['documents'] == ["Texto A modificado"]
+        assert await engine.document_type_counts() == {"text": 1}
+    
+    @pytest.mark.asyncio
+    async def test_failed_upsert_keeps_counts_and_indexes(self):
+        """Test de que un upsert fallido no toca contadores ni índices en memoria"""
+        from numpy_store import NumpyVectorStore
+        from sparse_index import BM25Index
+        
+        collection = NumpyVectorStore()
+        collection.add(ids=["a"], embeddings=[[1.0, 0.0]], documents=["Texto A"], metadatas=[{"type": "texto"}])
+        engine = AgenticRAGEngine()
+        engine.collection = collection
+        engine.sparse_index = BM25Index()
+        engine.sparse_index.add(["a"], ["Texto A"])
+        await engine.document_type_counts()
+        
+        with patch.object(engine, '_embed_texts', side_effect=RuntimeError("sin modelo")):
+            with pytest.raises(RuntimeError):
+                await engine.add_documents([{"doc_id": "a", "content": "Texto nuevo", "metadata": {"type": "nuevo"}}], upsert=True)
+        
+        assert await engine.document_type_counts() == {"texto": 1}
+        assert [doc_id for doc_id, _ in engine.sparse_index.search("Texto A", 5)] == ["a"]
 
 
 class TestDataModels:
@@ -308,13 +1038,12 @@ class TestErrorHandling:
         
         # Mock de la colección que falla
         mock_collection = Mock()
-        mock_collection.get.return_value = {'ids': []}  # Necesario para el cálculo de doc_id
         mock_collection.add.side_effect = Exception("Database error")
         engine.collection = mock_collection
         
         # Mock del método de embedding
-        with patch.object(engine, '_embed_text') as mock_embed:
-            mock_embed.return_value = [0.1, 0.2, 0.3]
+        with patch.object(engine, '_embed_texts') as mock_embed:
+            mock_embed.return_value = [[0.1, 0.2, 0.3]]
             
             with pytest.raises(Exception) as exc_info:
                 await engine.add_document("test content")
@@ -0,0 +1,100 @@
+"""
+Tests unitarios para el reranking con cross-encoder
+"""
+import pytest
+import sys
+import os
+import time
+from unittest.mock import Mock
+
+# Agregar el directorio padre al path para importar los módulos del servicio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reranker import CrossEncoderReranker
+
+
+def make_sources(*contents):
+    return [{'id': f"doc_{i}", 'content': content, 'relevance_score': 0.5} for i, content in enumerate(contents)]
+
+
+def make_reranker(predict, batch_size=2):
+    reranker = CrossEncoderReranker("fake-cross-encoder", batch_size=batch_size)
+    reranker._model = Mock(predict=Mock(side_effect=predict))
+    return reranker
+
+
+def score_by_length(pairs, **kwargs):
+    """Modelo falso: más relevante cuanto más largo el texto"""
+    return [float(len(content)) for _, content in pairs]
+
+
+class TestCrossEncoderReranker:
+    """Tests de reordenación por lotes y presupuesto de latencia"""
+
+    @pytest.mark.asyncio
+    async def test_rerank_scores_in_batches_and_reorders(self):
+        """Test de que todos los candidatos se puntúan por lotes y se reordenan"""
+        reranker = make_reranker(score_by_length)
+        sources = make_sources("a", "abc", "ab", "abcd", "abcde")
+
+        reranked, report = await reranker.rerank("consulta", sources, budget_ms=5000)
+
+        assert [source['id'] for source in reranked] == ["doc_4", "doc_3", "doc_1", "doc_2", "doc_0"]
+        assert reranked[0]['rerank_score'] == 5.0
+        assert report['status'] == "reranked"
+        assert report['candidates'] == 5
+        assert reranker._model.predict.call_count == 3
+        assert 'rerank_score' not in sources[0]  # Las fuentes originales no se modifican
+        assert reranker.stats()['reranked'] == 1
+
+    @pytest.mark.asyncio
+    async def test_rerank_truncates_when_estimate_exceeds_budget(self):
+        """Test de que solo se reordena el prefijo que cabe en el presupuesto"""
+        def timed_predict(pairs, **kwargs):
+            time.sleep(0.04)  # 20 ms por par
+            return score_by_length(pairs)
+
+        reranker = make_reranker(timed_predict)
+        sources = make_sources("a", "abc", "abcd", "abcde")
+
+        # El primer lote (40 ms) cabe; el segundo ya no cabe en lo que queda
+        reranked, report = await reranker.rerank("consulta", sources, budget_ms=70)
+
+        assert report['status'] == "truncated"
+        assert report['candidates'] == 2
+        # Prefijo reordenado y el resto en su orden original, sin score
+        assert [source['id'] for source in reranked] == ["doc_1", "doc_0", "doc_2", "doc_3"]
+        assert 'rerank_score' not in reranked[2]
+
+    @pytest.mark.asyncio
+    async def test_rerank_does_not_wait_for_slow_batch(self):
+        """Test de que un lote que excede el presupuesto no se espera"""
+        def slow_predict(pairs, **kwargs):
+            time.sleep(0.2)
+            return score_by_length(pairs)
+
+        reranker = make_reranker(slow_predict)
+        sources = make_sources("a", "abc")
+
+        started = time.perf_counter()
+        reranked, report = await reranker.rerank("consulta", sources, budget_ms=20)
+
+        assert time.perf_counter() - started < 0.15
+        assert report['status'] == "skipped"
+        assert reranked == sources
+
+    @pytest.mark.asyncio
+    async def test_rerank_failure_keeps_original_order(self):
+        """Test de fallback al orden original si el modelo falla"""
+        reranker = make_reranker(RuntimeError("modelo no disponible"))
+        sources = make_sources("a", "abc")
+
+        reranked, report = await reranker.rerank("consulta", sources, budget_ms=1000)
+
+        assert reranked == sources
+        assert report['status'] == "failed"
+        assert reranker.stats()['failed'] == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,74 @@
+"""
+Tests unitarios para el índice disperso BM25
+"""
+import pytest
+import sys
+import os
+
+# Agregar el directorio padre al path para importar los módulos del servicio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sparse_index import BM25Index, tokenize
+
+
+class TestTokenize:
+    """Tests para la tokenización en español"""
+
+    def test_accents_are_folded(self):
+        """Test de términos sin acentos ni eñes"""
+        assert tokenize("Albariño Rías Baixas") == ["albarino", "rias", "baixas"]
+        assert tokenize("Penedès") == tokenize("penedes")
+
+    def test_stopwords_are_removed(self):
+        """Test de eliminación de palabras vacías"""
+        assert tokenize("Un vino de la Ribera del Duero") == ["vino", "ribera", "duero"]
+
+
+class TestBM25Index:
+    """Tests para el índice invertido BM25"""
+
+    def _index(self):
+        index = BM25Index()
+        index.add(
+            ["albarino", "cava", "rioja"],
+            [
+                "Vino: Albariño Rías Baixas. Blanco fresco de Galicia",
+                "Vino: Cava Brut Nature. Espumoso del Penedès",
+                "Vino: Rioja Gran Reserva. Tinto con crianza"
+            ]
+        )
+        return index
+
+    def test_exact_terms_rank_first(self):
+        """Test de que el documento con el término exacto encabeza el ranking"""
+        index = self._index()
+
+        assert index.search("albarino", k=3)[0][0] == "albarino"
+        assert index.search("espumoso penedes", k=3)[0][0] == "cava"
+
+    def test_unknown_terms_return_nothing(self):
+        """Test de consulta sin términos indexados"""
+        assert self._index().search("sake", k=3) == []
+
+    def test_rare_terms_weigh_more(self):
+        """Test de IDF: un término raro puntúa más que uno común"""
+        index = self._index()
+        vino_score = dict(index.search("vino", k=3))["rioja"]
+        crianza_score = dict(index.search("crianza", k=3))["rioja"]
+        assert crianza_score > vino_score
+
+    def test_add_is_idempotent_and_remove_updates_postings(self):
+        """Test de sincronización incremental con la colección"""
+        index = self._index()
+        index.add(["cava"], ["Otro texto"])
+        assert len(index) == 3
+        assert index.search("cava", k=3)[0][0] == "cava"
+
+        index.remove(["cava", "inexistente"])
+        assert len(index) == 2
+        assert "cava" not in index
+        assert index.search("cava", k=3) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,124 @@
+"""
+Tests unitarios para el tesauro de expansión local de consultas
+"""
+import pytest
+import sys
+import os
+import json
+
+# Agregar el directorio padre al path para importar los módulos del servicio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from thesaurus import Thesaurus, ThesaurusBuilder, build_thesaurus, read_logged_queries, term_key
+
+KNOWLEDGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "knowledge_base")
+
+
+class TestThesaurusBuilder:
+    """Tests de minería de relaciones"""
+
+    def test_wines_relate_grape_region_type_and_dishes(self):
+        """Test de relaciones desde el catálogo de vinos"""
+        builder = ThesaurusBuilder()
+        builder.add_wines([
+            {"name": "Tinto A", "type": "Tinto", "region": "Rioja", "grape": "Tempranillo, Garnacha", "pairing": "Cordero asado, quesos curados"}
+        ])
+        terms = builder.build()["terms"]
+        assert set(terms["tempranillo"]) == {"Garnacha", "Rioja", "tinto", "cordero asado", "quesos curados"}
+        assert set(terms["cordero asado"]) == {"Tempranillo", "Garnacha", "Rioja", "tinto"}
+        # Los platos no se relacionan entre sí
+        assert "quesos curados" not in terms["cordero asado"]
+
+    def test_concepts_synonyms_and_dish_types(self):
+        """Test de ejemplos, sinónimos entre paréntesis y reglas de maridaje"""
+        builder = ThesaurusBuilder()
+        builder.add_concepts(
+            "## Tipos\n"
+            "### Vinos Tintos\n"
+            "- Ejemplos: Tempranillo (Tinto Fino), Garnacha\n"
+            "## Maridaje\n"
+            "- **Pescados**: Vinos blancos frescos\n"
+        )
+        terms = builder.build()["terms"]
+        assert terms["tempranillo"][0] == "Tinto Fino"
+        assert "tinto" in terms["garnacha"]
+        assert terms["pescado"] == ["blanco"]
+
+    def test_queries_add_cooccurrence_of_known_terms(self):
+        """Test de coocurrencia en consultas registradas"""
+        builder = ThesaurusBuilder()
+        builder.add_wines([{"type": "Tinto", "region": "Rioja", "pairing": "Cordero"}])
+        builder.add_wines([{"type": "Blanco", "region": "Rías Baixas", "pairing": "Marisco"}])
+        builder.add_queries(["cordero con blanco de rías baixas", "consulta sin términos"])
+        terms = builder.build()["terms"]
+        assert "blanco" in terms["cordero"]
+        assert "cordero" in terms["ria baixa"]
+
+    def test_read_logged_queries(self, tmp_path):
+        """Test de lectura de consultas sueltas y de líneas del log del servicio"""
+        path = tmp_path / "queries.log"
+        path.write_text(
+            "vino para paella\n"
+            "2025-01-01 10:00:00 - main - INFO - Received query: tinto para cordero\n"
+            "2025-01-01 10:00:01 - main - INFO - 🔍 Búsqueda semántica\n"
+            "\n",
+            encoding="utf-8"
+        )
+        assert read_logged_queries(str(path)) == ["vino para paella", "tinto para cordero"]
+
+    def test_build_from_knowledge_base(self):
+        """Test de construcción con los ficheros reales de la base de conocimiento"""
+        data, stats = build_thesaurus(
+            vinos_path=os.path.join(KNOWLEDGE_DIR, "vinos.json"),
+            conceptos_path=os.path.join(KNOWLEDGE_DIR, "conceptos_sumilleria.txt")
+        )
+        assert data["format"] == 1
+        assert stats["vinos"] > 0
+        assert stats["terminos"] == len(data["terms"]) > 0
+        assert all(len(related) <= 8 for related in data["terms"].values())
+
+
+class TestThesaurus:
+    """Tests de búsqueda de términos y expansión"""
+
+    @pytest.fixture
+    def thesaurus(self):
+        return Thesaurus({
+            "carne roja": ["tinto", "Tempranillo"],
+            "carne asada": ["Rioja", "tinto"],
+            "tinto": ["Tempranillo", "carnes rojas", "Rioja"],
+            "tempranillo": ["Tinto Fino", "tinto"],
+            "paella": ["blanco"]
+        })
+
+    def test_match_prefers_longest_phrase(self, thesaurus):
+        """Test de que una frase completa tiene prioridad sobre sus palabras"""
+        assert thesaurus.match("Tinto para carnes rojas") == ["tinto", "carne roja"]
+        # Una palabra suelta encuentra los términos que la contienen
+        assert thesaurus.match("vino para carne") == ["carne roja", "carne asada"]
+        assert thesaurus.match("algo sin relación") == []
+
+    def test_expand_alternates_terms_without_repeating(self, thesaurus):
+        """Test de expansión: relacionados de cada término, sin repetir términos de la consulta"""
+        assert thesaurus.related("tempranillo con paella") == ["Tinto Fino", "blanco", "tinto"]
+        assert thesaurus.expand("vino para carne", max_expansions=2) == ["vino para carne tinto", "vino para carne Rioja"]
+        assert thesaurus.expand("algo sin relación") == []
+
+    def test_load(self, tmp_path):
+        """Test de carga desde fichero y de los casos sin tesauro"""
+        path = tmp_path / "thesaurus.json"
+        path.write_text(json.dumps({"format": 1, "terms": {"paella": ["blanco"]}}), encoding="utf-8")
+        assert len(Thesaurus.load(str(path))) == 1
+        assert Thesaurus.load(str(tmp_path / "missing.json")) is None
+
+        path.write_text(json.dumps({"format": 99, "terms": {}}), encoding="utf-8")
+        assert Thesaurus.load(str(path)) is None
+
+    def test_term_key(self):
+        """Test de normalización de términos"""
+        assert term_key("Carnes Rojas") == term_key("carne roja") == "carne roja"
+        assert term_key("Rías Baixas") == "ria baixa"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,79 @@
+"""
+Tests unitarios para la caché de resultados de herramientas MCP
+"""
+import pytest
+import sys
+import os
+from unittest.mock import patch
+
+# Agregar el directorio padre al path para importar los módulos del servicio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tool_cache import ToolResultCache
+
+
+class TestToolResultCache:
+    """Tests de claves canónicas, TTL, LRU e invalidación"""
+
+    def test_key_ignores_argument_order(self):
+        """Test de que el orden de los argumentos no cambia la clave"""
+        assert ToolResultCache.key("guia_cata", {"tipo_vino": "tinto", "experiencia": "avanzado"}) == \
+            ToolResultCache.key("guia_cata", {"experiencia": "avanzado", "tipo_vino": "tinto"})
+        assert ToolResultCache.key("guia_cata", {"tipo_vino": "tinto"}) != \
+            ToolResultCache.key("temperaturas_servicio", {"tipo_vino": "tinto"})
+
+    def test_hit_miss_and_stats(self):
+        """Test de aciertos, fallos y tasa de aciertos"""
+        cache = ToolResultCache()
+        assert cache.get("guia_cata", {"tipo_vino": "tinto"}) is None
+        cache.put("guia_cata", {"tipo_vino": "tinto"}, "guía")
+
+        assert cache.get("guia_cata", {"tipo_vino": "tinto"}) == "guía"
+        stats = cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['hit_rate'] == 0.5
+
+    def test_ttl_expiration(self):
+        """Test de expiración por TTL"""
+        cache = ToolResultCache(ttl_seconds=10)
+        with patch("tool_cache.time.monotonic", return_value=100.0):
+            cache.put("guia_cata", {}, "guía")
+        with patch("tool_cache.time.monotonic", return_value=105.0):
+            assert cache.get("guia_cata", {}) == "guía"
+        with patch("tool_cache.time.monotonic", return_value=111.0):
+            assert cache.get("guia_cata", {}) is None
+        assert cache.stats()['expired'] == 1
+
+    def test_lru_bound(self):
+        """Test de que se descarta la entrada menos usada"""
+        cache = ToolResultCache(max_items=2)
+        cache.put("t", {"n": 1}, "uno")
+        cache.put("t", {"n": 2}, "dos")
+        cache.get("t", {"n": 1})
+        cache.put("t", {"n": 3}, "tres")
+
+        assert cache.get("t", {"n": 2}) is None
+        assert cache.get("t", {"n": 1}) == "uno"
+
+    def test_invalidation_discards_stale_results(self):
+        """Test de que la invalidación vacía la caché y descarta resultados en vuelo"""
+        cache = ToolResultCache()
+        cache.put("t", {}, "antes")
+        generation = cache.generation
+        cache.invalidate()
+        cache.put("t", {"n": 1}, "obsoleto", generation=generation)
+
+        assert cache.get("t", {}) is None
+        assert cache.get("t", {"n": 1}) is None
+        assert cache.stats()['invalidations'] == 1
+
+    def test_disabled_with_zero_ttl(self):
+        """Test de caché desactivada con TTL 0"""
+        cache = ToolResultCache(ttl_seconds=0)
+        cache.put("t", {}, "guía")
+        assert cache.get("t", {}) is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,108 @@
+"""
+Tests unitarios para el catálogo de vinos en memoria
+"""
+import pytest
+import sys
+import os
+
+# Agregar el directorio padre al path para importar los módulos del servicio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wine_catalog import WineCatalog
+
+
+WINES = {
+    "ribera": {"type": "vino", "name": "Ribera del Duero Reserva", "wine_type": "Tinto", "region": "Ribera del Duero", "price": 28.5, "rating": 92, "stock": 45},
+    "albarino": {"type": "vino", "name": "Albariño Rías Baixas", "wine_type": "Blanco", "region": "Rías Baixas", "price": 18.9, "rating": 88, "stock": 67},
+    "rioja": {"type": "vino", "name": "Rioja Gran Reserva", "wine_type": "Tinto", "region": "Rioja", "price": 45.0, "rating": 94, "stock": 23},
+    "cava": {"type": "vino", "name": "Cava Brut Nature", "wine_type": "Espumoso", "region": "Penedès", "price": 12.5, "rating": 85, "stock": 89},
+    "mencia": {"type": "vino", "name": "Mencía Bierzo", "wine_type": "Tinto", "region": "Bierzo", "price": 19.9, "rating": 89, "stock": 0},
+    "jumilla": {"type": "vino", "name": "Monastrell Jumilla", "wine_type": "Tinto", "region": "Jumilla", "price": 15.8, "rating": 87, "stock": 56},
+}
+
+
+def _catalog():
+    catalog = WineCatalog()
+    catalog.add(list(WINES) + ["concepto"], list(WINES.values()) + [{"type": "text"}])
+    return catalog
+
+
+class TestWineCatalog:
+    """Tests de las consultas por presupuesto del catálogo"""
+
+    def test_only_wines_are_indexed(self):
+        """Test de que solo se indexan documentos de tipo vino"""
+        catalog = _catalog()
+        assert len(catalog) == 6
+        assert "concepto" not in catalog
+
+    def test_budget_range_sorted_by_rating(self):
+        """Test de rango de precios con los mejor puntuados primero"""
+        catalog = _catalog()
+
+        wines = catalog.by_budget(min_price=15, max_price=30, k=3)
+
+        assert [wine["id"] for wine in wines] == ["ribera", "albarino", "jumilla"]
+
+    def test_wine_type_partition(self):
+        """Test de partición por tipo de vino (sin distinguir mayúsculas)"""
+        catalog = _catalog()
+
+        wines = catalog.by_budget(max_price=50, wine_type="tinto", k=10)
+
+        assert [wine["id"] for wine in wines] == ["rioja", "ribera", "jumilla"]
+        assert catalog.by_budget(max_price=50, wine_type="rosado") == []
+
+    def test_out_of_stock_is_skipped(self):
+        """Test de que los vinos sin stock no se recomiendan"""
+        catalog = _catalog()
+
+        assert "mencia" not in [wine["id"] for wine in catalog.by_budget(min_price=19, max_price=20)]
+        assert [wine["id"] for wine in catalog.by_budget(min_price=19, max_price=20, in_stock=False)] == ["mencia"]
+
+    def test_incremental_add_and_remove(self):
+        """Test de sincronización incremental con la ingesta"""
+        catalog = _catalog()
+        catalog.add(["godello"], [{"type": "vino", "wine_type": "Blanco", "price": 22.3, "rating": 90}])
+        catalog.add(["godello"], [{"type": "vino", "wine_type": "Blanco", "price": 1.0, "rating": 10}])
+
+        assert [wine["id"] for wine in catalog.by_budget(max_price=25, wine_type="blanco")] == ["godello", "albarino"]
+
+        catalog.remove(["godello", "albarino"])
+        assert catalog.by_budget(max_price=25, wine_type="blanco") == []
+        assert len(catalog) == 5
+
+
+class TestRegionIndex:
+    """Tests del índice de regiones y sus alias"""
+
+    def test_region_aliases_are_resolved(self):
+        """Test de resolución con acentos, prefijos y alias"""
+        catalog = _catalog()
+
+        assert catalog.resolve_region("Ribera") == ["Ribera del Duero"]
+        assert catalog.resolve_region("duero") == ["Ribera del Duero"]
+        assert catalog.resolve_region("rias baixas") == ["Rías Baixas"]
+        assert catalog.resolve_region("D.O. Penedes") == ["Penedès"]
+        assert catalog.resolve_region("Priorat") == []
+
+    def test_by_region_sorted_by_rating_with_style(self):
+        """Test de top-k por puntuación y filtro de estilo"""
+        catalog = _catalog()
+        catalog.add(["rioja_crianza"], [{"type": "vino", "name": "Rioja Crianza", "region": "D.O.Ca. Rioja", "rating": 86}])
+
+        assert [wine["id"] for wine in catalog.by_region("rioja")] == ["rioja", "rioja_crianza"]
+        assert [wine["id"] for wine in catalog.by_region("Rioja", style="crianza")] == ["rioja_crianza"]
+        assert [wine["id"] for wine in catalog.by_region("Rioja", k=1)] == ["rioja"]
+
+    def test_removed_region_disappears(self):
+        """Test de que una región sin vinos sale del índice"""
+        catalog = _catalog()
+        catalog.remove(["jumilla"])
+
+        assert catalog.resolve_region("Jumilla") == []
+        assert "Jumilla" not in catalog.regions()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,263 @@
+"""
+Tesauro de expansión de consultas
+Relaciones uva <-> región <-> tipo de vino <-> plato minadas sin conexión de
+vinos.json, conceptos_sumilleria.txt y consultas registradas, para expandir
+consultas en local sin llamar al LLM
+"""
+
+import json
+import logging
+import re
+from collections import Counter, defaultdict
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sparse_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+THESAURUS_FORMAT = 1
+
+# Pesos de cada fuente: lo redactado a mano pesa más que la coocurrencia
+_WEIGHT_CATALOG = 1
+_WEIGHT_CONCEPTS = 2
+_WEIGHT_SYNONYM = 3
+_WEIGHT_QUERY = 1
+
+WINE_TYPES = ("tinto", "blanco", "rosado", "espumoso", "dulce", "generoso")
+
+# Prefijo de las líneas de consulta en el log del servicio (/query)
+_QUERY_LOG_MARKER = "Received query: "
+
+def _singular(token: str) -> str:
+    """Plural regular a singular ("carnes" -> "carne"); basta con ser consistente"""
+    return token[:-1] if len(token) > 3 and token.endswith("s") else token
+
+def term_key(term: str) -> str:
+    """Clave normalizada de un término: sin acentos, palabras vacías ni plurales"""
+    return " ".join(_singular(token) for token in tokenize(term))
+
+def _split_list(text: str) -> List[str]:
+    """Elementos de una enumeración ("Tempranillo, Garnacha y Mazuelo")"""
+    return [item.strip(" .") for item in re.split(r",|\by\b|\be\b", text) if item.strip(" .")]
+
+class ThesaurusBuilder:
+    """Acumula relaciones ponderadas entre términos y genera el tesauro compacto"""
+
+    def __init__(self):
+        self._weights: Dict[str, Counter] = defaultdict(Counter)
+        self._display: Dict[str, str] = {}
+
+    def _term(self, term: str) -> Optional[str]:
+        key = term_key(term)
+        if not key:
+            return None
+        self._display.setdefault(key, term.strip())
+        return key
+
+    def relate(self, terms: Iterable[str], weight: int = 1):
+        """Relacionar todos los términos entre sí"""
+        keys = {key for key in (self._term(term) for term in terms) if key}
+        for a, b in combinations(sorted(keys), 2):
+            self._weights[a][b] += weight
+            self._weights[b][a] += weight
+
+    def relate_to(self, term: str, others: Iterable[str], weight: int = 1):
+        """Relacionar un término con cada uno de `others` (sin relacionarlos entre sí)"""
+        for other in others:
+            self.relate([term, other], weight)
+
+    # === FUENTES ===
+
+    def add_wines(self, wines: List[Dict]):
+        """Uvas, región y tipo de cada vino entre sí, y cada plato del maridaje con ellos"""
+        for wine in wines:
+            profile = _split_list(str(wine.get("grape", "")))
+            profile += [str(wine[field]).lower() if field == "type" else str(wine[field])
+                        for field in ("region", "type") if wine.get(field)]
+            self.relate(profile, _WEIGHT_CATALOG)
+            for dish in _split_list(str(wine.get("pairing", ""))):
+                self.relate_to(dish.lower(), profile, _WEIGHT_CATALOG)
+
+    def add_concepts(self, text: str):
+        """
+        Relaciones redactadas en el texto de conceptos de sumillería
+
+        - "### Vinos Tintos" + "Ejemplos: Tempranillo, ...": tipo <-> uvas
+        - "### Rioja" + "Variedades: ...": región <-> uvas
+        - "Tempranillo (Tinto Fino)": sinónimos
+        - "**Pescados**: Vinos blancos frescos": plato <-> tipo
+        """
+        section = ""
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith("### "):
+                section = line[4:].strip()
+                continue
+            if line.startswith("## "):
+                section = ""
+                continue
+
+            section_type = next((wine_type for wine_type in WINE_TYPES if wine_type in term_key(section).split()), None)
+            match = re.match(r"-\s*(Ejemplos|Variedad(?:es)?(?: principal)?)\s*:\s*(.+)", line, re.IGNORECASE)
+            if match and section:
+                anchor = section_type or section
+                for item in _split_list(match.group(2)):
+                    synonym = re.match(r"(.+?)\s*\((.+)\)", item)
+                    if synonym:
+                        self.relate([synonym.group(1), synonym.group(2)], _WEIGHT_SYNONYM)
+                        item = synonym.group(1)
+                    self.relate([anchor, item], _WEIGHT_CONCEPTS)
+                continue
+
+            match = re.match(r"-\s*\*\*(.+?)\*\*\s*:\s*Vinos?\s+(.+)", line, re.IGNORECASE)
+            if match:
+                wine_types = [wine_type for wine_type in WINE_TYPES if wine_type in term_key(match.group(2)).split()]
+                self.relate_to(match.group(1).lower(), wine_types, _WEIGHT_CONCEPTS)
+
+    def add_queries(self, queries: Iterable[str]):
+        """Términos ya conocidos que aparecen juntos en una misma consulta registrada"""
+        index = Thesaurus({key: [] for key in self._weights})
+        for query in queries:
+            keys = index.match(query)
+            self.relate([self._display[key] for key in keys], _WEIGHT_QUERY)
+
+    def build(self, max_related: int = 8) -> Dict:
+        """Tesauro compacto: clave normalizada -> términos relacionados (forma original), de más a menos peso"""
+        terms = {}
+        for key in sorted(self._weights):
+            related = sorted(self._weights[key].items(), key=lambda item: (-item[1], item[0]))[:max_related]
+            terms[key] = [self._display[other] for other, _ in related]
+        return {"format": THESAURUS_FORMAT, "terms": terms}
+
+def read_logged_queries(path: str) -> List[str]:
+    """Consultas de un fichero: una por línea o líneas del log del servicio ("Received query: ...")"""
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if _QUERY_LOG_MARKER in line:
+                line = line.split(_QUERY_LOG_MARKER, 1)[1]
+            elif " - " in line:
+                continue  # Otra línea del log
+            if line.strip():
+                queries.append(line.strip())
+    return queries
+
+class Thesaurus:
+    """
+    Expansión local de consultas
+
+    Los términos del tesauro se buscan en la consulta como n-gramas de sus
+    tokens normalizados; una palabra suelta ("carne") también encuentra los
+    términos que la contienen ("carnes rojas", "carnes asadas"). Cada
+    expansión añade a la consulta un término relacionado.
+    """
+
+    def __init__(self, terms: Dict[str, List[str]]):
+        self.terms = terms
+        self._max_tokens = max((len(key.split()) for key in terms), default=0)
+        self._by_token: Dict[str, List[str]] = defaultdict(list)
+        for key in terms:
+            for token in key.split():
+                self._by_token[token].append(key)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Thesaurus"]:
+        """Cargar un tesauro generado con scripts/build_thesaurus.py (None si no existe o no es válido)"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("format") != THESAURUS_FORMAT:
+                logger.warning(f"Formato de tesauro no soportado en {path}: {data.get('format')}")
+                return None
+            thesaurus = cls(data["terms"])
+            logger.info(f"📖 Tesauro cargado: {len(thesaurus)} términos desde {path}")
+            return thesaurus
+        except FileNotFoundError:
+            logger.info(f"Sin tesauro en {path}: la expansión usará el LLM")
+            return None
+        except Exception as e:
+            logger.error(f"Error cargando el tesauro {path}: {e}")
+            return None
+
+    def _match_groups(self, query: str) -> List[List[str]]:
+        """Términos de la consulta agrupados por posición: una frase completa o los términos que contienen una palabra suelta"""
+        tokens = [_singular(token) for token in tokenize(query)]
+        groups: List[Tuple[int, List[str]]] = []
+        covered = set()
+        # Frases completas, de la más larga a la más corta
+        for size in range(min(self._max_tokens, len(tokens)), 0, -1):
+            for start in range(len(tokens) - size + 1):
+                if covered.intersection(range(start, start + size)):
+                    continue
+                key = " ".join(tokens[start:start + size])
+                if key in self.terms:
+                    groups.append((start, [key]))
+                    covered.update(range(start, start + size))
+        # Palabras sueltas que forman parte de términos más largos
+        for position, token in enumerate(tokens):
+            if position not in covered and self._by_token.get(token):
+                groups.append((position, self._by_token[token]))
+        return [keys for _, keys in sorted(groups, key=lambda group: group[0])]
+
+    def match(self, query: str) -> List[str]:
+        """Claves del tesauro presentes en la consulta, en orden de aparición"""
+        return list(dict.fromkeys(key for keys in self._match_groups(query) for key in keys))
+
+    def _ranked_related(self, keys: List[str]) -> List[str]:
+        """Relacionados de varios términos fusionados por posición (los comunes a todos, primero)"""
+        if len(keys) == 1:
+            return list(self.terms[keys[0]])
+        scores: Counter = Counter()
+        for key in keys:
+            related = self.terms[key]
+            for rank, term in enumerate(related):
+                scores[term] += len(related) - rank
+        return [term for term, _ in sorted(scores.items(), key=lambda item: (-item[1], item[0]))]
+
+    def related(self, query: str, limit: int = 4) -> List[str]:
+        """Términos relacionados con los de la consulta, alternando entre términos, sin repetir"""
+        groups = self._match_groups(query)
+        queues = [self._ranked_related(keys) for keys in groups]
+        seen = {key for keys in groups for key in keys}
+        related: List[str] = []
+        while len(related) < limit and any(queues):
+            for queue in queues:
+                while queue:
+                    candidate = queue.pop(0)
+                    key = term_key(candidate)
+                    if key and key not in seen:
+                        seen.add(key)
+                        related.append(candidate)
+                        break
+                if len(related) == limit:
+                    break
+        return related
+
+    def expand(self, query: str, max_expansions: int = 4) -> List[str]:
+        """Variaciones de la consulta (sin incluirla), una por término relacionado"""
+        return [f"{query} {term}" for term in self.related(query, max_expansions)]
+
+def build_thesaurus(vinos_path: Optional[str] = None, conceptos_path: Optional[str] = None,
+                    query_paths: Iterable[str] = (), max_related: int = 8) -> Tuple[Dict, Dict[str, int]]:
+    """Construir el tesauro a partir de los ficheros de la base de conocimiento y de consultas"""
+    builder = ThesaurusBuilder()
+    stats = {"vinos": 0, "consultas": 0}
+    if vinos_path:
+        with open(vinos_path, 'r', encoding='utf-8') as f:
+            wines = json.load(f)
+        builder.add_wines(wines)
+        stats["vinos"] = len(wines)
+    if conceptos_path:
+        builder.add_concepts(Path(conceptos_path).read_text(encoding='utf-8'))
+    for path in query_paths:
+        queries = read_logged_queries(path)
+        builder.add_queries(queries)
+        stats["consultas"] += len(queries)
+    data = builder.build(max_related)
+    stats["terminos"] = len(data["terms"])
+    return data, stats
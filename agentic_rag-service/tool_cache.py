@@ -0,0 +1,101 @@
+"""
+Caché de resultados de herramientas MCP
+Resultados indexados por herramienta + argumentos canónicos, con TTL, LRU
+acotado e invalidación completa cuando cambia la base de conocimiento
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+class ToolResultCache:
+    """
+    Caché en memoria del texto devuelto por herramientas deterministas
+
+    Cada entrada guarda (instante de expiración, resultado). La invalidación
+    incrementa una generación: un resultado calculado antes de una escritura
+    en la base de conocimiento no se guarda aunque termine después.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600, max_items: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max_items
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.stats_counters = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'invalidations': 0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_items > 0
+
+    @property
+    def generation(self) -> int:
+        """Generación actual; se pasa a put() para descartar resultados obsoletos"""
+        return self._generation
+
+    @staticmethod
+    def key(tool: str, arguments: Dict[str, Any]) -> str:
+        """Clave estable: nombre de la herramienta y argumentos en JSON canónico"""
+        canonical = json.dumps(arguments or {}, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha256(f"{tool}\0{canonical}".encode("utf-8")).hexdigest()
+
+    def get(self, tool: str, arguments: Dict[str, Any]) -> Optional[Any]:
+        """Resultado cacheado y vigente, o None"""
+        if not self.enabled:
+            return None
+        key = self.key(tool, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats_counters['misses'] += 1
+                return None
+            expires_at, result = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.stats_counters['expired'] += 1
+                self.stats_counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats_counters['hits'] += 1
+            return result
+
+    def put(self, tool: str, arguments: Dict[str, Any], result: Any, generation: int = None):
+        """Guardar un resultado (se ignora si hubo una invalidación desde `generation`)"""
+        if not self.enabled:
+            return
+        key = self.key(tool, arguments)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Vaciar la caché (la base de conocimiento ha cambiado)"""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self.stats_counters['invalidations'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de aciertos/fallos y ocupación"""
+        with self._lock:
+            lookups = self.stats_counters['hits'] + self.stats_counters['misses']
+            return {
+                **self.stats_counters,
+                'hit_rate': round(self.stats_counters['hits'] / lookups, 4) if lookups else 0.0,
+                'items': len(self._entries),
+                'capacity': self.max_items,
+                'ttl_seconds': self.ttl_seconds
+            }
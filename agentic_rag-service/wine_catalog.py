@@ -0,0 +1,235 @@
+"""
+Índice en memoria del catálogo de vinos
+Listas ordenadas por precio y por puntuación, particionadas por tipo de vino,
+para responder consultas por presupuesto con búsqueda binaria (bisect), e
+índice región -> vinos con alias normalizados ("Ribera" -> "Ribera del Duero")
+"""
+
+import bisect
+import heapq
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sparse_index import fold_text, tokenize
+
+# Alias habituales de denominaciones de origen (claves y valores ya normalizados)
+REGION_ALIASES = {
+    "ribera": "ribera del duero",
+    "rias": "rias baixas",
+    "baixas": "rias baixas",
+    "rioja alavesa": "rioja",
+    "rioja alta": "rioja",
+    "rioja oriental": "rioja",
+    "cava": "penedes",
+    "priorato": "priorat",
+}
+
+# Prefijos que no forman parte del nombre de la región
+_REGION_PREFIXES = ("d o ca ", "d o q ", "d o ", "doca ", "doq ", "do ", "denominacion de origen ", "region ", "zona ")
+
+# Estilos de crianza detectados en el nombre del vino
+STYLES = ("gran reserva", "reserva", "crianza")
+
+def _region_key(region: Any) -> str:
+    """Nombre de región normalizado: sin acentos, signos ni prefijos tipo 'D.O.'"""
+    key = " ".join(re.findall(r"[a-z0-9]+", fold_text(str(region or ""))))
+    for prefix in _REGION_PREFIXES:
+        if key.startswith(prefix):
+            return key[len(prefix):]
+    return key
+
+def wine_style(name: Any) -> str:
+    """Estilo de crianza de un vino según su nombre: gran_reserva, reserva, crianza o joven"""
+    folded = fold_text(str(name or ""))
+    for style in STYLES:
+        if style in folded:
+            return style.replace(" ", "_")
+    return "joven"
+
+def _number(value: Any) -> Optional[float]:
+    """Valor numérico de un metadato, o None si falta o no es numérico"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+class WineCatalog:
+    """
+    Catálogo de vinos (documentos con metadata type == "vino")
+
+    Por cada partición (todos los vinos y cada tipo: "tinto", "blanco"...)
+    mantiene dos listas ordenadas de (clave, doc_id): por precio ascendente y
+    por puntuación descendente. Un rango de precios son dos bisect y el top-k
+    por puntuación se elige recorriendo la lista más corta.
+
+    Por región normalizada guarda sus vinos ordenados por puntuación, y cada
+    palabra significativa del nombre de la región ("ribera", "duero") es un
+    alias más, así que una recomendación por región es una consulta a un dict.
+    """
+
+    ALL = "*"
+
+    def __init__(self):
+        self._wines: Dict[str, Dict[str, Any]] = {}
+        self._by_price: Dict[str, List[Tuple[float, str]]] = {}
+        self._by_rating: Dict[str, List[Tuple[float, str]]] = {}
+        self._by_region: Dict[str, List[Tuple[float, str]]] = {}
+        self._region_names: Dict[str, str] = {}  # Región normalizada -> nombre original
+        self._region_tokens: Dict[str, set] = {}  # Palabra -> regiones normalizadas que la contienen
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._wines)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._wines
+
+    @staticmethod
+    def _type_key(wine_type: Any) -> str:
+        return fold_text(str(wine_type or "")).strip()
+
+    def _partitions(self, metadata: Dict[str, Any]) -> List[str]:
+        wine_type = self._type_key(metadata.get("wine_type"))
+        return [self.ALL, wine_type] if wine_type else [self.ALL]
+
+    def add(self, doc_ids: Iterable[str], metadatas: Iterable[Dict[str, Any]]):
+        """Incorporar los vinos de un lote de documentos (los demás tipos se ignoran)"""
+        with self._lock:
+            touched = set()
+            touched_regions = set()
+            for doc_id, metadata in zip(doc_ids, metadatas):
+                metadata = metadata or {}
+                if metadata.get("type") != "vino" or doc_id in self._wines:
+                    continue
+                self._wines[doc_id] = {"id": doc_id, **metadata}
+                price = _number(metadata.get("price"))
+                rating = _number(metadata.get("rating")) or 0.0
+                for partition in self._partitions(metadata):
+                    if price is not None:
+                        self._by_price.setdefault(partition, []).append((price, doc_id))
+                    self._by_rating.setdefault(partition, []).append((-rating, doc_id))
+                    touched.add(partition)
+
+                region = _region_key(metadata.get("region"))
+                if region:
+                    self._by_region.setdefault(region, []).append((-rating, doc_id))
+                    self._region_names.setdefault(region, metadata.get("region"))
+                    for token in tokenize(region):
+                        self._region_tokens.setdefault(token, set()).add(region)
+                    touched_regions.add(region)
+
+            # Un lote se ordena una sola vez (timsort aprovecha el tramo ya ordenado)
+            for partition in touched:
+                self._by_price.get(partition, []).sort()
+                self._by_rating[partition].sort()
+            for region in touched_regions:
+                self._by_region[region].sort()
+
+    def remove(self, doc_ids: Iterable[str]):
+        """Eliminar vinos del catálogo"""
+        with self._lock:
+            removed = {doc_id for doc_id in doc_ids if doc_id in self._wines}
+            if not removed:
+                return
+            touched = set()
+            touched_regions = set()
+            for doc_id in removed:
+                metadata = self._wines.pop(doc_id)
+                touched.update(self._partitions(metadata))
+                touched_regions.add(_region_key(metadata.get("region")))
+            for partition in touched:
+                for index in (self._by_price, self._by_rating):
+                    if partition in index:
+                        index[partition] = [entry for entry in index[partition] if entry[1] not in removed]
+            for region in touched_regions.intersection(self._by_region):
+                self._by_region[region] = [entry for entry in self._by_region[region] if entry[1] not in removed]
+                if not self._by_region[region]:
+                    # Región sin vinos: fuera del índice y de los alias
+                    del self._by_region[region]
+                    del self._region_names[region]
+                    for token in tokenize(region):
+                        self._region_tokens[token].discard(region)
+                        if not self._region_tokens[token]:
+                            del self._region_tokens[token]
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return self._wines.get(doc_id)
+
+    def by_budget(self, min_price: float = None, max_price: float = None, wine_type: str = None,
+                  k: int = 3, in_stock: bool = True) -> List[Dict[str, Any]]:
+        """
+        Top-k vinos por puntuación dentro de un rango de precios
+
+        Los vinos sin precio numérico no entran en ningún rango. Con in_stock,
+        se descartan los vinos con stock 0 (un stock desconocido no descarta).
+        """
+        partition = self._type_key(wine_type) if wine_type else self.ALL
+        low = float("-inf") if min_price is None else min_price
+        high = float("inf") if max_price is None else max_price
+
+        with self._lock:
+            by_price = self._by_price.get(partition, [])
+            start = bisect.bisect_left(by_price, low, key=lambda entry: entry[0])
+            end = bisect.bisect_right(by_price, high, key=lambda entry: entry[0])
+
+            def available(doc_id: str) -> bool:
+                return not in_stock or _number(self._wines[doc_id].get("stock")) != 0
+
+            by_rating = self._by_rating.get(partition, [])
+            if end - start > len(by_rating) // 2:
+                # Rango amplio: recorrer por puntuación y quedarse con los k primeros en rango
+                selected = []
+                for _, doc_id in by_rating:
+                    price = _number(self._wines[doc_id].get("price"))
+                    if price is not None and low <= price <= high and available(doc_id):
+                        selected.append(doc_id)
+                        if len(selected) == k:
+                            break
+            else:
+                # Rango estrecho: top-k por puntuación dentro del tramo de precios
+                in_range = [doc_id for _, doc_id in by_price[start:end] if available(doc_id)]
+                selected = heapq.nsmallest(k, in_range, key=lambda doc_id: (-(_number(self._wines[doc_id].get("rating")) or 0.0), doc_id))
+
+            return [self._wines[doc_id] for doc_id in selected]
+
+    def resolve_region(self, region: str) -> List[str]:
+        """
+        Regiones del catálogo (nombre original) que corresponden a un texto
+
+        Orden de resolución: nombre exacto normalizado, tabla de alias y
+        palabras del nombre de la región. Puede devolver varias si es ambiguo.
+        """
+        key = _region_key(region)
+        with self._lock:
+            if key in self._by_region:
+                return [self._region_names[key]]
+            alias = REGION_ALIASES.get(key)
+            if alias in self._by_region:
+                return [self._region_names[alias]]
+
+            # Regiones que contienen todas las palabras significativas de la consulta
+            tokens = tokenize(key)
+            if not tokens:
+                return []
+            matches = set.intersection(*(self._region_tokens.get(token, set()) for token in tokens))
+            return sorted(self._region_names[match] for match in matches)
+
+    def regions(self) -> List[str]:
+        """Nombres de todas las regiones con vinos en el catálogo"""
+        with self._lock:
+            return sorted(self._region_names.values())
+
+    def by_region(self, region: str, k: int = 5, style: str = None) -> List[Dict[str, Any]]:
+        """Top-k vinos por puntuación de las regiones que corresponden a `region`"""
+        keys = [_region_key(name) for name in self.resolve_region(region)]
+        with self._lock:
+            ranked = heapq.merge(*(self._by_region[key] for key in keys if key in self._by_region))
+            selected = []
+            for _, doc_id in ranked:
+                wine = self._wines[doc_id]
+                if style and style != "cualquiera" and wine_style(wine.get("name")) != style:
+                    continue
+                selected.append(wine)
+                if len(selected) == k:
+                    break
+            return selected